@@ -9,25 +9,29 @@
 # Short-Description: Manage the local photo server
 ### END INIT INFO
 
+CHECKOUT_DIR="[[ CHECKOUT DIR ]]"
 
 case "$1" in 
     start)
         echo "Starting photofloat"
-	cd [[ CHECKOUT DIR ]]
+	cd "$CHECKOUT_DIR" || exit 1
 	source venv/bin/activate
-	cd scanner
+	cd scanner || exit 1
         gunicorn \
 		--bind=unix:/var/run/photofloat.socket \
 		--pid=/var/run/photofloat.pid \
 		--capture-output \
-		--workers 1 \   # this is necessary
+		--workers 4 \
 		--timeout 120 \
 		--log-file=/var/log/gunicron-photofloat.log \
 		floatapp:app &
+	"$CHECKOUT_DIR/scanner/worker.py" --config "$CHECKOUT_DIR/scanner/floatapp/app.cfg" -j 1 >> /var/log/photofloat-worker.log 2>&1 &
+	echo $! > /var/run/photofloat-worker.pid
 	exit 0
         ;;
     stop)
         kill `cat /var/run/photofloat.pid`
+        kill `cat /var/run/photofloat-worker.pid`
 	exit 0
         ;;
     *)
@@ -1,17 +1,76 @@
 import os.path
 from datetime import datetime
+import atexit
+import fcntl
+import functools
+import gzip
+import hashlib
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+from ScanStats import timed
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-def message(category, text):
-    if message.level <= 0:
-        sep = "  "
+# Logging goes through a queue to a thread that formats and writes it, so the
+# scan never waits on its output. Each category has a level: per-file events are
+# DEBUG and per-directory ones INFO, both hidden by default; the run's own events
+# are NOTICE, and problems WARNING.
+NOTICE = 25
+logging.addLevelName(NOTICE, "NOTICE")
+log = logging.getLogger("photofloat")
+log.propagate = False
+file_categories = set(["cache hit", "resumed", "metainfo", "thumbing", "linking", "duplicate", "cleanup", "remove_stale_walk"])
+directory_categories = set(["walking", "full cache", "partial cache", "caching", "unchanged", "empty"])
+problem_categories = set(["error", "corrupt cache", "corrupt image", "unreadable", "save failure", "access denied",
+                          "link failure", "folder failure", "unlink failure", "watch failure"])
+def category_level(category):
+    if category in file_categories:
+        return logging.DEBUG
+    if category in directory_categories:
+        return logging.INFO
+    if category in problem_categories:
+        return logging.WARNING
+    return NOTICE
+def setup_logging(level=NOTICE, buffered=True):
+    # A listener inherited across a fork has no thread in this process to stop.
+    if setup_logging.listener is not None and setup_logging.pid == os.getpid():
+        setup_logging.listener.stop()
+    setup_logging.listener = None
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    if buffered:
+        records = queue.SimpleQueue()
+        setup_logging.listener = logging.handlers.QueueListener(records, output)
+        setup_logging.listener.start()
+        log.addHandler(logging.handlers.QueueHandler(records))
     else:
-        sep = "--"
-    print("%s %s%s[%s]%s%s" % (datetime.now().isoformat(), max(0, message.level) * "  |", sep, category, max(1, (14 - len(category))) * " ", text))
-message.level = 0
-def next_level():
-    message.level += 1
-def back_level():
-    message.level -= 1
+        log.addHandler(output)
+    log.setLevel(level)
+    setup_logging.pid = os.getpid()
+setup_logging.listener = None
+setup_logging.pid = None
+@atexit.register
+def flush_logging():
+    if setup_logging.listener is not None and setup_logging.pid == os.getpid():
+        setup_logging.listener.stop()
+        setup_logging.listener = None
+def message(category, text):
+    if setup_logging.pid != os.getpid():
+        # Not set up yet, or inherited across a fork without the listener thread:
+        # pool workers can be terminated at any time, so they write straight out.
+        inherited = setup_logging.pid is not None
+        setup_logging(log.level if inherited else NOTICE, buffered=not inherited)
+    level = category_level(category)
+    if log.isEnabledFor(level):
+        log.log(level, "[%s]%s%s", category, max(1, (14 - len(category))) * " ", text)
 def set_cache_path_base(base):
     trim_base.base = base
 def untrim_base(path):
@@ -24,26 +83,139 @@ def trim_base_custom(path, base):
     return path
 def trim_base(path):
     return trim_base_custom(path, trim_base.base)
-def cache_base(path, withoutslash=True):
-    path = trim_base(path)
+# The munging of cache_base, which PhotoFloat.cachePath in the web page repeats:
+# spaces to underscores, some punctuation dropped, lower case, and runs of dashes
+# or of underscores squeezed to one.
+munge_dropped = re.compile(r"[()&,#\[\]\"']")
+munge_runs = re.compile(r"--+|__+")
+@functools.lru_cache(maxsize=65536)
+def munge(path, withoutslash=True):
     if withoutslash:
         path = path.replace('/', '-')
-    path = path.replace(' ', '_').replace('(', '').replace('&', '').replace(',', '').replace(')', '').replace('#', '').replace('[', '').replace(']', '').replace('"', '').replace("'", '').replace('_-_', '-').lower()
-    while path.find("--") != -1:
-        path = path.replace("--", "-")
-    while path.find("__") != -1:
-        path = path.replace("__", "_")
+    path = munge_dropped.sub("", path.replace(' ', '_')).replace('_-_', '-').lower()
+    if "--" in path or "__" in path:
+        path = munge_runs.sub(lambda match: match.group(0)[0], path)
     if len(path) == 0:
         path = "root"
     return path
+def cache_base(path, withoutslash=True):
+    return munge(trim_base(path), withoutslash)
 def json_cache(path):
     return cache_base(path) + ".json"
-def image_cache(path, size, square=False, withoutslash=True, suffix=None):
+def json_page(path, page):
+    # Page files of an album too large for one JSON file, next to its own.
+    return path[:-len(".json")] + ".page%d.json" % page
+def json_variants(path):
+    # What write_json puts next to a JSON file: compressed copies and its ETag.
+    return [path + ".gz", path + ".br", path + ".etag"]
+def image_cache(path, size, square=False, withoutslash=True, suffix=None, ext="jpg"):
     if square:
         suffix = str(size) + "s"
     else: 
         suffix = suffix if suffix else ''
         suffix = str(size) + suffix
-    return cache_base(path, withoutslash) + "_" + suffix + ".jpg"
-def file_mtime(path):
-    return datetime.fromtimestamp(int(os.path.getmtime(path)))
+    return cache_base(path, withoutslash) + "_" + suffix + "." + ext
+def hash_cache(digest, size, square=False, suffix=None, ext="jpg"):
+    # Content-addressed thumbnails, shared by every copy of the same original.
+    if square:
+        suffix = str(size) + "s"
+    else:
+        suffix = suffix if suffix else ''
+        suffix = str(size) + suffix
+    return "objects/" + digest[:2] + "/" + digest + "_" + suffix + "." + ext
+def hash_cache_digest(entry):
+    # The digest of a hash_cache entry, or None for any other cache entry.
+    if not entry.startswith("objects/"):
+        return None
+    return os.path.basename(entry).split("_", 1)[0]
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+# Each stat is timed as the "stat" stage, whose count is then the number of stat
+# calls, including those of photos built in pool workers (see ScanStats).
+def file_stat(path):
+    with timed("stat"):
+        return os.stat(path)
+def entry_stat(entry):
+    # Only called once per os.scandir entry; the DirEntry caches the result.
+    with timed("stat"):
+        return entry.stat()
+def file_mtime(path, stat_result=None):
+    if stat_result is None:
+        stat_result = file_stat(path)
+    return datetime.fromtimestamp(int(stat_result.st_mtime))
+# Held by whatever writes album JSON and the photo lists (a scan, or an ingest)
+# until it is done; closing the returned file releases it.
+lock_file = ".lock"
+def cache_lock(cache_path):
+    fp = open(os.path.join(cache_path, lock_file), "a")
+    fcntl.flock(fp, fcntl.LOCK_EX)
+    return fp
+class AtomicFile(object):
+    # A file written under a temporary name and renamed over path once complete,
+    # so readers, and the next scan after a crash, see the old contents or the
+    # new ones, never part of a write. Closing it without commit() drops it.
+    # With sync, the data and the rename are on disk before commit() returns.
+    sync = False
+    # What a killed writer leaves behind; with the cache lock held, no one else is writing.
+    leftover = re.compile(r"^\..+\.[0-9]+\.tmp$")
+    def __init__(self, path, mode="wb"):
+        self.path = path
+        self.temp = os.path.join(os.path.dirname(path), ".%s.%d.tmp" % (os.path.basename(path), os.getpid()))
+        self.fp = open(self.temp, mode)
+    def commit(self):
+        if AtomicFile.sync:
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+        self.fp.close()
+        os.replace(self.temp, self.path)
+        if AtomicFile.sync:
+            sync_directory(os.path.dirname(self.path))
+    def close(self):
+        if not self.fp.closed:
+            self.fp.close()
+            try:
+                os.unlink(self.temp)
+            except FileNotFoundError:
+                pass
+    def __enter__(self):
+        return self.fp
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.commit()
+        else:
+            self.close()
+def sync_directory(path):
+    fd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+def atomic_write(path, data):
+    with AtomicFile(path) as fp:
+        fp.write(data)
+def write_json(path, text):
+    # The ETag is written last, so it never names contents that are not there yet.
+    # Contents it already names are only touched, as the scan compares the JSON's
+    # mtime with the directory's, and are not compressed again.
+    data = text.encode("utf-8")
+    etag = hashlib.blake2b(data, digest_size=16).hexdigest().encode("ascii")
+    try:
+        with open(path + ".etag", "rb") as fp:
+            if fp.read() == etag and os.path.exists(path + ".gz") and os.path.exists(path + ".br") == (brotli is not None):
+                os.utime(path)
+                return
+    except FileNotFoundError:
+        pass
+    atomic_write(path, data)
+    atomic_write(path + ".gz", gzip.compress(data, 9, mtime=0))
+    if brotli is not None:
+        atomic_write(path + ".br", brotli.compress(data, quality=write_json.brotli_quality))
+    elif os.path.exists(path + ".br"):
+        os.unlink(path + ".br")
+    atomic_write(path + ".etag", etag)
+# Brotli's default of 11 is several times slower than gzip -9 for a few percent less.
+write_json.brotli_quality = 5
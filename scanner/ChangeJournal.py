@@ -0,0 +1,42 @@
+import fcntl
+import os
+import os.path
+
+# Directories (trimmed paths, one per line) that changed since the last scan.
+# The watcher appends to the journal; a scan moves its contents to the
+# processing file and only removes that once the scan has completed.
+journal_file = ".dirty.journal"
+processing_file = journal_file + ".processing"
+
+def journal_entries():
+    return [journal_file, processing_file]
+
+def record_dirty(cache_path, paths):
+    if len(paths) == 0:
+        return
+    with open(os.path.join(cache_path, journal_file), "a") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        fp.write("".join((path or ".") + "\n" for path in paths))
+        fp.flush()
+
+def take_dirty(cache_path):
+    journal = os.path.join(cache_path, journal_file)
+    processing = os.path.join(cache_path, processing_file)
+    if os.path.exists(journal):
+        with open(journal, "r+") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            with open(processing, "a") as out:
+                out.write(fp.read())
+                out.flush()
+                os.fsync(out.fileno())
+            fp.truncate(0)
+    if not os.path.exists(processing):
+        return set()
+    with open(processing, "r") as fp:
+        return set(line.rstrip("\n") for line in fp if line != "\n")
+
+def clear_dirty(cache_path):
+    try:
+        os.unlink(os.path.join(cache_path, processing_file))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,186 @@
+from PIL import Image, TiffTags
+from PIL.ExifTags import TAGS
+from PIL.TiffImagePlugin import IFDRational
+import re
+import struct
+
+# Reads the EXIF fields Photo._metadata uses, and the size, from the headers of
+# a JPEG, without opening it with Pillow. Only the IFD entries of those fields
+# are decoded, into the same values Pillow's _getexif gives for them. Anything
+# out of the ordinary (other formats, MPO, truncated or unusual data) is left to
+# Pillow: read_metadata and exif_tags then return None.
+
+names = ["Orientation", "Make", "Model", "ApertureValue", "FNumber", "FocalLength", "ISOSpeedRatings", "ISO",
+         "PhotographicSensitivity", "ExposureTime", "Flash", "LightSource", "ExposureProgram", "SpectralSensitivity",
+         "MeteringMode", "SensingMethod", "SceneCaptureType", "SubjectDistanceRange", "ExposureCompensation",
+         "ExposureBiasValue", "DateTimeOriginal", "DateTime"]
+wanted = frozenset(tag for tag, name in TAGS.items() if name in names)
+exif_ifd = 0x8769
+orientation_tag = 0x0112
+xmp_orientation = re.compile(rb'tiff:Orientation(="|>)([0-9])')
+# Segments Pillow knows before the scan, and those of them that give the frame size.
+markers = frozenset(range(0xffc0, 0xfff0)) - frozenset([0xffc8, 0xffd8, 0xffd9]) - frozenset(range(0xffd0, 0xffd8)) | frozenset([0xfffe])
+frames = frozenset(range(0xffc0, 0xffd0)) - frozenset([0xffc4, 0xffc8, 0xffcc]) | frozenset([0xffde])
+read_markers = frames | frozenset([0xffdb, 0xffe1, 0xffe2, 0xffed, 0xffee])
+
+# Entry types decoded, as (struct format of one value, its size); the rest go to Pillow.
+types = { 2: ("s", 1), 3: ("H", 2), 4: ("L", 4), 5: ("L", 8), 8: ("h", 2), 9: ("l", 4), 10: ("l", 8) }
+
+# Sizes of every type Pillow reads: an entry of any of them whose data is cut
+# short makes Pillow drop the rest of its IFD.
+units = { 1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4, 16: 8 }
+
+class Unsupported(Exception):
+    pass
+
+def entry_value(tiff, endian, tag, type, count, field, group):
+    format, unit = types[type]
+    size = count * unit
+    if size > 4:
+        (offset,) = struct.unpack(endian + "L", field)
+        data = tiff[offset:offset + size]
+    else:
+        data = field[:size]
+    if len(data) != size or not data:
+        # Pillow skips these with a warning.
+        raise Unsupported()
+    info = TiffTags.lookup(tag, group)
+    if type == 2:
+        if data.endswith(b"\0"):
+            data = data[:-1]
+        return info.cvt_enum(data.decode("latin-1", "replace"))
+    if type in (5, 10):
+        numbers = struct.unpack("%s%d%s" % (endian, count * 2, format), data)
+        values = tuple(IFDRational(numerator, denominator) for numerator, denominator in zip(numbers[::2], numbers[1::2]))
+    else:
+        values = struct.unpack("%s%d%s" % (endian, count, format), data)
+    # Fields specified as single values, and single values, are not tuples.
+    if len(values) == 1 or info.length == 1:
+        return values[0]
+    return values
+
+def read_ifd(tiff, endian, offset, group, tags, pointers=()):
+    # Adds the wanted entries of the IFD at offset to tags; returns the
+    # values of the pointers entries, which are read whatever their type.
+    found = dict()
+    if offset < 0 or offset + 2 > len(tiff):
+        raise Unsupported()
+    (count,) = struct.unpack_from(endian + "H", tiff, offset)
+    if offset + 2 + count * 12 + 4 > len(tiff):
+        raise Unsupported()
+    for index in range(count):
+        tag, type, number, field = struct.unpack_from(endian + "HHL4s", tiff, offset + 2 + index * 12)
+        if type in units and number * units[type] > 4 and struct.unpack(endian + "L", field)[0] + number * units[type] > len(tiff):
+            raise Unsupported()
+        if tag not in wanted and tag not in pointers:
+            continue
+        if type not in types or number == 0:
+            raise Unsupported()
+        value = entry_value(tiff, endian, tag, type, number, field, group)
+        if tag in pointers:
+            found[tag] = value
+        if tag in wanted:
+            tags[tag] = value
+    return found
+
+def exif_tags(exif, xmp=None):
+    # The wanted tags of an APP1 Exif payload (as Pillow keeps it in info["exif"]),
+    # by tag number, with the orientation from the XMP if the EXIF has none.
+    tags = dict()
+    if exif is None:
+        return tags
+    try:
+        while exif.startswith(b"Exif\0\0"):
+            exif = exif[6:]
+        if exif:
+            if exif[:4] == b"II*\0":
+                endian = "<"
+            elif exif[:4] == b"MM\0*":
+                endian = ">"
+            else:
+                return None
+            (offset,) = struct.unpack_from(endian + "L", exif, 4)
+            found = read_ifd(exif, endian, offset, None, tags, (exif_ifd,))
+            if exif_ifd in found:
+                if not isinstance(found[exif_ifd], int):
+                    return None
+                # As in Pillow, the Exif IFD's entries win over IFD0's.
+                details = dict()
+                read_ifd(exif, endian, found[exif_ifd], exif_ifd, details)
+                tags.update(details)
+    except (Unsupported, struct.error):
+        return None
+    if orientation_tag not in tags and xmp:
+        match = xmp_orientation.search(xmp)
+        if match:
+            tags[orientation_tag] = int(match[2])
+    return tags
+
+def segments(fp):
+    # (marker, payload) of the JPEG segments before the scan starts; payloads
+    # the reader has no use for are skipped rather than read, and are None.
+    if fp.read(3) != b"\xff\xd8\xff":
+        raise Unsupported()
+    marker = 0xff00 | fp.read(1)[0]
+    while True:
+        while marker == 0xffff:
+            # Fill bytes.
+            marker = 0xff00 | fp.read(1)[0]
+        if marker not in markers:
+            raise Unsupported()
+        (length,) = struct.unpack(">H", fp.read(2))
+        if length < 2:
+            raise Unsupported()
+        if marker in read_markers or marker == 0xffda:
+            payload = fp.read(length - 2)
+            if len(payload) != length - 2:
+                raise Unsupported()
+        else:
+            fp.seek(length - 2, 1)
+            payload = None
+        if marker == 0xffda:
+            return
+        yield marker, payload
+        prefix = fp.read(2)
+        if len(prefix) != 2 or prefix[0] != 0xff:
+            raise Unsupported()
+        marker = 0xff00 | prefix[1]
+
+def read_metadata(path):
+    # (size, exif_tags) of the JPEG at path, or None to leave it to Pillow.
+    size = None
+    exif = None
+    xmp = None
+    try:
+        with open(path, "rb") as fp:
+            for marker, payload in segments(fp):
+                if marker in frames:
+                    # Pillow only opens 8 bit greyscale, RGB and CMYK frames.
+                    if len(payload) < 6 or payload[0] != 8 or payload[5] not in (1, 3, 4):
+                        raise Unsupported()
+                    size = struct.unpack_from(">HH", payload, 1)[::-1]
+                elif marker == 0xffdb:
+                    while payload:
+                        length = 65 if payload[0] // 16 == 0 else 129
+                        if len(payload) < length:
+                            raise Unsupported()
+                        payload = payload[length:]
+                elif marker == 0xffe1 and payload.startswith(b"Exif\0\0"):
+                    exif = payload if exif is None else exif + payload[6:]
+                elif marker == 0xffe1 and payload.startswith(b"http://ns.adobe.com/xap/1.0/\0"):
+                    xmp = payload.split(b"\0", 1)[1]
+                elif marker == 0xffe2 and payload.startswith(b"MPF\0"):
+                    # Pillow opens these as MPO, which reads the EXIF its own way.
+                    raise Unsupported()
+                elif marker == 0xffed and payload.startswith(b"Photoshop 3.0\0"):
+                    raise Unsupported()
+                elif marker == 0xffee and payload.startswith(b"Adobe") and len(payload) < 7:
+                    raise Unsupported()
+    except (Unsupported, OSError, IndexError, struct.error):
+        return None
+    if size is None or (Image.MAX_IMAGE_PIXELS and size[0] * size[1] > Image.MAX_IMAGE_PIXELS):
+        return None
+    tags = exif_tags(exif, xmp)
+    if tags is None:
+        return None
+    return size, tags
@@ -0,0 +1,161 @@
+from CachePath import *
+from PhotoAlbum import Photo, Album, PhotoAlbumEncoder, read_album_json, write_album_json, write_album_schema, schema_file, date_format
+from PhotoList import splice_photos
+from ScanIndex import ScanIndex
+from collections import OrderedDict
+from datetime import datetime
+import json
+import os
+import os.path
+import traceback
+
+# Adds new (or replaced) photos to the cache without walking the tree: their
+# thumbnails are made, their albums' JSON gets the photos, the albums above
+# them get the new dates, and the photos are spliced into the photo lists. A
+# batch writes each album, each photo list shard and the index once, however
+# many of its photos they take.
+
+# Albums are patched in schema 1 form, with all their photos, however they are stored.
+
+def parse_date(value):
+    return datetime.strptime(value, date_format)
+
+def read_album(cache_path, album_path):
+    try:
+        return read_album_json(os.path.join(cache_path, json_cache(album_path)))
+    except FileNotFoundError:
+        return { "path": album_path, "date": None, "albums": [], "photos": [] }
+
+def settle_album(album):
+    # Same order and date as Album.to_dict would give.
+    album["photos"].sort(key=lambda photo: (parse_date(photo["date"]), photo["name"]))
+    album["albums"].sort(key=lambda sub: parse_date(sub["date"]))
+    dates = [parse_date(item["date"]) for item in album["photos"][-1:] + album["albums"][-1:]]
+    album["date"] = max(dates).strftime(date_format)
+
+def write_album(cache_path, album):
+    settle_album(album)
+    album["thumbs"] = { "sizes": [ [size[0], size[1]] for size in Photo.thumb_sizes ], "formats": Photo.thumb_formats }
+    if Album.schema == 2 and not os.path.exists(os.path.join(cache_path, schema_file)):
+        write_album_schema(cache_path)
+    write_album_json(cache_path, json_cache(album["path"]), album)
+
+def remove_hash_caches(cache_path, photo):
+    for entry in photo.image_caches:
+        fullpath = os.path.join(cache_path, entry)
+        if os.path.isfile(fullpath):
+            message("cleanup", "Removing stale file " + fullpath)
+            os.unlink(fullpath)
+            directory = os.path.dirname(fullpath)
+            if len(os.listdir(directory)) == 0:
+                os.rmdir(directory)
+
+def album_depth(album_path):
+    return album_path.count("/") + 1 if album_path else 0
+
+def patch_albums(cache_path, photos):
+    # Puts photos into their albums, and the albums' new dates into the albums
+    # above, deepest first so each album is patched fully before its parent.
+    # Returns the albums to write, by path, and the date each photo was listed
+    # under before, if it was.
+    albums = dict()
+    old_dates = dict()
+    for photo in photos:
+        album_path = trim_base(os.path.dirname(photo.path))
+        if album_path not in albums:
+            albums[album_path] = read_album(cache_path, album_path)
+        album = albums[album_path]
+        for item in album["photos"]:
+            if item["name"] == photo.name:
+                old_dates[photo.path] = parse_date(item["date"])
+        album["photos"] = [item for item in album["photos"] if item["name"] != photo.name]
+        album["photos"].append(json.loads(json.dumps(photo, cls=PhotoAlbumEncoder)))
+    # Each album above only lists its sub-albums' paths and dates.
+    for depth in range(max(album_depth(path) for path in albums), 0, -1):
+        for child in [album for path, album in albums.items() if album_depth(path) == depth]:
+            settle_album(child)
+            parent_path = os.path.dirname(child["path"])
+            parent = albums.get(parent_path)
+            if parent is None:
+                parent = read_album(cache_path, parent_path)
+            name = trim_base_custom(child["path"], parent["path"])
+            entries = [sub for sub in parent["albums"] if sub["path"] == name]
+            if entries and entries[0]["date"] == child["date"]:
+                continue
+            parent["albums"] = [sub for sub in parent["albums"] if sub["path"] != name]
+            parent["albums"].append({ "path": name, "date": child["date"] })
+            albums[parent_path] = parent
+    return albums, old_dates
+
+def ingest_batch(paths, album_base, cache_path, progress=None):
+    # Ingests every readable photo of paths; progress(done), if given, hears of
+    # each one thumbnailed. Returns the photos, and the paths that failed.
+    album_base = os.path.abspath(album_base)
+    cache_path = os.path.abspath(cache_path)
+    set_cache_path_base(album_base)
+    lock = cache_lock(cache_path)
+    try:
+        made = OrderedDict()
+        failed = []
+        for done, path in enumerate(paths):
+            path = os.path.abspath(path)
+            message("ingesting", trim_base(path))
+            try:
+                photo = Photo(path, cache_path)
+            except KeyboardInterrupt:
+                raise
+            except:
+                traceback.print_exc()
+                photo = None
+            if photo is not None and photo.is_valid:
+                # Uploaded twice, the later copy is the one on disk.
+                made.pop(path, None)
+                made[path] = photo
+            else:
+                message("unreadable photo", trim_base(path))
+                failed.append(path)
+            if progress:
+                progress(done + 1)
+        photos = list(made.values())
+        if not photos:
+            return photos, failed
+
+        albums, old_dates = patch_albums(cache_path, photos)
+        for album in albums.values():
+            write_album(cache_path, album)
+        splice_photos(cache_path, [(photo.path, photo.date, old_dates.get(photo.path)) for photo in photos])
+
+        if os.path.exists(os.path.join(cache_path, ScanIndex.filename)):
+            # The index learns of the photos and the new album dates, so the next scan
+            # need not rebuild them. The directories keep their recorded mtimes (new ones
+            # get none), so that scan still re-lists them.
+            index = ScanIndex(cache_path)
+            try:
+                replaced = []
+                for path, photo in made.items():
+                    old_attributes = index.file_attributes(photo.path)
+                    index.update_file(photo, trim_base(os.path.dirname(path)), ScanIndex.state(file_stat(path)), Photo.thumb_spec())
+                    if old_attributes and "hash" in old_attributes and old_attributes["hash"] != photo.attributes.get("hash"):
+                        replaced.append((path, old_attributes))
+                for path, old_attributes in replaced:
+                    if index.hash_refs(old_attributes["hash"]) == 0:
+                        # Scans will take the new photo as current, so they would never
+                        # drop the thumbnails of what it replaced.
+                        remove_hash_caches(cache_path, Photo.from_index(path, old_attributes, None))
+                for album in albums.values():
+                    parent = os.path.dirname(album["path"]) if album["path"] != "" else None
+                    summary = Album.from_summary(album["path"], parse_date(album["date"]), False)
+                    index.update_album(summary, index.album_mtime(album["path"]) or 0, parent)
+            finally:
+                index.close()
+        for photo in photos:
+            message("ingested", photo.path)
+        return photos, failed
+    finally:
+        lock.close()
+
+def ingest(path, album_base, cache_path):
+    photos, failed = ingest_batch([path], album_base, cache_path)
+    if failed:
+        raise ValueError("unreadable photo: %s" % path)
+    return photos[0]
@@ -0,0 +1,112 @@
+import json
+import os
+import os.path
+import socket
+import sqlite3
+import time
+
+class JobQueue(object):
+    # Jobs for worker.py, queued by FloatApp. Kept in the cache directory, the one
+    # place both of them are configured with and may write to. One connection per thread.
+    filename = ".jobs.sqlite"
+    def __init__(self, cache_path):
+        self._db = sqlite3.connect(os.path.join(cache_path, JobQueue.filename), timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT NOT NULL,
+                args TEXT NOT NULL,
+                state TEXT NOT NULL,
+                worker TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL,
+                done INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+        """)
+        # Queues from before progress was tracked lack its columns.
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+        if "done" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN done INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("ALTER TABLE jobs ADD COLUMN total INTEGER NOT NULL DEFAULT 1")
+    @staticmethod
+    def cache_entries():
+        return [JobQueue.filename + suffix for suffix in ("", "-wal", "-shm", "-journal")]
+    def close(self):
+        self._db.close()
+
+    def enqueue(self, type, args, total=1):
+        # total is how many items the job works through, for progress().
+        return self._db.execute("INSERT INTO jobs (type, args, state, created, total) VALUES (?, ?, 'queued', ?, ?)",
+            (type, json.dumps(args), time.time(), total)).lastrowid
+    def enqueue_unique(self, type, args):
+        # Queues the job unless one of the same type is already waiting or running;
+        # returns its id, or None.
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if self.pending(type):
+                return None
+            return self.enqueue(type, args)
+        finally:
+            self._db.execute("COMMIT")
+    def claim(self, worker):
+        # Marks the oldest queued job as running by worker; returns (id, type, args) or None.
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute("SELECT id, type, args FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE jobs SET state = 'running', worker = ?, started = ? WHERE id = ?", (worker, time.time(), row[0]))
+            return (row[0], row[1], json.loads(row[2]))
+        finally:
+            self._db.execute("COMMIT")
+    def progress(self, id, done):
+        self._db.execute("UPDATE jobs SET done = ? WHERE id = ?", (done, id))
+    def finish(self, id, error=None):
+        if error:
+            self._db.execute("UPDATE jobs SET state = 'failed', error = ?, finished = ? WHERE id = ?", (error, time.time(), id))
+        else:
+            self._db.execute("UPDATE jobs SET state = 'done', done = total, finished = ? WHERE id = ?", (time.time(), id))
+    def requeue_orphans(self):
+        # Jobs left running by a worker process on this host that is gone (killed,
+        # or the machine restarted) are queued again. Returns how many.
+        orphans = []
+        for id, worker in self._db.execute("SELECT id, worker FROM jobs WHERE state = 'running'").fetchall():
+            host, _, pid = worker.rpartition(":")
+            if host == socket.gethostname() and not process_alive(int(pid)):
+                orphans.append(id)
+        for id in orphans:
+            self.requeue(id)
+        return len(orphans)
+    def running(self, worker):
+        # Ids of the jobs worker has claimed and not finished.
+        return [row[0] for row in self._db.execute("SELECT id FROM jobs WHERE state = 'running' AND worker = ?", (worker,))]
+    def requeue(self, id):
+        self._db.execute("UPDATE jobs SET state = 'queued', worker = NULL, started = NULL, done = 0 WHERE id = ? AND state = 'running'", (id,))
+
+    def pending(self, type):
+        return self._db.execute("SELECT COUNT(*) FROM jobs WHERE type = ? AND state IN ('queued', 'running')", (type,)).fetchone()[0]
+    def jobs(self, type):
+        # (id, state, args, error, done, total) of every job of type still listed.
+        return [(row[0], row[1], json.loads(row[2]), row[3], row[4], row[5]) for row in self._db.execute(
+            "SELECT id, state, args, error, done, total FROM jobs WHERE type = ? ORDER BY id", (type,))]
+    def clean(self):
+        # Forgets finished jobs.
+        self._db.execute("DELETE FROM jobs WHERE state IN ('done', 'failed')")
+
+def worker_name(pid=None):
+    # That of this process, or of process pid on this host.
+    return "%s:%d" % (socket.gethostname(), pid or os.getpid())
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -1,23 +1,64 @@
 from importlib_metadata import metadata
 from CachePath import *
-from datetime import datetime
+from ScanStats import StageTimes, timed, collect
+from ExifReader import read_metadata, exif_tags
+from datetime import datetime, timedelta
+import calendar
 import json
 import os
 import os.path
 from PIL import Image
 from PIL.ExifTags import TAGS
 from PIL.TiffImagePlugin import IFDRational
-import gc
+import math
 import errno
 import traceback
 
 class Album(object):
+    # Layout of the album JSON written: 1 is a list of photo dicts, 2 is compact_album's.
+    schema = 1
+    # Albums with more photos than this are split into pages of this many (0: never).
+    page_size = 500
+    @staticmethod
+    def configure(config):
+        # Takes ALBUM_SCHEMA, ALBUM_PAGE_SIZE and BROTLI_QUALITY from an app.cfg-style mapping, if set.
+        if config.get("ALBUM_SCHEMA"):
+            if config["ALBUM_SCHEMA"] not in (1, 2):
+                raise ValueError("unknown album schema: %s" % config["ALBUM_SCHEMA"])
+            Album.schema = config["ALBUM_SCHEMA"]
+        if "ALBUM_PAGE_SIZE" in config:
+            if int(config["ALBUM_PAGE_SIZE"]) < 0:
+                raise ValueError("ALBUM_PAGE_SIZE cannot be negative")
+            Album.page_size = int(config["ALBUM_PAGE_SIZE"])
+        if "BROTLI_QUALITY" in config:
+            if not 0 <= int(config["BROTLI_QUALITY"]) <= 11:
+                raise ValueError("BROTLI_QUALITY must be from 0 to 11")
+            write_json.brotli_quality = int(config["BROTLI_QUALITY"])
+    @staticmethod
+    def layout():
+        # Identifies how album JSON is written; a cache written otherwise needs rewriting.
+        return [Album.schema, Album.page_size]
     def __init__(self, path):
         self._path = trim_base(path)
         self._photos = list()
         self._albums = list()
         self._photos_sorted = True
         self._albums_sorted = True
+        self._summary = None
+        # Photos by name, for photo_from_path; built on its first call.
+        self._photos_by_name = None
+    @staticmethod
+    def from_summary(path, date, empty):
+        # Stands in for an album that was not walked, as far as its parent's JSON needs.
+        album = Album(path)
+        album._summary = (date, empty)
+        return album
+    def summarize(self):
+        # Once cached, keeps only what the parent album's JSON needs, so the photos can be freed.
+        self._summary = (self.date, self.empty)
+        self._photos = list()
+        self._photos_by_name = None
+        self._albums = list()
     @property
     def photos(self):
         return self._photos
@@ -34,6 +75,8 @@ class Album(object):
         return json_cache(self.path)
     @property
     def date(self):
+        if self._summary:
+            return self._summary[0]
         self._sort()
         if len(self._photos) == 0 and len(self._albums) == 0:
             return datetime(1900, 1, 1)
@@ -47,6 +90,8 @@ class Album(object):
     def add_photo(self, photo):
         self._photos.append(photo)
         self._photos_sorted = False
+        if self._photos_by_name is not None:
+            self._photos_by_name.setdefault(photo.name, photo)
     def add_album(self, album):
         self._albums.append(album)
         self._albums_sorted = False
@@ -59,6 +104,8 @@ class Album(object):
             self._albums_sorted = True
     @property
     def empty(self):
+        if self._summary:
+            return self._summary[1]
         if len(self._photos) != 0:
             return False
         if len(self._albums) == 0:
@@ -70,20 +117,31 @@ class Album(object):
         
     def cache(self, base_dir):
         self._sort()
-        fp = open(os.path.join(base_dir, self.cache_path), 'w')
-        json.dump(self, fp, cls=PhotoAlbumEncoder)
-        fp.close()
+        write_album_json(base_dir, self.cache_path, self.to_dict())
+    @property
+    def cache_entries(self):
+        # Every file cache() writes for the album, relative to the cache directory.
+        entries = list()
+        for entry in [self.cache_path] + [json_page(self.cache_path, page) for page in range(album_pages(len(self._photos)))]:
+            entries.append(entry)
+            entries.extend(json_variants(entry))
+        return entries
     @staticmethod
-    def from_cache(path, cache_base=None):
-        fp = open(path, "r")
-        dictionary = json.load(fp)
-        fp.close()
-        return Album.from_dict(dictionary, cache_base=cache_base)
+    def from_cache(path, cache_base=None, stats=None):
+        return Album.from_dict(read_album_json(path), cache_base=cache_base, stats=stats)
     @staticmethod
-    def from_dict(dictionary, cripple=True, cache_base=None):
+    def from_dict(dictionary, cripple=True, cache_base=None, stats=None):
+        # stats, if given, maps the names of the files in the album's directory to their stat results.
+        if dictionary.get("version") == 2:
+            dictionary = expand_album(dictionary)
         album = Album(dictionary["path"])
         for photo in dictionary["photos"]:
-            photo_obj = Photo.from_dict(photo, untrim_base(album.path), cache_base)
+            stat_result = None
+            if stats is not None:
+                stat_result = stats.get(photo["name"])
+                if stat_result is None:
+                    continue
+            photo_obj = Photo.from_dict(photo, untrim_base(album.path), cache_base, stat_result)
             if photo_obj.valid:
                 album.add_photo(photo_obj)
         if not cripple:
@@ -102,23 +160,79 @@ class Album(object):
             for sub in self._albums:
                 if not sub.empty:
                     subalbums.append(sub)
-        return { "path": self.path, "date": self.date, "albums": subalbums, "photos": self._photos }
+        # The thumbnails every photo has, for the client to pick from.
+        thumbs = { "sizes": [ [size[0], size[1]] for size in Photo.thumb_sizes ], "formats": Photo.thumb_formats }
+        return { "path": self.path, "date": self.date, "albums": subalbums, "photos": self._photos, "thumbs": thumbs }
     def photo_from_path(self, path):
-        for photo in self._photos:
-            if trim_base(path) == photo._path:
-                return photo
+        # The album's photos all live in its directory, so the name finds the one
+        # candidate; the first photo added wins, as it did when this was a search.
+        if self._photos_by_name is None:
+            self._photos_by_name = dict()
+            for photo in self._photos:
+                self._photos_by_name.setdefault(photo.name, photo)
+        photo = self._photos_by_name.get(os.path.basename(path))
+        if photo is not None and photo._path == trim_base(path):
+            return photo
         return None
     
 class Photo(object):
     # Thumbnail details: (size, square?, quality). Largest first, as smaller ones are created from larger.
     thumb_sizes = [ (1024, False, 75), (150, True, 75) ]
-    def __init__(self, path, thumb_path=None, attributes=None, album_base=None):
+    # Every size is written in each of these formats (file extensions, see thumb_format_names).
+    thumb_formats = [ "jpg" ]
+    thumb_format_names = { "jpg": "JPEG", "webp": "WEBP", "avif": "AVIF" }
+    # Let the JPEG decoder scale down (by 1/2, 1/4 or 1/8) while decoding originals for thumbnails.
+    draft_decode = True
+    # Name thumbnails after a hash of the original's contents (see hash_cache) instead of its path.
+    content_addressed = False
+    # Read EXIF with ExifReader where it can, rather than with Pillow's _getexif.
+    fast_exif = True
+    @staticmethod
+    def configure(config):
+        # Takes THUMB_SIZES, THUMB_FORMATS, CONTENT_ADDRESSED, FAST_EXIF and SYNC_WRITES
+        # from an app.cfg-style mapping, if set.
+        if config.get("THUMB_SIZES"):
+            sizes = [ (int(size[0]), bool(size[1]), int(size[2])) for size in config["THUMB_SIZES"] ]
+            if len(set(size[1] for size in sizes)) != 2:
+                raise ValueError("THUMB_SIZES needs both square and plain thumbnails")
+            Photo.thumb_sizes = sorted(set(sizes), key=lambda size: (-size[0], size[1]))
+        if config.get("THUMB_FORMATS"):
+            for ext in config["THUMB_FORMATS"]:
+                if ext not in Photo.thumb_format_names:
+                    raise ValueError("unknown thumbnail format: %s" % ext)
+            # The web page falls back to jpg for browsers that decode none of the others.
+            if "jpg" not in config["THUMB_FORMATS"]:
+                raise ValueError("THUMB_FORMATS needs jpg")
+            Photo.thumb_formats = list(config["THUMB_FORMATS"])
+        if "CONTENT_ADDRESSED" in config:
+            Photo.content_addressed = bool(config["CONTENT_ADDRESSED"])
+        if "FAST_EXIF" in config:
+            Photo.fast_exif = bool(config["FAST_EXIF"])
+        if "SYNC_WRITES" in config:
+            AtomicFile.sync = bool(config["SYNC_WRITES"])
+    @staticmethod
+    def thumb_config():
+        return { "THUMB_SIZES": Photo.thumb_sizes, "THUMB_FORMATS": Photo.thumb_formats, "CONTENT_ADDRESSED": Photo.content_addressed,
+                 "FAST_EXIF": Photo.fast_exif, "SYNC_WRITES": AtomicFile.sync }
+    def __init__(self, path, thumb_path=None, attributes=None, album_base=None, stat_result=None):
+        # Stage times of building the photo stay with it (see ScanStats), for the
+        # scan to take, or are dropped if there were none.
+        self.stage_times = StageTimes()
+        outer = collect(self.stage_times)
+        try:
+            self._load(path, thumb_path, attributes, album_base, stat_result)
+        finally:
+            collect(outer)
+        if self.stage_times.empty:
+            self.stage_times = None
+    def _load(self, path, thumb_path, attributes, album_base, stat_result):
         if album_base:
             set_cache_path_base(album_base)
         self._path = trim_base(path)
         self.is_valid = True
+        self.is_current = True
         try:
-            mtime = file_mtime(path)
+            mtime = file_mtime(path, stat_result)
         except KeyboardInterrupt:
             raise
         except Exception as e:
@@ -126,6 +240,7 @@ class Photo(object):
             # traceback.print_exc()
             self.is_valid = False
             return
+        self._mtime = mtime
 
         if attributes:
             self._attributes = attributes
@@ -133,41 +248,71 @@ class Photo(object):
             self._attributes = {}
             self._attributes["dateTimeFile"] = mtime
 
-        thumbs_exist = True
-        for size in Photo.thumb_sizes:
-            if not self.check_thumb_exists(thumb_path, path, size[0], size[1]):
-                thumbs_exist = False
-                break
+        if not Photo.content_addressed:
+            self._attributes.pop("hash", None)
+        elif "hash" not in self._attributes or self._attributes["dateTimeFile"] < mtime:
+            try:
+                with timed("hash"):
+                    self._attributes["hash"] = file_hash(path)
+            except KeyboardInterrupt:
+                raise
+            except:
+                self.is_valid = False
+                return
 
         thumbs_needed = True
-        if self._attributes is not None and self._attributes["dateTimeFile"] >= mtime and thumbs_exist:
+        if self._attributes is not None and self._attributes["dateTimeFile"] >= mtime and self.thumbs_exist(thumb_path, path):
             thumbs_needed = False
 
+        if not thumbs_needed and "size" in self._attributes:
+            # Unchanged since it was cached: everything _metadata would derive is already
+            # in the cached attributes, so the original file does not need to be opened.
+            self._orientation = self._cached_orientation()
+            return
+
+        if not thumbs_needed and Photo.fast_exif:
+            # Only the metadata is missing: the headers are enough, if ExifReader can read them.
+            with timed("exif"):
+                header = read_metadata(path)
+            if header is not None:
+                self._exif_metadata(*header)
+                self.stage_times.event("metainfo")
+                return
+
         try:
-            image = Image.open(path)
+            with timed("image_open"):
+                image = Image.open(path)
         except KeyboardInterrupt:
             raise
         except:
             self.is_valid = False
             return
 
-        # Always regenerate metadata since it also sets self._orientation.
-        # (If it is too slow, we could recalculate self._orientation from the orientation metadata.)
-        self._metadata(image)
+        with timed("exif"):
+            self._metadata(image)
+        self.stage_times.event("metainfo")
 
         if thumbs_needed:
             self._thumbnails(image, thumb_path, path)
 #           self._thumbnail_lns(thumb_path)
     
     def _metadata(self, image):
-        self._attributes["size"] = image.size
+        info = None
+        if Photo.fast_exif and image.format == "JPEG":
+            # The APP1 segment Pillow kept while opening the image, read by ExifReader.
+            info = exif_tags(image.info.get("exif"), image.info.get("xmp"))
+        if info is None:
+            try:
+                info = image._getexif()
+            except KeyboardInterrupt:
+                raise
+            except:
+                info = None
+        self._exif_metadata(image.size, info)
+    def _exif_metadata(self, size, info):
+        # info maps EXIF tag numbers to values as Pillow's _getexif gives them.
+        self._attributes["size"] = size
         self._orientation = 1
-        try:
-            info = image._getexif()
-        except KeyboardInterrupt:
-            raise
-        except:
-            return
         if not info:
             return
         
@@ -255,49 +400,75 @@ class Photo(object):
     _metadata.scene_capture_type_list = ["Standard", "Landscape", "Portrait", "Night scene"]
     _metadata.subject_distance_range_list = ["Unknown", "Macro", "Close view", "Distant view"]
 
-    def check_thumb_exists(self, thumb_path, original_path, size, square=False):
-        thumb_path = os.path.join(thumb_path, image_cache(self._path, size, square, False))
-        info_string = "%s -> %spx" % (os.path.basename(original_path), str(size))
+    def _cached_orientation(self):
+        # The orientation is cached in its descriptive form; anything else was treated as normal.
+        try:
+            return self._metadata.orientation_list.index(self._attributes["orientation"]) + 1
+        except (KeyError, ValueError):
+            return 1
+
+    def _thumb_cache(self, size, square=False, suffix=None, ext="jpg"):
+        if self._attributes and "hash" in self._attributes:
+            return hash_cache(self._attributes["hash"], size, square, suffix, ext)
+        return image_cache(self._path, size, square, False, suffix, ext)
+
+    def thumbs_exist(self, thumb_path, original_path):
+        for size in Photo.thumb_sizes:
+            for ext in Photo.thumb_formats:
+                if not self.check_thumb_exists(thumb_path, original_path, size[0], size[1], ext):
+                    return False
+        return True
+
+    def check_thumb_exists(self, thumb_path, original_path, size, square=False, ext="jpg"):
+        thumb_path = os.path.join(thumb_path, self._thumb_cache(size, square, ext=ext))
+        info_string = "%s -> %spx" % (self._path, str(size))
         if square:
             info_string += ", square"
         # Thumb is deemed to exist (and be up-to-date) if its file exists and is later than the photo's timestamp
-        if os.path.exists(thumb_path) and self._attributes and file_mtime(thumb_path) >= self._attributes["dateTimeFile"]:
+        try:
+            thumb_mtime = file_mtime(thumb_path)
+        except FileNotFoundError:
+            return False
+        # A content-addressed thumbnail cannot be older than the contents it is named after.
+        if self._attributes and ("hash" in self._attributes or thumb_mtime >= self._attributes["dateTimeFile"]):
             return True
         return False
         
     def _thumbnail(self, image, thumb_path, original_path, size, quality, square=False, suffix=None):
-        thumb_path = os.path.join(thumb_path, image_cache(self._path, size, square, False, suffix))
-        info_string = "%s -> %spx" % (os.path.basename(original_path), str(size))
+        # Works on the image as stored (see _thumbnails) and only orients the small result.
+        thumb_base = thumb_path
+        thumb_path = os.path.join(thumb_path, self._thumb_cache(size, square, suffix))
+        info_string = "%s -> %spx" % (self._path, str(size))
         if square:
             info_string += ", square"
         message("thumbing", info_string)
-        gc.collect()
         try:
-            image = image.copy()
+            if square:
+                if image.size[0] > image.size[1]:
+                    left = (image.size[0] - image.size[1]) / 2
+                    top = 0
+                    right = image.size[0] - ((image.size[0] - image.size[1]) / 2)
+                    bottom = image.size[1]
+                else:
+                    left = 0
+                    top = (image.size[1] - image.size[0]) / 2
+                    right = image.size[0]
+                    bottom = image.size[1] - ((image.size[1] - image.size[0]) / 2)
+                with timed("resize"):
+                    image = image.crop((left, top, right, bottom))
+            # What Image.thumbnail would do to the oriented image, but into a new image
+            # instead of a full copy.
+            target = self._thumb_size(image.size, size)
+            if target is not None:
+                with timed("resize"):
+                    image = image.resize(target, Image.LANCZOS, reducing_gap=2.0)
+            with timed("orientation"):
+                oriented = self._oriented(image)
         except KeyboardInterrupt:
             raise
         except:
-            try:
-                image = image.copy() # we try again to work around PIL bug
-            except KeyboardInterrupt:
-                raise
-            except:
-                message("corrupt image", os.path.basename(original_path))
-                return
-        if square:
-            if image.size[0] > image.size[1]:
-                left = (image.size[0] - image.size[1]) / 2
-                top = 0
-                right = image.size[0] - ((image.size[0] - image.size[1]) / 2)
-                bottom = image.size[1]
-            else:
-                left = 0
-                top = (image.size[1] - image.size[0]) / 2
-                right = image.size[0]
-                bottom = image.size[1] - ((image.size[1] - image.size[0]) / 2)
-            image = image.crop((left, top, right, bottom))
-            gc.collect()
-        image.thumbnail((size, size), Image.ANTIALIAS)
+            message("corrupt image", self._path)
+            return
         try:
             tomake = os.path.dirname(thumb_path)
             os.makedirs(tomake)
@@ -307,52 +478,101 @@ class Photo(object):
             else:
                 message('folder failure', os.path.basename(thumb_path))
                 return
-        try:
-            image.save(thumb_path, "JPEG", quality=quality)
-            # Return the thumbnail'ed image, so it can be reused to create the next one
-            return image
-        except KeyboardInterrupt:
+        for ext in Photo.thumb_formats:
+            thumb_path = os.path.join(thumb_base, self._thumb_cache(size, square, suffix, ext))
             try:
-                os.unlink(thumb_path)
-            except:
-                pass
-            raise
-        except:
-            traceback.print_exc()
-            message("save failure", os.path.basename(thumb_path))
-            try:
-                os.unlink(thumb_path)
+                # An interrupted save leaves the previous thumbnail, if any, rather than part of one.
+                with timed("encode"):
+                    with AtomicFile(thumb_path) as fp:
+                        oriented.save(fp, Photo.thumb_format_names[ext], quality=quality)
+            except KeyboardInterrupt:
+                raise
             except:
-                return
+                traceback.print_exc()
+                message("save failure", os.path.basename(thumb_path))
+        # Return the thumbnail'ed image, so it can be reused to create the next one
+        return image
 
-    def _thumbnails(self, image, thumb_path, original_path):
-        mirror = image
+    def _thumb_size(self, image_size, size):
+        # Image.thumbnail's size for a size x size box, worked out on the oriented
+        # image as thumbnail() saw it, then turned back; None if it already fits.
+        swapped = self._orientation in (5, 6, 7, 8)
+        width, height = reversed(image_size) if swapped else image_size
+        if width <= size and height <= size:
+            return None
+        aspect = width / float(height)
+        round_aspect = lambda number, key: max(min(math.floor(number), math.ceil(number), key=key), 1)
+        if aspect <= 1:
+            width, height = round_aspect(size * aspect, key=lambda n: abs(aspect - n / float(size))), size
+        else:
+            width, height = size, round_aspect(size / aspect, key=lambda n: 0 if n == 0 else abs(aspect - size / float(n)))
+        return (height, width) if swapped else (width, height)
+
+    def _draft(self, image):
+        if not Photo.draft_decode or image.format != "JPEG":
+            return
+        # Smallest scale at which the original still covers every thumbnail: the long
+        # side for plain ones, the short side for square (cropped) ones.
+        width, height = image.size
+        scale = 0
+        for size in Photo.thumb_sizes:
+            side = min(width, height) if size[1] else max(width, height)
+            scale = max(scale, size[0] / float(side))
+        if scale < 1:
+            image.draft(image.mode, (int(math.ceil(width * scale)), int(math.ceil(height * scale))))
+
+    def _oriented(self, image):
         if self._orientation == 2:
             # Vertical Mirror
-            mirror = image.transpose(Image.FLIP_LEFT_RIGHT)
+            return image.transpose(Image.FLIP_LEFT_RIGHT)
         elif self._orientation == 3:
             # Rotation 180
-            mirror = image.transpose(Image.ROTATE_180)
+            return image.transpose(Image.ROTATE_180)
         elif self._orientation == 4:
             # Horizontal Mirror
-            mirror = image.transpose(Image.FLIP_TOP_BOTTOM)
+            return image.transpose(Image.FLIP_TOP_BOTTOM)
         elif self._orientation == 5:
             # Horizontal Mirror + Rotation 270
-            mirror = image.transpose(Image.FLIP_TOP_BOTTOM).transpose(Image.ROTATE_270)
+            return image.transpose(Image.TRANSPOSE)
         elif self._orientation == 6:
             # Rotation 270
-            mirror = image.transpose(Image.ROTATE_270)
+            return image.transpose(Image.ROTATE_270)
         elif self._orientation == 7:
             # Vertical Mirror + Rotation 270
-            mirror = image.transpose(Image.FLIP_LEFT_RIGHT).transpose(Image.ROTATE_270)
+            return image.transpose(Image.TRANSVERSE)
         elif self._orientation == 8:
             # Rotation 90
-            mirror = image.transpose(Image.ROTATE_90)
+            return image.transpose(Image.ROTATE_90)
+        return image
+
+    def _thumbnails(self, image, thumb_path, original_path):
+        # Crops and resizes commute with the orientation transform, so it is applied
+        # to each finished thumbnail rather than to the full-size original.
+        self._draft(image)
+        try:
+            # Decoded here rather than by the first crop or resize, to be timed on its own.
+            with timed("decode"):
+                image.load()
+        except KeyboardInterrupt:
+            raise
+        except:
+            message("corrupt image", self._path)
+            return
+        made = []
         for size in Photo.thumb_sizes:
-            thumb = self._thumbnail(mirror, thumb_path, original_path, size[0], size[2], square=size[1], suffix=None)
-            # Return generated thumbnail so it can be used to generate further ones, which is faster than creating each from the original
+            # Each size is made from the smallest thumbnail so far that still covers it,
+            # which is faster than creating each from the original. Square thumbnails
+            # can only be the source of other square ones.
+            source = image
+            for square, thumb in made:
+                if square and not size[1]:
+                    continue
+                side = min(thumb.size) if size[1] else max(thumb.size)
+                if side >= size[0] and max(thumb.size) < max(source.size):
+                    source = thumb
+            thumb = self._thumbnail(source, thumb_path, original_path, size[0], size[2], square=size[1], suffix=None)
             if thumb:
-                mirror = thumb
+                made.append((size[1], thumb))
     @property
     def name(self):
         return os.path.basename(self._path)
@@ -365,8 +585,11 @@ class Photo(object):
     def path(self):
         return self._path
     @property
+    def mtime(self):
+        return self._mtime
+    @property
     def image_caches(self):
-        return [image_cache(self._path, size[0], size[1], False) for size in Photo.thumb_sizes]
+        return [self._thumb_cache(size[0], size[1], ext=ext) for size in Photo.thumb_sizes for ext in Photo.thumb_formats]
     @property
     def date(self):
         correct_date = None;
@@ -389,7 +612,10 @@ class Photo(object):
     def attributes(self):
         return self._attributes
     @staticmethod
-    def from_dict(dictionary, basepath, cache_base=None):
+    def from_dict(dictionary, basepath, cache_base=None, stat_result=None):
+        # Rebuilds a photo from its album JSON without opening or thumbnailing it, as
+        # from_index does. One whose file changed since, or whose thumbnails or size
+        # are missing, is not current: the scan builds it again, in the pool if any.
         del dictionary["date"]
         path = os.path.join(basepath, dictionary["name"])
         del dictionary["name"]
@@ -401,7 +627,36 @@ class Photo(object):
                     raise
                 except:
                     pass
-        return Photo(path, cache_base, dictionary)
+        try:
+            mtime = file_mtime(path, stat_result)
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            # Probably because the file no longer exists.
+            return Photo.from_index(path, None, None)
+        if not Photo.content_addressed:
+            dictionary.pop("hash", None)
+        photo = Photo.from_index(path, dictionary, mtime)
+        photo.is_current = (dictionary["dateTimeFile"] >= mtime and "size" in dictionary and
+                            ("hash" in dictionary or not Photo.content_addressed) and photo.thumbs_exist(cache_base, path))
+        return photo
+    @staticmethod
+    def from_index(path, attributes, mtime):
+        # Rebuilds a photo the scan index vouches for, without touching the file at all.
+        photo = Photo.__new__(Photo)
+        photo._path = trim_base(path)
+        photo._mtime = mtime
+        photo.is_valid = attributes is not None
+        photo.is_current = True
+        photo._attributes = attributes
+        photo.stage_times = None
+        if photo.is_valid:
+            photo._orientation = photo._cached_orientation()
+        return photo
+    @staticmethod
+    def thumb_spec():
+        # Identifies the thumbnail set; photos thumbnailed under another spec need redoing.
+        return repr((Photo.thumb_sizes, Photo.thumb_formats, Photo.content_addressed))
     def to_dict(self):
         photo = { "name": self.name, "date": self.date }
         photo.update(self.attributes)
@@ -413,7 +668,7 @@ class Photo(object):
             square = sizes[1]
             thumb_path = os.path.join(cache_path, image_cache(self._path, size, square, False))
             thumb_path_dump = os.path.join(cache_path, image_cache(self._path, size, square))
-            info_string = "%s -> %spx" % (os.path.basename(self._path), str(size))
+            info_string = "%s -> %spx" % (self._path, str(size))
             if square:
                 info_string += ", square"
             if thumb_path_dump == thumb_path or (os.path.exists(thumb_path) and not os.path.exists(thumb_path_dump)):
@@ -456,9 +711,196 @@ class PhotoAlbumEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
             return obj.strftime("%a %b %d %H:%M:%S %Y")
+        if isinstance(obj, Album) and Album.schema == 2:
+            return compact_album(obj.to_dict())
         if isinstance(obj, Album) or isinstance(obj, Photo):
             return obj.to_dict()
         if isinstance(obj, IFDRational):
             return [obj.numerator, obj.denominator]
         return json.JSONEncoder.default(self, obj)
-        
+
+# Schema 2 album JSON is columnar: "photos" (and "albums") map each key to a list
+# with one value per photo, null where a photo lacks it. Dates are seconds since
+# the epoch, taking the naive datetimes as UTC so they read back unchanged, and
+# the EXIF fields in enum_tables are indices into those tables, which are written
+# once per cache to schema_file rather than into every album.
+date_format = "%a %b %d %H:%M:%S %Y"
+schema_file = "album_schema.json"
+
+def enum_tables():
+    # Album JSON refers to these entries by position: only ever append to them.
+    tables = Photo._metadata
+    return {
+        "orientation": tables.orientation_list,
+        "flash": list(tables.flash_dictionary.values()),
+        "lightSource": list(tables.light_source_dictionary.values()),
+        "exposureProgram": tables.exposure_list,
+        "meteringMode": tables.metering_list,
+        "sensingMethod": tables.sensing_method_list,
+        "sceneCaptureType": tables.scene_capture_type_list,
+        "subjectDistanceRange": tables.subject_distance_range_list
+    }
+
+def enum_indices():
+    if not hasattr(enum_indices, "indices"):
+        enum_indices.indices = dict((key, dict((value, i) for i, value in enumerate(table))) for key, table in enum_tables().items())
+    return enum_indices.indices
+
+def is_date_key(key):
+    return key == "date" or key.startswith("dateTime")
+
+def encode_date(value):
+    # Takes datetimes, or dates already formatted for schema 1 (as Ingest has them).
+    if isinstance(value, str):
+        try:
+            value = datetime.strptime(value, date_format)
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        return calendar.timegm(value.timetuple())
+    return value
+
+def decode_date(value):
+    if isinstance(value, int):
+        return (datetime(1970, 1, 1) + timedelta(seconds=value)).strftime(date_format)
+    return value
+
+def columns(items):
+    # Lists of dicts to a dict of lists.
+    keys = list()
+    for item in items:
+        for key in item:
+            if key not in keys:
+                keys.append(key)
+    indices = enum_indices()
+    result = dict()
+    for key in keys:
+        column = [item.get(key) for item in items]
+        if is_date_key(key):
+            column = [encode_date(value) for value in column]
+        elif key in indices:
+            column = [indices[key].get(value, value) if isinstance(value, str) else value for value in column]
+        result[key] = column
+    return result
+
+def rows(columns, count):
+    tables = enum_tables()
+    items = [dict() for i in range(count)]
+    for key, column in columns.items():
+        for item, value in zip(items, column):
+            if value is None:
+                continue
+            if is_date_key(key):
+                value = decode_date(value)
+            elif key in tables and isinstance(value, int):
+                value = tables[key][value]
+            item[key] = value
+    return items
+
+def compact_album(dictionary):
+    # Schema 2 of an album's (crippled) to_dict, or of its schema 1 JSON; also
+    # of a page, or header, of a paged album, which lack some of the keys.
+    compact = dict(dictionary)
+    compact["version"] = 2
+    if "date" in dictionary:
+        compact["date"] = encode_date(dictionary["date"])
+    if "photos" in dictionary:
+        photos = [photo.to_dict() if isinstance(photo, Photo) else photo for photo in dictionary["photos"]]
+        compact["photoCount"] = len(photos)
+        compact["photos"] = columns(photos)
+    if "albums" in dictionary:
+        compact["albumCount"] = len(dictionary["albums"])
+        compact["albums"] = columns(dictionary["albums"])
+    return compact
+
+def expand_album(dictionary):
+    # The schema 1 JSON (dates as strings) of a schema 2 album, page or header.
+    album = dict(dictionary)
+    del album["version"]
+    if "date" in dictionary:
+        album["date"] = decode_date(dictionary["date"])
+    if "photos" in dictionary:
+        del album["photoCount"]
+        album["photos"] = rows(dictionary["photos"], dictionary["photoCount"])
+    if "albums" in dictionary:
+        del album["albumCount"]
+        album["albums"] = rows(dictionary["albums"], dictionary["albumCount"])
+    return album
+
+# An album with more than Album.page_size photos is written as a header, in the
+# album's usual file, with the album's sub-albums and dates, the number of photos
+# and pages, and every photo's name in order (so a photo's page can be found
+# without loading any), and the photos themselves in page files (see json_page).
+def album_pages(count):
+    if not Album.page_size or count <= Album.page_size:
+        return 0
+    return (count + Album.page_size - 1) // Album.page_size
+
+def existing_pages(base_dir, cache_path, start=0):
+    # The page files of cache_path, from page start on, left in base_dir.
+    entries = list()
+    while os.path.exists(os.path.join(base_dir, json_page(cache_path, start))):
+        entries.append(json_page(cache_path, start))
+        entries.extend(json_variants(json_page(cache_path, start)))
+        start += 1
+    return entries
+
+def write_album_json(base_dir, cache_path, dictionary):
+    # Writes an album's to_dict (or its schema 1 JSON) in the configured schema,
+    # paged if it is large enough.
+    def encode(dictionary):
+        if Album.schema == 2:
+            dictionary = compact_album(dictionary)
+        return json.dumps(dictionary, cls=PhotoAlbumEncoder)
+    path = os.path.join(base_dir, cache_path)
+    photos = dictionary["photos"]
+    pages = album_pages(len(photos))
+    if pages:
+        for page in range(pages):
+            items = photos[page * Album.page_size:(page + 1) * Album.page_size]
+            write_json(json_page(path, page), encode({ "path": dictionary["path"], "page": page, "photos": items }))
+        dictionary = dict(dictionary)
+        del dictionary["photos"]
+        dictionary["photoCount"] = len(photos)
+        dictionary["pageSize"] = Album.page_size
+        dictionary["pages"] = pages
+        dictionary["names"] = [photo.name if isinstance(photo, Photo) else photo["name"] for photo in photos]
+    # The header goes last, so it never lists pages that are not written yet.
+    write_json(path, encode(dictionary))
+    for entry in existing_pages(base_dir, cache_path, pages):
+        if os.path.exists(os.path.join(base_dir, entry)):
+            os.unlink(os.path.join(base_dir, entry))
+
+def read_album_json(path):
+    # The schema 1 JSON of the album cached at path, with all of its pages.
+    with open(path, "r") as fp:
+        album = json.load(fp)
+    if album.get("version") == 2:
+        album = expand_album(album)
+    if "pages" in album:
+        photos = list()
+        for page in range(album["pages"]):
+            with open(json_page(path, page), "r") as fp:
+                items = json.load(fp)
+            if items.get("version") == 2:
+                items = expand_album(items)
+            photos.extend(items["photos"])
+        for key in ("photoCount", "pageSize", "pages", "names"):
+            del album[key]
+        album["photos"] = photos
+    return album
+
+def write_album_schema(cache_path):
+    # What clients need to expand schema 2 albums; also tells the next scan which
+    # schema and page size the cache was written with.
+    write_json(os.path.join(cache_path, schema_file), json.dumps({ "version": Album.schema, "pageSize": Album.page_size, "enums": enum_tables() }))
+
+def album_schema(cache_path):
+    # The Album.layout() the cache was last written with (unpaged schema 1 from
+    # before there was a choice).
+    try:
+        with open(os.path.join(cache_path, schema_file), "r") as fp:
+            schema = json.load(fp)
+        return [schema["version"], schema.get("pageSize", 0)]
+    except (OSError, ValueError, KeyError):
+        return [1, 0]
@@ -0,0 +1,178 @@
+from CachePath import *
+import heapq
+import json
+import os
+import os.path
+import tempfile
+
+# all_photos.json lists every photo path, oldest first. The same list is also
+# split by month into shard_dir as [date, path] pairs, with a manifest of the
+# shards and their sizes, so readers only need to load the months they are
+# after, and a few photos can be spliced in (see splice_photos).
+list_file = "all_photos.json"
+shard_dir = "all_photos.d"
+manifest_file = "manifest.json"
+
+def shard_entries(cache_path):
+    # The cache entries (relative to cache_path) the last write left behind.
+    try:
+        with open(os.path.join(cache_path, shard_dir, manifest_file), "r") as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError):
+        return []
+    return [os.path.join(shard_dir, manifest_file)] + [os.path.join(shard_dir, shard["name"] + ".json") for shard in manifest["shards"]]
+
+def photo_count(cache_path):
+    # How many photos the last write listed, or None.
+    try:
+        with open(os.path.join(cache_path, shard_dir, manifest_file), "r") as fp:
+            return json.load(fp)["count"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def date_key(date):
+    return date.strftime("%Y-%m-%dT%H:%M:%S")
+
+def sort_key(photo):
+    return (date_key(photo.date), photo.name, photo.path)
+
+class Spool(object):
+    # Sorts keys (tuples of strings) without holding them all: every run_size keys
+    # are sorted and spilled to a temporary file, and the runs merged at the end.
+    run_size = 100000
+    def __init__(self, cache_path, prefix):
+        self._cache_path = cache_path
+        self._prefix = prefix
+        self._keys = list()
+        self._runs = list()
+    def add(self, key):
+        self._keys.append(key)
+        if len(self._keys) >= Spool.run_size:
+            self._spill()
+    def _spill(self):
+        self._keys.sort()
+        run = tempfile.TemporaryFile("w+", dir=self._cache_path, prefix=self._prefix)
+        for key in self._keys:
+            run.write(json.dumps(key) + "\n")
+        run.seek(0)
+        self._runs.append(run)
+        self._keys = list()
+    def sorted(self):
+        # Yields every key added, duplicates included, in order.
+        self._keys.sort()
+        runs = [(tuple(json.loads(line)) for line in run) for run in self._runs]
+        return heapq.merge(self._keys, *runs)
+    def close(self):
+        for run in self._runs:
+            run.close()
+        self._runs = list()
+        self._keys = list()
+
+class PhotoSpool(Spool):
+    # The (date, name, path) keys of every photo, for all_photos.json.
+    def __init__(self, cache_path):
+        Spool.__init__(self, cache_path, ".all_photos.")
+    def add(self, photo):
+        Spool.add(self, sort_key(photo))
+    def sorted(self):
+        # Yields (date, path) in list order.
+        for date, name, path in Spool.sorted(self):
+            yield date, path
+
+class JSONListWriter(object):
+    # Writes a JSON array one item at a time; it replaces path when closed.
+    def __init__(self, path):
+        self._file = AtomicFile(path, "w")
+        self._fp = self._file.fp
+        self._fp.write("[")
+        self.count = 0
+    def add(self, item):
+        if self.count:
+            self._fp.write(", ")
+        self._fp.write(json.dumps(item))
+        self.count += 1
+    def close(self):
+        self._fp.write("]")
+        self._file.commit()
+
+def write_photo_lists(cache_path, photos):
+    # photos yields (date, path) in list order, dates as ISO strings.
+    # Returns the cache entries written.
+    old_entries = shard_entries(cache_path)
+    try:
+        os.mkdir(os.path.join(cache_path, shard_dir))
+    except FileExistsError:
+        pass
+    all_photos = JSONListWriter(os.path.join(cache_path, list_file))
+    shards = list()
+    shard = None
+    for date, path in photos:
+        all_photos.add(path)
+        month = date[:7]
+        if shard is None or shards[-1]["name"] != month:
+            if shard is not None:
+                shard.close()
+                shards[-1]["count"] = shard.count
+            shards.append({ "name": month })
+            shard = JSONListWriter(os.path.join(cache_path, shard_dir, month + ".json"))
+        shard.add([date, path])
+    if shard is not None:
+        shard.close()
+        shards[-1]["count"] = shard.count
+    all_photos.close()
+    write_manifest(cache_path, shards)
+    entries = [list_file] + shard_entries(cache_path)
+    for entry in old_entries:
+        if entry not in entries:
+            message("cleanup", "Removing stale file " + entry)
+            os.unlink(os.path.join(cache_path, entry))
+    return entries
+
+def write_manifest(cache_path, shards):
+    with AtomicFile(os.path.join(cache_path, shard_dir, manifest_file), "w") as fp:
+        json.dump({ "count": sum(shard["count"] for shard in shards), "shards": shards }, fp)
+
+def read_shard(cache_path, name):
+    try:
+        with open(os.path.join(cache_path, shard_dir, name + ".json"), "r") as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return []
+
+def splice_photos(cache_path, changes):
+    # changes are (path, date, old_date): each path is listed under date (a datetime)
+    # and dropped from where it was listed under old_date, if not None. Every shard
+    # they touch is rewritten once, and all_photos.json once from the shards.
+    try:
+        with open(os.path.join(cache_path, shard_dir, manifest_file), "r") as fp:
+            shards = json.load(fp)["shards"]
+    except FileNotFoundError:
+        os.makedirs(os.path.join(cache_path, shard_dir), exist_ok=True)
+        shards = []
+    added = dict()
+    dropped = dict()
+    for path, date, old_date in changes:
+        date = date_key(date)
+        added.setdefault(date[:7], list()).append((date, os.path.basename(path), path))
+        dropped.setdefault(date[:7], set()).add(path)
+        if old_date is not None:
+            dropped.setdefault(date_key(old_date)[:7], set()).add(path)
+    counts = dict((shard["name"], shard["count"]) for shard in shards)
+    for month in dropped:
+        keys = [(item[0], os.path.basename(item[1]), item[1]) for item in read_shard(cache_path, month) if item[1] not in dropped[month]]
+        items = [[date, path] for date, name, path in heapq.merge(keys, sorted(added.get(month, [])))]
+        shard_path = os.path.join(cache_path, shard_dir, month + ".json")
+        if len(items):
+            with AtomicFile(shard_path, "w") as fp:
+                json.dump(items, fp)
+            counts[month] = len(items)
+        elif month in counts:
+            os.unlink(shard_path)
+            del counts[month]
+    shards = [{ "name": month, "count": counts[month] } for month in sorted(counts)]
+    all_photos = JSONListWriter(os.path.join(cache_path, list_file))
+    for shard in shards:
+        for item in read_shard(cache_path, shard["name"]):
+            all_photos.add(item[1])
+    all_photos.close()
+    write_manifest(cache_path, shards)
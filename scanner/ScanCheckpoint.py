@@ -0,0 +1,69 @@
+from CachePath import *
+from PhotoAlbum import Photo, PhotoAlbumEncoder
+from ScanIndex import ScanIndex
+import json
+import os
+import os.path
+import threading
+
+class ScanCheckpoint(object):
+    # The photos a scan has built so far, one JSON line each, as they are built.
+    # A scan that is killed before it writes their album JSON (a job timing out,
+    # CTRL+C) leaves it behind, and the next scan takes the photos from it instead
+    # of building them again, as long as their files have not changed since.
+    # A scan that completes removes it.
+    filename = ".scan_checkpoint.jsonl"
+    def __init__(self, cache_path):
+        self._cache_path = cache_path
+        self._path = os.path.join(cache_path, ScanCheckpoint.filename)
+        self._photos = dict()
+        self._lock = threading.Lock()
+        header = json.dumps({ "thumbs": Photo.thumb_spec() })
+        try:
+            with open(self._path, "r") as fp:
+                if fp.readline().rstrip("\n") == header:
+                    for line in fp:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # Cut short by the interruption.
+                            continue
+                        self._photos[record["path"]] = record
+        except FileNotFoundError:
+            pass
+        # Lines are appended after whatever is left of the last one.
+        self._fp = open(self._path, "w" if not self._photos else "a")
+        if not self._photos:
+            self._fp.write(header + "\n")
+        else:
+            self._fp.write("\n")
+        self._fp.flush()
+    def __len__(self):
+        # How many photos are left to take.
+        return len(self._photos)
+    @staticmethod
+    def cache_entries():
+        return [ScanCheckpoint.filename]
+    def add(self, photo, stat_result):
+        if not photo.is_valid:
+            return
+        line = json.dumps({ "path": photo.path, "state": ScanIndex.state(stat_result), "photo": photo }, cls=PhotoAlbumEncoder)
+        with self._lock:
+            self._fp.write(line + "\n")
+            self._fp.flush()
+            if AtomicFile.sync:
+                os.fsync(self._fp.fileno())
+    def photo(self, path, stat_result):
+        # The photo at path as the interrupted scan built it, or None.
+        record = self._photos.pop(trim_base(path), None)
+        if record is None or tuple(record["state"]) != ScanIndex.state(stat_result):
+            return None
+        photo = Photo.from_dict(record["photo"], os.path.dirname(path), self._cache_path, stat_result)
+        if not photo.is_valid or not photo.is_current:
+            return None
+        return photo
+    def close(self):
+        self._fp.close()
+    def remove(self):
+        self.close()
+        os.unlink(self._path)
@@ -0,0 +1,126 @@
+from datetime import datetime
+import os.path
+import pickle
+import sqlite3
+import urllib.request
+
+class ScanIndex(object):
+    # What the last scan saw of each file and directory. Kept inside the cache it
+    # describes, so that copying, moving or deleting the cache takes it along and
+    # it never vouches for a cache it was not written with.
+    filename = ".scanindex.sqlite"
+    def __init__(self, cache_path, readonly=False):
+        if readonly:
+            # For FloatApp, which must neither create the index nor change it;
+            # raises sqlite3.Error if there is none.
+            path = urllib.request.pathname2url(os.path.join(cache_path, ScanIndex.filename))
+            self._db = sqlite3.connect("file:%s?mode=ro" % path, uri=True)
+            return
+        self._db = sqlite3.connect(os.path.join(cache_path, ScanIndex.filename))
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                album TEXT NOT NULL,
+                name TEXT NOT NULL,
+                mtime INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                date TEXT,
+                attributes BLOB,
+                thumbs TEXT,
+                hash TEXT
+            );
+            CREATE INDEX IF NOT EXISTS files_album ON files (album);
+            CREATE TABLE IF NOT EXISTS albums (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                empty INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS albums_parent ON albums (parent);
+        """)
+        # Indexes from before content-addressed thumbnails lack the hash column.
+        if "hash" not in [row[1] for row in self._db.execute("PRAGMA table_info(files)")]:
+            self._db.execute("ALTER TABLE files ADD COLUMN hash TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_hash ON files (hash)")
+    @staticmethod
+    def cache_entries():
+        return [ScanIndex.filename + suffix for suffix in ("", "-wal", "-shm", "-journal")]
+    @staticmethod
+    def state(stat_result):
+        return (int(stat_result.st_mtime), stat_result.st_size, stat_result.st_ino)
+    def close(self):
+        self._db.commit()
+        self._db.close()
+    def commit(self):
+        self._db.commit()
+
+    def album_mtime(self, path):
+        row = self._db.execute("SELECT mtime FROM albums WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+    def album_summary(self, path):
+        row = self._db.execute("SELECT date, empty FROM albums WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        return (datetime.fromisoformat(row[0]), bool(row[1]))
+    def sub_albums(self, path):
+        return [row[0] for row in self._db.execute("SELECT path FROM albums WHERE parent = ?", (path,))]
+    def update_album(self, album, mtime, parent):
+        self._db.execute("INSERT OR REPLACE INTO albums (path, parent, mtime, date, empty) VALUES (?, ?, ?, ?, ?)",
+            (album.path, parent, mtime, album.date.isoformat(), int(album.empty)))
+    def remove_album(self, path):
+        # Drops the album and everything below it, returning what was dropped
+        # as ([(file path, attributes)], [album path]).
+        prefix = path + "/" if path else ""
+        like = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        files = [(row[0], pickle.loads(row[1]) if row[1] is not None else None) for row in self._db.execute(
+            "SELECT path, attributes FROM files WHERE album = ? OR album LIKE ? ESCAPE '\\'", (path, like))]
+        albums = [row[0] for row in self._db.execute(
+            "SELECT path FROM albums WHERE path = ? OR path LIKE ? ESCAPE '\\'", (path, like))]
+        self._db.execute("DELETE FROM files WHERE album = ? OR album LIKE ? ESCAPE '\\'", (path, like))
+        self._db.execute("DELETE FROM albums WHERE path = ? OR path LIKE ? ESCAPE '\\'", (path, like))
+        return files, albums
+
+    def files(self, album_path):
+        # name -> (state, attributes or None if unreadable, thumbs)
+        files = {}
+        for name, mtime, size, inode, attributes, thumbs in self._db.execute(
+                "SELECT name, mtime, size, inode, attributes, thumbs FROM files WHERE album = ?", (album_path,)):
+            if attributes is not None:
+                attributes = pickle.loads(attributes)
+            files[name] = ((mtime, size, inode), attributes, thumbs)
+        return files
+    def update_file(self, photo, album_path, state, thumbs):
+        if photo.is_valid:
+            attributes = pickle.dumps(photo.attributes, pickle.HIGHEST_PROTOCOL)
+            date = photo.date.isoformat()
+            digest = photo.attributes.get("hash")
+        else:
+            attributes = None
+            date = None
+            digest = None
+        self._db.execute("INSERT OR REPLACE INTO files (path, album, name, mtime, size, inode, date, attributes, thumbs, hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (photo.path, album_path, photo.name, state[0], state[1], state[2], date, attributes, thumbs, digest))
+    def file_attributes(self, path):
+        # The attributes indexed for the photo at path, or None if it is unknown or unreadable.
+        row = self._db.execute("SELECT attributes FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return pickle.loads(row[0])
+    def remove_file(self, path):
+        self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+    def hash_refs(self, digest):
+        # How many indexed photos share the content-addressed thumbnails of digest.
+        return self._db.execute("SELECT COUNT(*) FROM files WHERE hash = ?", (digest,)).fetchone()[0]
+    def hash_paths(self, digest):
+        # The paths of the indexed photos whose thumbnails are those of digest.
+        return [row[0] for row in self._db.execute("SELECT path FROM files WHERE hash = ?", (digest,))]
+    def photo_list(self):
+        # (date, path) of every readable photo, in the order all_photos.json lists them.
+        for row in self._db.execute("SELECT date, path FROM files WHERE date IS NOT NULL ORDER BY date, name, path"):
+            yield row[0], row[1]
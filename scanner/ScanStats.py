@@ -0,0 +1,132 @@
+import json
+import os
+import os.path
+import time
+
+# Where a scan spends its time. Code on the hot path wraps each stage in
+# timed(stage), which adds to timed.times: the collector of the directory being
+# walked, or of the photo being built (Photo keeps its own, so the times of
+# photos built in pool workers come back with them). TreeWalker merges them per
+# directory and per run, into ScanStats.
+stages = ["listdir", "stat", "json_load", "index_load", "image_open", "hash", "exif", "decode",
+          "orientation", "resize", "encode", "json_write", "stale_cleanup"]
+
+class StageTimes(object):
+    def __init__(self):
+        self.seconds = dict()
+        self.counts = dict()
+        self.events = dict()
+    def add(self, stage, seconds, count=1):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        self.counts[stage] = self.counts.get(stage, 0) + count
+    def event(self, name, count=1):
+        # Things worth counting that take no time of their own, like cache hits.
+        self.events[name] = self.events.get(name, 0) + count
+    def merge(self, other):
+        for stage, seconds in other.seconds.items():
+            self.add(stage, seconds, other.counts[stage])
+        for name, count in other.events.items():
+            self.event(name, count)
+    @property
+    def empty(self):
+        return not self.counts and not self.events
+    @property
+    def total(self):
+        return sum(self.seconds.values())
+    def to_dict(self):
+        return dict((stage, { "seconds": round(self.seconds[stage], 6), "count": self.counts[stage] })
+                    for stage in stages + sorted(set(self.seconds) - set(stages)) if stage in self.seconds)
+
+class timed(object):
+    __slots__ = ("stage", "start")
+    def __init__(self, stage):
+        self.stage = stage
+    def __enter__(self):
+        self.start = time.perf_counter()
+    def __exit__(self, type, value, traceback):
+        timed.times.add(self.stage, time.perf_counter() - self.start)
+timed.times = StageTimes()
+
+def collect(times):
+    # Makes times the collector timed() adds to; returns the one it replaces.
+    outer = timed.times
+    timed.times = times
+    return outer
+
+class ScanStats(object):
+    # How many of the slowest directories the summary lists.
+    top_directories = 50
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.run = StageTimes()
+        self.directories = dict()
+    def directory(self, path):
+        times = self.directories.get(path)
+        if times is None:
+            times = self.directories[path] = StageTimes()
+        return times
+    def finish(self):
+        self.finished = time.time()
+    def totals(self):
+        totals = StageTimes()
+        totals.merge(self.run)
+        for times in self.directories.values():
+            totals.merge(times)
+        return totals
+    def summary(self):
+        totals = self.totals()
+        slowest = sorted(self.directories.items(), key=lambda item: item[1].total, reverse=True)[:ScanStats.top_directories]
+        stage_seconds = sorted(totals.seconds.items(), key=lambda item: item[1], reverse=True)
+        return {
+            "started": self.started,
+            "wall_seconds": round((self.finished or time.time()) - self.started, 6),
+            "directories": len(self.directories),
+            # Photo stages run in pool workers add up across them, so with -j the
+            # stage seconds can exceed the wall time.
+            "stages": totals.to_dict(),
+            "events": totals.events,
+            "slowest_stage": stage_seconds[0][0] if stage_seconds else None,
+            "slowest_directories": [{ "path": path, "seconds": round(times.total, 6), "stages": times.to_dict(), "events": times.events }
+                                    for path, times in slowest],
+        }
+    def write_json(self, path):
+        text = json.dumps(self.summary(), indent=2, sort_keys=True)
+        if path == "-":
+            print(text)
+            return
+        with open(path, "w") as fp:
+            fp.write(text + "\n")
+    def write_prometheus(self, path):
+        # For node_exporter's textfile collector, which must never see half a file.
+        summary = self.summary()
+        lines = [
+            "# HELP photofloat_scan_stage_seconds Seconds spent in each stage by the last scan.",
+            "# TYPE photofloat_scan_stage_seconds gauge",
+        ]
+        lines += ['photofloat_scan_stage_seconds{stage="%s"} %f' % (stage, value["seconds"]) for stage, value in summary["stages"].items()]
+        lines += [
+            "# HELP photofloat_scan_stage_count Times each stage was run by the last scan.",
+            "# TYPE photofloat_scan_stage_count gauge",
+        ]
+        lines += ['photofloat_scan_stage_count{stage="%s"} %d' % (stage, value["count"]) for stage, value in summary["stages"].items()]
+        lines += [
+            "# HELP photofloat_scan_events Cache hits, photos built and other events of the last scan.",
+            "# TYPE photofloat_scan_events gauge",
+        ]
+        lines += ['photofloat_scan_events{event="%s"} %d' % (name, count) for name, count in sorted(summary["events"].items())]
+        lines += [
+            "# HELP photofloat_scan_wall_seconds Duration of the last scan.",
+            "# TYPE photofloat_scan_wall_seconds gauge",
+            "photofloat_scan_wall_seconds %f" % summary["wall_seconds"],
+            "# HELP photofloat_scan_directories Directories walked by the last scan.",
+            "# TYPE photofloat_scan_directories gauge",
+            "photofloat_scan_directories %d" % summary["directories"],
+            "# HELP photofloat_scan_last_finished_timestamp_seconds When the last scan finished.",
+            "# TYPE photofloat_scan_last_finished_timestamp_seconds gauge",
+            "photofloat_scan_last_finished_timestamp_seconds %f" % (self.finished or time.time()),
+        ]
+        temp = os.path.join(os.path.dirname(os.path.abspath(path)), "." + os.path.basename(path) + ".tmp")
+        with open(temp, "w") as fp:
+            fp.write("\n".join(lines) + "\n")
+        os.replace(temp, path)
@@ -1,151 +1,466 @@
 import os
 import os.path
-import sys
 from datetime import datetime
-from PhotoAlbum import Photo, Album, PhotoAlbumEncoder
+from PhotoAlbum import Photo, Album, album_schema, write_album_schema, schema_file, existing_pages
+from ScanIndex import ScanIndex
+from ScanCheckpoint import ScanCheckpoint
+from JobQueue import JobQueue
+from ChangeJournal import journal_entries, take_dirty, clear_dirty
+from PhotoList import Spool, PhotoSpool, write_photo_lists, photo_count
+from ScanStats import ScanStats, timed, collect
 from CachePath import *
-import json
 import traceback
-#from multiprocessing.pool import ThreadPool
+import time
+from multiprocessing import Pool
+
+def configure_worker(thumb_config, level):
+    Photo.configure(thumb_config)
+    setup_logging(level, buffered=False)
+
+class Progress(object):
+    # Seconds between progress lines; 0 for none.
+    interval = 10
+    def __init__(self, expected=None):
+        # expected: how many photos the last scan listed, for the ETA.
+        self.started = self.last = time.time()
+        self.expected = expected
+        self.files = 0
+        self.hits = 0
+    def file(self, hit, count=1):
+        self.files += count
+        if hit:
+            self.hits += count
+        if Progress.interval and time.time() - self.last >= Progress.interval:
+            self.report()
+    def report(self):
+        self.last = time.time()
+        rate = self.files / max(self.last - self.started, 0.001)
+        if self.expected and rate and self.files < self.expected:
+            eta = "%ds" % ((self.expected - self.files) / rate)
+        else:
+            eta = "unknown"
+        message("progress", "%d files, %.1f files/s, %.1f%% cache hits, ETA %s" %
+                (self.files, rate, 100.0 * self.hits / max(self.files, 1), eta))
 
 class TreeWalker:
-    def __init__(self, album_path, cache_path):
+    def __init__(self, album_path, cache_path, jobs=1, index=False, incremental=False):
+        self.pool = None
+        self.index = None
+        self.incremental = False
+        self.photo_spool = None
+        self.cache_entries = None
+        self.checkpoint = None
+        self.lock = None
+        # Per-stage times of the scan, per directory and in all.
+        self.stats = ScanStats()
+        self.progress = None
+        outer = collect(self.stats.run)
         try:
             self.album_path = os.path.abspath(album_path)
             self.cache_path = os.path.abspath(cache_path)
             set_cache_path_base(self.album_path)
-            self.all_albums = list()
-            self.all_photos = list()
-            #self.pool = ThreadPool(10)
-            message("will start walking", "")
-            self.walk(self.album_path)
-            self.big_lists()
-            self.remove_stale()
+            self.progress = Progress(photo_count(self.cache_path))
+            # Uploads are ingested after the scan, rather than in the middle of it.
+            self.lock = cache_lock(self.cache_path)
+            # Sort keys of every photo, for all_photos.json, and every cache entry
+            # still in use, for remove_stale; the albums themselves are not kept.
+            self.photo_spool = PhotoSpool(self.cache_path)
+            self.cache_entries = Spool(self.cache_path, ".cache_entries.")
+            # Albums whose photos are still being built by the pool, in the
+            # order the serial walk would have cached them (children first).
+            self.pending_albums = list()
+            # Trimmed paths of albums whose JSON no longer matches the index.
+            self.changed = set()
+            # Trimmed paths of directories the change journal says must be re-listed,
+            # and cache entries known to be stale after an incremental scan.
+            self.dirty = set()
+            self.stale = set()
+            # Album JSON written in another schema or page size is rewritten, even if unchanged.
+            self.reschema = album_schema(self.cache_path) != Album.layout()
+            if index or incremental:
+                self.index = ScanIndex(self.cache_path)
+            self.checkpoint = ScanCheckpoint(self.cache_path)
+            if len(self.checkpoint):
+                message("resuming", "%d photos built by an interrupted scan" % len(self.checkpoint))
+            if jobs > 1:
+                # Workers get the thumbnail settings explicitly, in case they are not forked.
+                self.pool = Pool(jobs, configure_worker, (Photo.thumb_config(), log.getEffectiveLevel()))
+            dirty = take_dirty(self.cache_path)
+            if incremental and self.index.album_mtime("") is None:
+                message("incremental", "no scan index yet, walking everything")
+            elif incremental and self.reschema:
+                message("incremental", "album layout changed, walking everything")
+            elif incremental:
+                self.incremental = True
+            if self.incremental:
+                self.remove_leftovers()
+                self.incremental_walk(dirty)
+                self.big_lists()
+                self.remove_stale_entries()
+            else:
+                message("will start walking", "")
+                self.walk(self.album_path)
+                self.flush()
+                self.big_lists()
+                self.remove_stale()
+            clear_dirty(self.cache_path)
+            self.checkpoint.remove()
+            self.checkpoint = None
+            self.progress.report()
+            message("stat calls", str(self.stats.totals().counts.get("stat", 0)))
             message("complete", "")
         except Exception as e:
-            import traceback
-            print(f" error {str(e)}")
+            message("error", str(e))
             traceback.print_exc()
-    def walk(self, path):
-        next_level()
-        if not os.access(path, os.R_OK | os.X_OK):
-            message("access denied", os.path.basename(path))
-            back_level()
+        finally:
+            collect(outer)
+            self.stats.finish()
+            if self.pool:
+                self.pool.terminate()
+            if self.index:
+                self.index.close()
+            if self.photo_spool:
+                self.photo_spool.close()
+            if self.cache_entries:
+                self.cache_entries.close()
+            if self.checkpoint:
+                self.checkpoint.close()
+            if self.lock:
+                self.lock.close()
+    def list_photo(self, photo):
+        timed.times.event("photos")
+        self.photo_spool.add(photo)
+        self.keep(photo.image_caches)
+    def keep(self, entries):
+        # Cache entries still in use, for remove_stale, by directory.
+        for entry in entries:
+            self.cache_entries.add(os.path.split(entry))
+    def flush(self):
+        for path, album, photos, mtime in self.pending_albums:
+            self.finish_album(path, album, photos, mtime)
+        self.pending_albums = list()
+    def flush_ready(self):
+        # Finishes the albums at the front whose photos are all built, so their JSON
+        # is written during the walk rather than all at the end of it.
+        ready = 0
+        for path, album, photos, mtime in self.pending_albums:
+            if not all(isinstance(photo, Photo) or photo.ready() for photo, state in photos):
+                break
+            self.finish_album(path, album, photos, mtime)
+            ready += 1
+        del self.pending_albums[:ready]
+    def incremental_walk(self, dirty):
+        message("incremental", "%d changed directories" % len(dirty))
+        targets = set()
+        for path in dirty:
+            path = os.path.abspath(untrim_base(path))
+            if os.path.commonpath([path, self.album_path]) != self.album_path:
+                continue
+            # A directory that is gone shows up as a change to the nearest one left.
+            while path != self.album_path and not os.path.isdir(path):
+                path = os.path.dirname(path)
+            self.dirty.add(trim_base(path))
+            # Parents list their sub-albums' dates, so every ancestor is refreshed too.
+            while path not in targets:
+                targets.add(path)
+                if path == self.album_path:
+                    break
+                path = os.path.dirname(path)
+        # Deepest first, so each parent sees its children's updated index entries.
+        for path in sorted(targets, key=lambda path: path.count(os.sep), reverse=True):
+            self.walk(path)
+            self.flush()
+    def indexed_album(self, path):
+        # In an incremental scan, directories nobody reported as changed are not walked
+        # (and changed ones have already been walked, deepest first).
+        summary = self.index.album_summary(trim_base(path))
+        if summary is None:
             return None
-        message("walking", os.path.basename(path))
+        return Album.from_summary(path, summary[0], summary[1])
+    def json_cache(self, path, stat_result, stats):
         cache = os.path.join(self.cache_path, json_cache(path))
-        cached = False
         cached_album = None
-        if os.path.exists(cache):
+        try:
+            cache_stat = file_stat(cache)
+        except FileNotFoundError:
+            cache_stat = None
+        if cache_stat:
             try:
-                cached_album = Album.from_cache(cache, self.cache_path)
-                if file_mtime(path) <= file_mtime(cache):
-                    message("full cache", os.path.basename(path))
-                    cached = True
-                    album = cached_album
+                with timed("json_load"):
+                    cached_album = Album.from_cache(cache, self.cache_path, stats)
+                # A photo rewritten in place leaves the directory's mtime alone.
+                if file_mtime(path, stat_result) <= file_mtime(cache, cache_stat) and all(photo.is_current for photo in cached_album.photos):
+                    message("full cache", trim_base(path))
                     #self.pool.map(lambda x: x._thumbnail_lns(self.cache_path), album.photos)
                     #self.pool.wait_completion()
-                    for photo in album.photos:
-                        self.all_photos.append(photo)
+                    for photo in cached_album.photos:
+                        self.list_photo(photo)
+                    self.progress.file(True, len(cached_album.photos))
+                    return True, cached_album
                 else:
-                    message("partial cache", os.path.basename(path))
+                    message("partial cache", trim_base(path))
             except KeyboardInterrupt:
                 raise
             except :
-                message("corrupt cache", os.path.basename(path))
+                message("corrupt cache", trim_base(path))
                 traceback.print_exc()
                 cached_album = None
-        if not cached:
-            album = Album(path)
-        for entry in os.listdir(path):
-            if entry[0] == '.':
-                continue
-            try:
-                entry = entry
-            except KeyboardInterrupt:
-                raise
-            except:
-                next_level()
-                message("unicode error", entry.decode(sys.getfilesystemencoding(), "replace"))
-                back_level()
-                continue
-            entry = os.path.join(path, entry)
-            if os.path.isdir(entry):
-                next_walked_album = self.walk(entry)
+        return False, cached_album
+    def index_cache(self, path, mtime, stats):
+        album = Album(path)
+        with timed("index_load"):
+            indexed = self.index.files(album.path)
+            known_mtime = self.index.album_mtime(album.path)
+        spec = Photo.thumb_spec()
+        if album.path not in self.dirty and known_mtime == mtime and all(thumbs == spec for _, _, thumbs in indexed.values()):
+            # A photo rewritten in place leaves the directory's mtime alone.
+            photos = [self.indexed_photo(os.path.join(path, name), known, stats.get(name)) for name, known in indexed.items()]
+            if all(photo is not None for photo in photos):
+                message("full cache", album.path)
+                for photo in photos:
+                    if photo.is_valid:
+                        self.list_photo(photo)
+                        album.add_photo(photo)
+                self.progress.file(True, len(indexed))
+                return True, album, indexed
+        if indexed:
+            message("partial cache", album.path)
+        return False, album, indexed
+    def indexed_photo(self, path, known, stat_result):
+        # The photo as the index has it, or None if the file or its thumbnails changed since.
+        state, attributes, thumbs = known
+        if stat_result is None or ScanIndex.state(stat_result) != state or thumbs != Photo.thumb_spec():
+            return None
+        photo = Photo.from_index(path, attributes, datetime.fromtimestamp(state[0]))
+        if photo.is_valid and not photo.thumbs_exist(self.cache_path, path):
+            return None
+        return photo
+    def file_stats(self, entries):
+        # One stat per file, reused for every mtime check on it during the scan.
+        return { entry.name: entry_stat(entry) for entry in entries if not entry.is_dir() and entry.is_file() }
+    def walk(self, path, stat_result=None):
+        # The directory's own stages are timed into its collector, then the
+        # collector of the walk above (or the run's) is put back.
+        outer = collect(self.stats.directory(trim_base(path)))
+        try:
+            return self.walk_directory(path, stat_result)
+        finally:
+            collect(outer)
+    def walk_directory(self, path, stat_result):
+        if not os.access(path, os.R_OK | os.X_OK):
+            message("access denied", trim_base(path))
+            return None
+        message("walking", trim_base(path))
+        if stat_result is None:
+            stat_result = file_stat(path)
+        with timed("listdir"):
+            with os.scandir(path) as iterator:
+                entries = [entry for entry in iterator if entry.name[0] != '.']
+        mtime = None
+        cached_album = None
+        stats = self.file_stats(entries)
+        if self.index:
+            mtime = int(stat_result.st_mtime)
+            cached, album, indexed = self.index_cache(path, mtime, stats)
+        else:
+            cached, cached_album = self.json_cache(path, stat_result, stats)
+            album = cached_album if cached else Album(path)
+        photos = list()
+        sub_albums = set()
+        for entry in entries:
+            if entry.is_dir():
+                next_walked_album = None
+                if self.incremental:
+                    next_walked_album = self.indexed_album(entry.path)
+                if next_walked_album is None:
+                    next_walked_album = self.walk(entry.path, entry_stat(entry))
                 if next_walked_album is not None:
                     album.add_album(next_walked_album)
-            elif not cached and os.path.isfile(entry):
-                next_level()
-                cache_hit = False
-                if cached_album:
+                    sub_albums.add(next_walked_album.path)
+            elif not cached and entry.name in stats:
+                stat_result = stats[entry.name]
+                entry = entry.path
+                photo = None
+                state = None
+                if self.index:
+                    state = ScanIndex.state(stat_result)
+                    known = indexed.pop(os.path.basename(entry), None)
+                    if known:
+                        photo = self.indexed_photo(entry, known, stat_result)
+                    if photo is not None:
+                        message("cache hit", trim_base(entry))
+                        timed.times.event("cache_hit")
+                        state = None
+                    elif known and known[0] != state and known[1] and "hash" in known[1]:
+                        # New contents get new thumbnails; the old ones go if nothing else uses them.
+                        self.add_stale_photo(entry, known[1])
+                elif cached_album:
                     cached_photo = cached_album.photo_from_path(entry)
-                    if cached_photo and file_mtime(entry) <= cached_photo.attributes["dateTimeFile"]:
-                        message("cache hit", os.path.basename(entry))
+                    if cached_photo and cached_photo.is_current:
+                        message("cache hit", trim_base(entry))
+                        timed.times.event("cache_hit")
 #                        cached_photo._thumbnail_lns(self.cache_path)
-                        cache_hit = True
                         photo = cached_photo
-                if not cache_hit:
-                    message("metainfo", os.path.basename(entry))
-                    photo = Photo(entry, self.cache_path)
-                if photo.is_valid:
-                    self.all_photos.append(photo)
-                    album.add_photo(photo)
-                else:
-                    message("unreadable", os.path.basename(entry))
-                back_level()
-        if not album.empty:
-            message("caching", os.path.basename(path))
-            album.cache(self.cache_path)
-            self.all_albums.append(album)
+                if photo is None:
+                    photo = self.checkpoint.photo(entry, stat_result)
+                    if photo is not None:
+                        message("resumed", trim_base(entry))
+                        timed.times.event("checkpoint_hit")
+                        self.changed.add(album.path)
+                self.progress.file(photo is not None)
+                if photo is None:
+                    message("metainfo", trim_base(entry))
+                    self.changed.add(album.path)
+                    if self.pool:
+                        photo = self.pool.apply_async(Photo, args=(entry, self.cache_path), kwds=dict(album_base=self.album_path, stat_result=stat_result),
+                                                      callback=lambda photo, stat_result=stat_result: self.checkpoint.add(photo, stat_result))
+                    else:
+                        photo = Photo(entry, self.cache_path, stat_result=stat_result)
+                        self.checkpoint.add(photo, stat_result)
+                photos.append((photo, state))
+        if self.index and not cached:
+            # Whatever the index still holds for this directory is gone from disk.
+            for name, (state, attributes, thumbs) in indexed.items():
+                self.index.remove_file(os.path.join(album.path, name))
+                self.add_stale_photo(os.path.join(path, name), attributes)
+                self.changed.add(album.path)
+            for sub_album in self.index.sub_albums(album.path):
+                if sub_album not in sub_albums:
+                    files, albums = self.index.remove_album(sub_album)
+                    for file_path, attributes in files:
+                        self.add_stale_photo(untrim_base(file_path), attributes)
+                    for album_path in albums:
+                        self.add_stale_album(json_cache(album_path))
+                    self.changed.add(album.path)
+        if self.pool:
+            self.pending_albums.append((path, album, photos, mtime))
+            self.flush_ready()
         else:
-            message("empty", os.path.basename(path))
-        back_level()
+            self.finish_album(path, album, photos, mtime)
         return album
+    def finish_album(self, path, album, photos, mtime=None):
+        # With a pool, albums are finished after their walk, so this selects the
+        # album's collector itself.
+        times = self.stats.directory(album.path)
+        outer = collect(times)
+        try:
+            self.finish_album_photos(path, album, photos, mtime, times)
+        finally:
+            collect(outer)
+    def finish_album_photos(self, path, album, photos, mtime, times):
+        for photo, state in photos:
+            if not isinstance(photo, Photo):
+                photo = photo.get()
+            if photo.stage_times is not None:
+                times.merge(photo.stage_times)
+                photo.stage_times = None
+            if state is not None:
+                self.index.update_file(photo, album.path, state, Photo.thumb_spec())
+            if photo.is_valid:
+                self.list_photo(photo)
+                album.add_photo(photo)
+            else:
+                message("unreadable", photo.path)
+        cache = os.path.join(self.cache_path, album.cache_path)
+        if self.index:
+            for sub_album in album.albums:
+                if sub_album.path in self.changed:
+                    self.changed.add(album.path)
+            if album.path in self.changed or self.index.album_mtime(album.path) != mtime:
+                parent = os.path.dirname(album.path) if path != self.album_path else None
+                self.index.update_album(album, mtime, parent)
+            self.index.commit()
+            if not album.empty and (self.reschema or not os.path.exists(cache + ".etag")):
+                self.changed.add(album.path)
+        if not album.empty:
+            if self.index and album.path not in self.changed:
+                message("unchanged", album.path)
+            else:
+                message("caching", album.path)
+                with timed("json_write"):
+                    album.cache(self.cache_path)
+                times.event("album_written")
+            self.keep(album.cache_entries)
+        else:
+            message("empty", album.path)
+            self.add_stale_album(album.cache_path)
+        album.summarize()
+    def add_stale_album(self, cache_path):
+        self.stale.add(cache_path)
+        self.stale.update(json_variants(cache_path))
+        self.stale.update(existing_pages(self.cache_path, cache_path))
+    def add_stale_photo(self, path, attributes):
+        for entry in Photo.from_index(path, attributes, None).image_caches:
+            self.stale.add(entry)
     def big_lists(self):
-        photo_list = []
-        self.all_photos.sort(key=lambda item: (item.date, item.name))
-        for photo in self.all_photos:
-            photo_list.append(photo.path)
         message("caching", "all photos path list")
-        fp = open(os.path.join(self.cache_path, "all_photos.json"), 'w')
-        json.dump(photo_list, fp, cls=PhotoAlbumEncoder)
-        fp.close()
+        if self.incremental:
+            photos = self.index.photo_list()
+        else:
+            photos = self.photo_spool.sorted()
+        with timed("json_write"):
+            self.keep(write_photo_lists(self.cache_path, photos))
+            write_album_schema(self.cache_path)
+        self.keep([schema_file] + json_variants(schema_file))
     def remove_stale(self):
         message("cleanup", "building cache list")
-        all_cache_entries = { "all_photos.json": True, "latest_photos.json": True }
-        for album in self.all_albums:
-            all_cache_entries[album.cache_path] = True
-        for photo in self.all_photos:
-            for entry in photo.image_caches:
-                all_cache_entries[entry] = True
-        # Make each an absolute path
-        all_cache_entries = {os.path.join(self.cache_path, cache_item): True for cache_item in all_cache_entries}
-        # Start the stale walk
-        self.remove_stale_walk(self.cache_path, all_cache_entries)
-    def remove_stale_walk(self, cache_path, all_cache_entries):
-        message("remove_stale_walk", cache_path)
-        files_found = 0
-        next_level()
-        for cache_file in os.listdir(cache_path):
-            try:
-                cache_file = cache_file.decode(sys.getfilesystemencoding())
-            except KeyboardInterrupt:
-                raise
-            except:
-                pass
-            fullpath = os.path.join(cache_path, cache_file)
-            if os.path.isdir(fullpath):
-                sub_files_found = self.remove_stale_walk(fullpath, all_cache_entries)
-                # If no files were found in the subdirectory, remove it
-                if sub_files_found == 0:
-                    message("remove_stale_walk", "Removing stale dir " + fullpath)
-                    os.rmdir(fullpath)
-                files_found += sub_files_found
-            elif os.path.isfile(fullpath):
-                if fullpath not in all_cache_entries:
-                    message("remove_stale_walk", "Removing stale file " + fullpath)
-                    os.unlink(fullpath)
-                else:
-                    files_found += 1
-        back_level()
-        return files_found
+        self.keep(["latest_photos.json"] + ScanIndex.cache_entries() + ScanCheckpoint.cache_entries() +
+                  JobQueue.cache_entries() + journal_entries() + [lock_file])
+        with timed("stale_cleanup"):
+            self.remove_stale_walk()
+    def remove_stale_walk(self):
+        # Goes through the cache directories in sorted order, alongside the entries
+        # in use, sorted by directory too, so only one directory's names are held.
+        directories = sorted(os.path.relpath(root, self.cache_path) if root != self.cache_path else ""
+                             for root, dirs, files in os.walk(self.cache_path))
+        entries = self.cache_entries.sorted()
+        entry = next(entries, None)
+        for directory in directories:
+            fullpath = os.path.join(self.cache_path, directory)
+            message("remove_stale_walk", fullpath)
+            names = set()
+            while entry is not None and entry[0] <= directory:
+                if entry[0] == directory:
+                    names.add(entry[1])
+                entry = next(entries, None)
+            with os.scandir(fullpath) as iterator:
+                stale = [item.path for item in iterator if item.is_file() and item.name not in names]
+            for path in stale:
+                message("remove_stale_walk", "Removing stale file " + path)
+                os.unlink(path)
+                timed.times.event("stale_removed")
+        # Deepest first, so a directory left with only empty ones goes too.
+        for directory in reversed(directories):
+            fullpath = os.path.join(self.cache_path, directory)
+            if directory and len(os.listdir(fullpath)) == 0:
+                message("remove_stale_walk", "Removing stale dir " + fullpath)
+                os.rmdir(fullpath)
+    def remove_leftovers(self):
+        # Temporary files of writers killed mid-write. A full scan's remove_stale
+        # takes them along with the rest; an incremental one only removes the
+        # entries it knows are stale, so it sweeps them up before walking.
+        with timed("stale_cleanup"):
+            for root, dirs, files in os.walk(self.cache_path):
+                for name in files:
+                    if AtomicFile.leftover.match(name):
+                        message("cleanup", "Removing leftover file " + os.path.join(root, name))
+                        os.unlink(os.path.join(root, name))
+                        timed.times.event("stale_removed")
+    def remove_stale_entries(self):
+        with timed("stale_cleanup"):
+            self.remove_stale_files()
+    def remove_stale_files(self):
+        for cache_file in sorted(self.stale):
+            digest = hash_cache_digest(cache_file)
+            if digest is not None and self.index.hash_refs(digest) > 0:
+                continue
+            fullpath = os.path.join(self.cache_path, cache_file)
+            if os.path.isfile(fullpath):
+                message("cleanup", "Removing stale file " + fullpath)
+                os.unlink(fullpath)
+                timed.times.event("stale_removed")
+                directory = os.path.dirname(fullpath)
+                while directory != self.cache_path and len(os.listdir(directory)) == 0:
+                    message("cleanup", "Removing stale dir " + directory)
+                    os.rmdir(directory)
+                    directory = os.path.dirname(directory)
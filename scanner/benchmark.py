@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+
+from ChangeJournal import record_dirty
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+from PhotoList import photo_count
+import argparse
+import filecmp
+import json
+import os
+import os.path
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Times TreeWalker on a synthetic album tree (or a copy of a real one), one scan
+# per scenario, each in a fresh process so its CPU time and peak RSS are its own.
+# The results are written as JSON, to compare commits with.
+
+def progress(text):
+    # stdout may be carrying the JSON results.
+    sys.stderr.write("[benchmark] %s\n" % text)
+    sys.stderr.flush()
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return (int(width), int(height))
+
+def exif_date(when):
+    return time.strftime("%Y:%m:%d %H:%M:%S", time.gmtime(when))
+
+def make_photo(path, size, orientation, when, rng):
+    # A noisy gradient, so decoding and encoding cost about what a photo does,
+    # with the EXIF fields PhotoFloat reads.
+    noise = Image.effect_noise((max(1, size[0] // 8), max(1, size[1] // 8)), 48).resize(size)
+    gradient = Image.linear_gradient("L").resize(size)
+    base = Image.new("L", size, rng.randrange(256))
+    image = Image.merge("RGB", (noise, gradient, base))
+    exif = Image.Exif()
+    exif[0x010f] = "Benchmark"
+    exif[0x0110] = "Synthetic %d" % rng.randrange(3)
+    exif[0x0112] = orientation
+    exif[0x0132] = exif_date(when)
+    details = exif.get_ifd(0x8769)
+    details[0x9003] = exif_date(when)
+    details[0x829a] = IFDRational(1, rng.choice([60, 125, 250, 1000]))
+    details[0x829d] = IFDRational(rng.choice([18, 28, 56, 80]), 10)
+    details[0x8827] = rng.choice([100, 200, 400, 1600])
+    details[0x9209] = rng.choice([0x0, 0x10, 0x18, 0x19])
+    details[0x9207] = rng.choice([2, 3, 5])
+    image.save(path, "JPEG", quality=85, exif=exif.tobytes())
+    os.utime(path, (when, when))
+
+def generate(album_path, depth, fanout, images, sizes, orientations, seed):
+    # images photos in every directory, and fanout sub-directories down to depth.
+    # Returns the paths of the photos made.
+    rng = random.Random(seed)
+    photos = list()
+    def populate(path, level):
+        os.makedirs(path, exist_ok=True)
+        for i in range(images):
+            photo = os.path.join(path, "IMG_%04d.jpg" % i)
+            when = 1262304000 + rng.randrange(10 * 365 * 86400)
+            make_photo(photo, rng.choice(sizes), rng.choice(orientations), when, rng)
+            photos.append(photo)
+        if level < depth:
+            for i in range(fanout):
+                populate(os.path.join(path, "Event %d (day %d)" % (level, i)), level + 1)
+    populate(album_path, 0)
+    return photos
+
+def list_photos(album_path):
+    photos = list()
+    for root, dirs, files in os.walk(album_path):
+        dirs[:] = sorted(d for d in dirs if d[0] != '.')
+        photos.extend(os.path.join(root, name) for name in sorted(files) if name[0] != '.')
+    return photos
+
+class Bench(object):
+    # What the scenarios work on: the album tree, its cache and the scan settings.
+    def __init__(self, album_path, cache_path, mode, seed):
+        self.album_path = album_path
+        self.cache_path = cache_path
+        self.mode = mode
+        self.rng = random.Random(seed)
+        self.photos = list_photos(album_path)
+        self.warm = False
+        # Photos whose thumbnails the next scan must rebuild, checked after it.
+        self.rebuilt = list()
+    def changed(self, paths):
+        # An incremental scan only sees the directories the watcher would have recorded.
+        if self.mode == "incremental":
+            directories = [os.path.relpath(os.path.dirname(path), self.album_path) for path in paths]
+            record_dirty(self.cache_path, ["" if directory == "." else directory for directory in directories])
+
+# Each scenario prepares the tree and cache, then the scan is timed. Those that
+# need a warm cache get an untimed scan first if nothing has scanned yet.
+def prepare_cold(bench):
+    shutil.rmtree(bench.cache_path)
+    os.mkdir(bench.cache_path)
+
+def prepare_nochange(bench):
+    pass
+
+def prepare_single(bench):
+    # One photo gets new contents (and so a new mtime), rewritten in place so its
+    # directory's mtime stays. Two seconds ahead, past the thumbnails' whole seconds.
+    path = bench.rng.choice(bench.photos)
+    with Image.open(path) as image:
+        size = image.size
+    make_photo(path, size, 1, time.time() + 2, bench.rng)
+    bench.changed([path])
+    bench.rebuilt.append(path)
+
+def prepare_stale(bench, fraction=0.25):
+    # A quarter of the photos and a whole directory go, leaving their thumbnails
+    # and album JSON for the scan to clean up.
+    directories = sorted(set(os.path.dirname(path) for path in bench.photos if os.path.dirname(path) != bench.album_path))
+    removed = list()
+    if directories:
+        victim = bench.rng.choice(directories)
+        shutil.rmtree(victim)
+        removed.extend(path for path in bench.photos if path.startswith(victim + os.sep))
+        removed.append(victim)
+    left = [path for path in bench.photos if path not in removed]
+    for path in bench.rng.sample(left, int(len(left) * fraction)):
+        os.unlink(path)
+        removed.append(path)
+    bench.photos = list_photos(bench.album_path)
+    bench.changed(removed)
+
+def prepare_partial(bench):
+    # Every directory's mtime moves on, as when a photo is added to it, so each
+    # album is rescanned from its partial cache: its photos are looked up one by
+    # one in the album JSON. Two seconds ahead, past the cache's whole seconds.
+    when = time.time() + 2
+    directories = [root for root, dirs, files in os.walk(bench.album_path)]
+    for directory in directories:
+        os.utime(directory, (when, when))
+    bench.changed([os.path.join(directory, "") for directory in directories])
+
+def check_rebuilt(bench, config):
+    # Each photo the scenario changed must have thumbnails just like ones built
+    # afresh, or the scan that was timed skipped it.
+    from PhotoAlbum import Photo
+    Photo.configure(config)
+    scratch = tempfile.mkdtemp(prefix="benchmark.")
+    try:
+        for path in bench.rebuilt:
+            photo = Photo(path, scratch, album_base=bench.album_path)
+            for entry in photo.image_caches:
+                cached = os.path.join(bench.cache_path, entry)
+                if not os.path.exists(cached) or not filecmp.cmp(os.path.join(scratch, entry), cached, shallow=False):
+                    raise RuntimeError("the scan did not rebuild %s for %s" % (entry, path))
+    finally:
+        shutil.rmtree(scratch)
+    bench.rebuilt = list()
+
+scenarios = [
+    ("cold", prepare_cold, False),
+    ("nochange", prepare_nochange, True),
+    ("single", prepare_single, True),
+    ("partial", prepare_partial, True),
+    ("stale", prepare_stale, True),
+]
+
+def exif_attributes(path, how):
+    # The attributes Photo._metadata derives from path, read with Pillow's _getexif
+    # ("pillow"), ExifReader on Pillow's APP1 segment ("opened") or ExifReader
+    # alone ("headers"); None where ExifReader leaves the file to Pillow.
+    from PhotoAlbum import Photo
+    from ExifReader import read_metadata
+    photo = Photo.__new__(Photo)
+    photo._attributes = dict()
+    if how == "headers":
+        metadata = read_metadata(path)
+        if metadata is None:
+            return None
+        photo._exif_metadata(*metadata)
+    else:
+        Photo.fast_exif = how == "opened"
+        try:
+            with Image.open(path) as image:
+                photo._metadata(image)
+        except KeyboardInterrupt:
+            raise
+        except:
+            return "unreadable"
+    # Compared by repr, as EXIF rationals with a zero denominator are NaN.
+    return repr(sorted(dict(photo._attributes, orientationTag=photo._orientation).items()))
+
+def compare_exif(photos):
+    # Times the three ways of exif_attributes over photos, and lists the photos
+    # where ExifReader's attributes differ from Pillow's.
+    result = { "photos": len(photos), "seconds": dict(), "mismatches": list(), "left_to_pillow": 0 }
+    attributes = dict()
+    for how in ("pillow", "opened", "headers"):
+        start = time.perf_counter()
+        attributes[how] = [exif_attributes(path, how) for path in photos]
+        result["seconds"][how] = time.perf_counter() - start
+    for index, path in enumerate(photos):
+        expected = attributes["pillow"][index]
+        if attributes["headers"][index] is None:
+            result["left_to_pillow"] += 1
+        elif attributes["headers"][index] != expected:
+            result["mismatches"].append({ "path": path, "how": "headers" })
+        if attributes["opened"][index] != expected:
+            result["mismatches"].append({ "path": path, "how": "opened" })
+    return result
+
+def proc_io():
+    # Read and write syscalls of this process, where Linux tells.
+    try:
+        with open("/proc/self/io", "r") as fp:
+            fields = dict(line.split(": ") for line in fp.read().splitlines())
+        return { "read_syscalls": int(fields["syscr"]), "write_syscalls": int(fields["syscw"]) }
+    except (OSError, KeyError, ValueError):
+        return { "read_syscalls": None, "write_syscalls": None }
+
+def peak_rss_kb(usage):
+    # ru_maxrss survives fork and exec, so it would start at the benchmark's own
+    # peak; VmHWM is this process's alone.
+    try:
+        with open("/proc/self/status", "r") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return usage.ru_maxrss
+
+def child(result_path, album_path, cache_path, mode, jobs, config):
+    # The timed scan, in its own process.
+    from PhotoAlbum import Photo, Album
+    from TreeWalker import TreeWalker
+    Photo.configure(config)
+    Album.configure(config)
+    start = time.perf_counter()
+    walker = TreeWalker(album_path, cache_path, jobs=jobs, index=mode != "json", incremental=mode == "incremental")
+    wall = time.perf_counter() - start
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = {
+        "wall": wall,
+        "user": own.ru_utime + workers.ru_utime,
+        "system": own.ru_stime + workers.ru_stime,
+        "peak_rss_kb": max(peak_rss_kb(own), workers.ru_maxrss),
+        "stat_calls": walker.stats.totals().counts.get("stat", 0),
+        "stages": walker.stats.summary()["stages"],
+    }
+    result.update(proc_io())
+    with open(result_path, "w") as fp:
+        json.dump(result, fp)
+
+def copy_gc_thumbnails(photo_path, cache_path):
+    # The thumbnail pipeline Photo had before it stopped copying: the whole
+    # original is oriented, then each size copies the last image (collecting
+    # garbage first) and shrinks the copy in place with Image.thumbnail.
+    import gc
+    from PhotoAlbum import Photo
+    image = Image.open(photo_path)
+    photo = Photo.from_index(photo_path, {}, None)
+    photo._orientation = image.getexif().get(0x0112, 1)
+    photo._draft(image)
+    mirror = photo._oriented(image)
+    for size, square, quality in Photo.thumb_sizes:
+        gc.collect()
+        thumb = mirror.copy()
+        if square:
+            side = min(thumb.size)
+            left = (thumb.size[0] - side) / 2
+            top = (thumb.size[1] - side) / 2
+            thumb = thumb.crop((left, top, left + side, top + side))
+            gc.collect()
+        thumb.thumbnail((size, size), Image.LANCZOS)
+        for ext in Photo.thumb_formats:
+            thumb.save(os.path.join(cache_path, "%d%s.%s" % (size, "s" if square else "", ext)), Photo.thumb_format_names[ext], quality=quality)
+        mirror = thumb
+    return True
+
+def thumb_child(result_path, photo_path, cache_path, config, draft, copy_gc):
+    # One photo's thumbnails, built in a process of their own for its peak RSS;
+    # the peak after the imports is kept too, to tell the build's share.
+    from CachePath import set_cache_path_base
+    from PhotoAlbum import Photo
+    Photo.configure(config)
+    Photo.draft_decode = draft
+    set_cache_path_base(os.path.dirname(photo_path))
+    baseline = peak_rss_kb(resource.getrusage(resource.RUSAGE_SELF))
+    start = time.perf_counter()
+    if copy_gc:
+        valid = copy_gc_thumbnails(photo_path, cache_path)
+    else:
+        valid = Photo(photo_path, cache_path).is_valid
+    result = {
+        "seconds": time.perf_counter() - start,
+        "baseline_rss_kb": baseline,
+        "peak_rss_kb": peak_rss_kb(resource.getrusage(resource.RUSAGE_SELF)),
+        "valid": valid,
+    }
+    with open(result_path, "w") as fp:
+        json.dump(result, fp)
+
+def strace_counts(path):
+    # Syscall name to count, from strace -c output.
+    counts = dict()
+    with open(path, "r") as fp:
+        for line in fp:
+            fields = line.split()
+            if len(fields) >= 5 and fields[3].isdigit() and fields[-1] != "total":
+                counts[fields[-1]] = int(fields[3])
+    return counts
+
+def cache_snapshot(cache_path):
+    snapshot = dict()
+    for root, dirs, files in os.walk(cache_path):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                snapshot[path] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                pass
+    return snapshot
+
+def scan(bench, args, log):
+    # Runs one scan in a child process; returns its measurements.
+    fd, result_path = tempfile.mkstemp(prefix="benchmark.", suffix=".json")
+    os.close(fd)
+    command = [sys.executable, os.path.abspath(__file__), "--child", result_path, "--mode", bench.mode, "-j", str(args.jobs)]
+    if args.config:
+        command += ["--config", args.config]
+    command += [bench.album_path, bench.cache_path]
+    strace_path = None
+    if args.strace:
+        strace_path = result_path + ".strace"
+        command = ["strace", "-f", "-c", "-o", strace_path] + command
+    before = cache_snapshot(bench.cache_path)
+    try:
+        subprocess.check_call(command, stdout=log, stderr=subprocess.STDOUT)
+        with open(result_path, "r") as fp:
+            result = json.load(fp)
+        if strace_path:
+            counts = strace_counts(strace_path)
+            result["syscalls"] = sum(counts.values())
+            result["syscall_counts"] = counts
+        else:
+            result["syscalls"] = None
+    finally:
+        for path in (result_path, strace_path):
+            if path and os.path.exists(path):
+                os.unlink(path)
+    after = cache_snapshot(bench.cache_path)
+    result["cache_written"] = sum(1 for path, mtime in after.items() if before.get(path) != mtime)
+    result["cache_removed"] = sum(1 for path in before if path not in after)
+    result["photos"] = photo_count(bench.cache_path) or 0
+    result["photos_per_second"] = result["photos"] / result["wall"] if result["wall"] else None
+    bench.warm = True
+    return result
+
+def partial_rescan(work, count, args, log):
+    # A partial-cache rescan of one flat directory of count photos, small ones as
+    # it reads none of them: the time goes on matching files to cached photos.
+    path = os.path.join(work, "partial-%d" % count)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(os.path.join(path, "cache"))
+    progress("generating a directory of %d photos" % count)
+    generate(os.path.join(path, "albums"), 0, 0, count, [(160, 120)], [1], args.seed)
+    bench = Bench(os.path.join(path, "albums"), os.path.join(path, "cache"), args.mode, args.seed)
+    progress("warming the cache for %d photos" % count)
+    scan(bench, args, log)
+    prepare_partial(bench)
+    progress("scanning: partial rescan of %d photos" % count)
+    result = scan(bench, args, log)
+    result["files"] = count
+    progress("%d photos: %.2fs wall, %.2fs cpu" % (count, result["wall"], result["user"] + result["system"]))
+    return result
+
+def thumb_memory(work, args, log):
+    # Peak RSS of building one photo's thumbnails, for each original resolution,
+    # with draft decoding and without, by Photo and by the copy_gc_thumbnails
+    # pipeline it replaced. Rotated, as cameras held upright write them.
+    path = os.path.join(work, "memory")
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    rng = random.Random(args.seed)
+    results = list()
+    for size in [parse_size(size) for size in args.memory.split(",")]:
+        progress("generating a %dx%d photo" % size)
+        photo = os.path.join(path, "%dx%d.jpg" % size)
+        make_photo(photo, size, 6, 1262304000, rng)
+        for draft, copy_gc in [(draft, copy_gc) for draft in (True, False) for copy_gc in (False, True)]:
+            cache = os.path.join(path, "cache")
+            if os.path.exists(cache):
+                shutil.rmtree(cache)
+            os.mkdir(cache)
+            fd, result_path = tempfile.mkstemp(prefix="benchmark.", suffix=".json")
+            os.close(fd)
+            command = [sys.executable, os.path.abspath(__file__), "--thumb-child", result_path]
+            if args.config:
+                command += ["--config", args.config]
+            if not draft:
+                command += ["--full-decode"]
+            if copy_gc:
+                command += ["--copy-gc"]
+            try:
+                subprocess.check_call(command + [photo, cache], stdout=log, stderr=subprocess.STDOUT)
+                with open(result_path, "r") as fp:
+                    result = json.load(fp)
+            finally:
+                os.unlink(result_path)
+            result.update(size="%dx%d" % size, draft=draft, pipeline="copy_gc" if copy_gc else "photo")
+            results.append(result)
+            progress("%dx%d, %s, %s: %d KB peak (%d KB before building), %.2fs" % (size + ("draft" if draft else "full decode",
+                     result["pipeline"], result["peak_rss_kb"], result["baseline_rss_kb"], result["seconds"])))
+    return results
+
+def git_revision():
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        revision = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=here, stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], cwd=here, stderr=subprocess.DEVNULL) != 0
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    from main import read_config
+    names = [scenario[0] for scenario in scenarios]
+    parser = argparse.ArgumentParser(description="Time scans of a synthetic album tree and write the results as JSON.")
+    parser.add_argument("--scenarios", default=",".join(names),
+                        help="comma separated, run in this order (default: %(default)s)")
+    parser.add_argument("--mode", choices=["json", "index", "incremental"], default="json",
+                        help="scan with the JSON caches only, with --index or with --incremental (default: json)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N", help="scan with N worker processes (default: 1)")
+    parser.add_argument("--config", metavar="FILE", help="thumbnail and album settings for the scans, as for main.py")
+    parser.add_argument("--depth", type=int, default=2, help="levels of sub-directories (default: 2)")
+    parser.add_argument("--fanout", type=int, default=3, help="sub-directories per directory (default: 3)")
+    parser.add_argument("--images", type=int, default=20, help="photos per directory (default: 20)")
+    parser.add_argument("--sizes", default="1600x1200,1200x1600,3000x2000",
+                        help="photo resolutions to pick from (default: %(default)s)")
+    parser.add_argument("--orientations", default="1,3,6,8", help="EXIF orientations to pick from (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--source", metavar="DIR", help="benchmark on a copy of DIR instead of a synthetic tree")
+    parser.add_argument("--work", metavar="DIR", help="build the tree and cache in DIR, and keep them (default: a temporary directory)")
+    parser.add_argument("--strace", action="store_true", help="count every syscall with strace -f -c (slows the scans down)")
+    parser.add_argument("--log", metavar="FILE", help="keep the scanner's output in FILE")
+    parser.add_argument("--exif", action="store_true",
+                        help="also time ExifReader against Pillow on every photo, and check they read the same attributes")
+    parser.add_argument("--partial", metavar="COUNTS",
+                        help="also time a partial-cache rescan of a flat directory of each of these many photos, comma separated (e.g. 1000,10000,50000)")
+    parser.add_argument("--memory", metavar="SIZES",
+                        help="also measure the peak RSS of building one photo's thumbnails at each of these "
+                             "resolutions, comma separated (e.g. 4000x3000,6000x4000,8000x6000)")
+    parser.add_argument("-o", "--output", metavar="FILE", help="write the results to FILE instead of stdout")
+    parser.add_argument("--child", metavar="RESULT", help=argparse.SUPPRESS)
+    parser.add_argument("--thumb-child", metavar="RESULT", help=argparse.SUPPRESS)
+    parser.add_argument("--full-decode", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--copy-gc", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("paths", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    config = read_config(args.config) if args.config else {}
+    if args.child:
+        child(args.child, args.paths[0], args.paths[1], args.mode, args.jobs, config)
+        return
+    if args.thumb_child:
+        thumb_child(args.thumb_child, args.paths[0], args.paths[1], config, not args.full_decode, args.copy_gc)
+        return
+
+    selected = args.scenarios.split(",") if args.scenarios else []
+    for name in selected:
+        if name not in names:
+            parser.error("unknown scenario: %s" % name)
+    if args.strace and shutil.which("strace") is None:
+        parser.error("strace is not installed")
+    work = os.path.abspath(args.work) if args.work else tempfile.mkdtemp(prefix="photofloat-benchmark.")
+    album_path = os.path.join(work, "albums")
+    cache_path = os.path.join(work, "cache")
+    log = open(args.log, "w") if args.log else open(os.devnull, "w")
+    try:
+        if os.path.exists(album_path):
+            shutil.rmtree(album_path)
+        os.makedirs(cache_path, exist_ok=True)
+        started = time.perf_counter()
+        if args.source:
+            progress("copying %s" % args.source)
+            shutil.copytree(args.source, album_path)
+        else:
+            progress("generating the album tree")
+            generate(album_path, args.depth, args.fanout, args.images, [parse_size(size) for size in args.sizes.split(",")],
+                     [int(orientation) for orientation in args.orientations.split(",")], args.seed)
+        bench = Bench(album_path, cache_path, args.mode, args.seed)
+        tree = {
+            "source": args.source,
+            "photos": len(bench.photos),
+            "directories": sum(1 for _ in os.walk(album_path)),
+            "bytes": sum(os.path.getsize(path) for path in bench.photos),
+            "generate_seconds": time.perf_counter() - started,
+        }
+        if not args.source:
+            tree.update(depth=args.depth, fanout=args.fanout, images=args.images, sizes=args.sizes, orientations=args.orientations, seed=args.seed)
+        exif = None
+        if args.exif:
+            progress("comparing ExifReader with Pillow")
+            exif = compare_exif(bench.photos)
+            progress("exif: %.2fs with Pillow, %.2fs on its APP1 segment, %.2fs from the headers, %d mismatches" %
+                     (exif["seconds"]["pillow"], exif["seconds"]["opened"], exif["seconds"]["headers"], len(exif["mismatches"])))
+        results = list()
+        for name, prepare, needs_warm in scenarios:
+            if name not in selected:
+                continue
+            if needs_warm and not bench.warm:
+                progress("warming the cache for %s" % name)
+                scan(bench, args, log)
+            prepare(bench)
+            progress("scanning: %s" % name)
+            result = scan(bench, args, log)
+            check_rebuilt(bench, config)
+            result["name"] = name
+            results.append(result)
+            progress("%s: %.2fs wall, %.2fs cpu, %d KB peak, %.1f photos/s" % (name, result["wall"],
+                     result["user"] + result["system"], result["peak_rss_kb"], result["photos_per_second"] or 0))
+        memory = None
+        if args.memory:
+            memory = thumb_memory(work, args, log)
+        partial = None
+        if args.partial:
+            partial = [partial_rescan(work, int(count), args, log) for count in args.partial.split(",")]
+        report = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "pillow": Image.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "mode": args.mode,
+            "jobs": args.jobs,
+            "config": dict((key, repr(value)) for key, value in config.items()),
+            "tree": tree,
+            "scenarios": results,
+        }
+        if exif is not None:
+            report["exif"] = exif
+        if partial is not None:
+            report["partial"] = partial
+        if memory is not None:
+            report["memory"] = memory
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, "w") as fp:
+                fp.write(text + "\n")
+        else:
+            print(text)
+    finally:
+        log.close()
+        if not args.work:
+            shutil.rmtree(work, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
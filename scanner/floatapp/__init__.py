@@ -1,9 +1,15 @@
 from flask import Flask
 from flask_login import LoginManager
+import os
 import os.path
 
 app = Flask(__name__)
-app.config.from_pyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.cfg"))
+# FLOATAPP_CONFIG names another config file, as the tests do.
+app.config.from_pyfile(os.environ.get("FLOATAPP_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.cfg")))
+# The same thumbnail settings as worker.py gives the jobs it runs, so anything
+# the app does with photos names their thumbnails the same way.
+from PhotoAlbum import Photo
+Photo.configure(app.config)
 login_manager = LoginManager()
 from floatapp import login
 login_manager.setup_app(app)
@@ -1,39 +1,38 @@
 from floatapp import app
-from floatapp.login import is_authenticated, query_is_photo_user, query_is_admin_user, photo_user, admin_user
+from floatapp.login import admin_required, is_authenticated, query_is_photo_user, query_is_admin_user, photo_user, admin_user
 from floatapp.jsonp import jsonp
-from floatapp.process import thumber_pool, thumber_works
-from floatapp.walker import  wait_and_scan, wait_and_compress
-from PhotoAlbum import Photo
+from floatapp.process import job_queue
+from PhotoList import shard_dir, manifest_file, list_file, read_shard
+from CachePath import munge, hash_cache_digest
+from ScanIndex import ScanIndex
 from flask import Response, abort, json, request, jsonify, make_response, send_file, send_from_directory
 from flask_login import login_user, current_user
-from random import shuffle
+from random import sample
+from bisect import bisect_right
+from collections import OrderedDict
 import os
+import shutil
+import sqlite3
+import tarfile
+import threading
+import time
 from mimetypes import guess_type
 
-from flask_uploads import UploadSet, configure_uploads, IMAGES
+from flask_uploads import UploadSet, configure_uploads, extension, IMAGES
 albumuploadset = UploadSet('albums', IMAGES + tuple('mp4'.split()), default_dest=lambda app:app.config['ALBUM_PATH'])
 albumuploadset.resolve_conflict = lambda folder, fname: fname
 configure_uploads(app, (albumuploadset,))
 
 cwd = os.path.dirname(os.path.abspath(__file__))
 
-def find_scanner():
-    return [jb['_jb'] for jb in thumber_works if jb['type'] == 'scanner']
-
 @app.route("/scan", methods=['GET'])
 #@admin_required
 @jsonp
 def check_scanner():
-    clean_done_jobs()
-    try:
-        walker = find_scanner()[0]
-        running = walker.ready()
-    except Exception as e:
-        walker = None
-        running = False
-        response = jsonify(code='notfound', running=False)
+    if job_queue().pending("scan"):
+        response = jsonify(code='running', running=True)
     else:
-        response = jsonify(code='running', running=running)
+        response = jsonify(code='notfound', running=False)
     response.cache_control.no_cache = True
     return response
 
@@ -42,15 +41,11 @@ def check_scanner():
 #@admin_required
 @jsonp
 def start_scanner():
-    clean_done_jobs()
-    try:
-        _ = find_scanner()[0]
+    queue = job_queue()
+    queue.clean()
+    args = dict(album_path=os.path.abspath(app.config["ALBUM_PATH"]), cache_path=os.path.abspath(app.config["CACHE_PATH"]))
+    if queue.enqueue_unique("scan", args) is None:
         abort(make_response(jsonify(code='running', running=True), 409))
-    except:
-        pass
-    args = (app.config["ALBUM_PATH"], app.config["CACHE_PATH"])
-    jb = thumber_pool.apply_async(wait_and_scan, args=args)
-    thumber_works.append(dict(type='scanner', _jb=jb))
     response = jsonify(code='started')
     response.cache_control.no_cache = True
     return response
@@ -69,16 +64,12 @@ def login():
     return ""
 
 def cache_base(path):
-    #path = path.replace('/', '-').replace(' ', '_').replace('(', '').replace('&', '').replace(',', '').replace(')', '').replace('#', '').replace('[', '').replace(']', '').replace('"', '').replace("'", '').replace('_-_', '-').lower()
-    path = path.replace(' ', '_').replace('(', '').replace('&', '').replace(',', '').replace(')', '').replace('#', '').replace('[', '').replace(']', '').replace('"', '').replace("'", '').replace('_-_', '-').lower()
-    while path.find("--") != -1:
-        path = path.replace("--", "-")
-    while path.find("__") != -1:
-        path = path.replace("__", "_")
-    if len(path) == 0:
-        path = "root"
-    return path
+    # As the scanner names cache entries, but keeping slashes.
+    return munge(path, False)
 
+# Restricted path prefixes, sorted, with any prefix that extends another one
+# dropped. The only candidate prefix of a path is then the last one sorting at
+# or before it, found by bisection.
 auth_list = [ ]
 def read_auth_list():
     global auth_list, cwd
@@ -89,16 +80,55 @@ def read_auth_list():
         paths.append(path)
         paths.append(cache_base(path))
     f.close()
-    auth_list = paths
+    paths.sort()
+    auth_list = [ ]
+    for path in paths:
+        if len(auth_list) == 0 or not path.startswith(auth_list[-1]):
+            auth_list.append(path)
 
-# TODO: Make this run via inotify
-read_auth_list()
+def reload_auth_list():
+    # Picks up edits to auth.txt, checking its mtime at most once a second.
+    now = time.time()
+    if now - reload_auth_list.checked < 1:
+        return
+    reload_auth_list.checked = now
+    stat = os.stat(os.path.join(cwd, "auth.txt"))
+    mtime = (stat.st_mtime_ns, stat.st_size)
+    if mtime != reload_auth_list.mtime:
+        read_auth_list()
+        reload_auth_list.mtime = mtime
+reload_auth_list.checked = 0
+reload_auth_list.mtime = None
+reload_auth_list()
+
+def is_restricted(path):
+    index = bisect_right(auth_list, path)
+    return index > 0 and path.startswith(auth_list[index - 1])
 
 def check_permissions(path):
     if not is_authenticated():
-        for auth_path in auth_list:
-            if path.startswith(auth_path):
-                abort(403)
+        reload_auth_list()
+        if is_restricted(path):
+            abort(403)
+
+# Content-addressed thumbnails (cache/objects/) are named after a hash of the
+# photo rather than its path, so auth.txt cannot restrict them by prefix. While
+# it restricts anything, one is only public if some photo the scan index lists
+# with that hash is; without a scan index, none are. One connection per thread.
+indexes = threading.local()
+def object_is_public(digest):
+    try:
+        if not hasattr(indexes, "index"):
+            indexes.index = ScanIndex(app.config["CACHE_PATH"], readonly=True)
+        paths = indexes.index.hash_paths(digest)
+    except sqlite3.Error:
+        return False
+    return any(not is_restricted(path) for path in paths)
+
+def check_object_permissions(path):
+    digest = hash_cache_digest(path)
+    if digest is not None and not is_authenticated() and len(auth_list) != 0 and not object_is_public(digest):
+        abort(403)
 
 
 @app.route("/albums/<path:path>")
@@ -109,7 +139,11 @@ def albums(path):
 
 @app.route("/cache/<path:path>")
 def cache(path):
+    # Dotfiles in the cache directory (such as the scan index) are private to the scanner.
+    if os.path.basename(path).startswith("."):
+        abort(404)
     check_permissions(path)
+    check_object_permissions(path)
     return accel_redirect(app.config["CACHE_ACCEL"], app.config["CACHE_PATH"], path)
 
 @app.route('/<path:path>')
@@ -118,46 +152,151 @@ def send_js(path):
     print(f'{os.getcwd()}')
     return send_from_directory('/home/sumit/wksc/personal/PhotoFloat/web', path)
 
+def json_encoding(real_path):
+    # The best pre-compressed copy of a scanner-written JSON file the client takes,
+    # as (file suffix, Content-Encoding, ETag). The ETag comes from the scanner's
+    # sidecar file, so the JSON itself is never read here.
+    try:
+        f = open(real_path + ".etag", "r")
+        etag = f.read().strip()
+        f.close()
+    except OSError:
+        return "", None, None
+    for suffix, encoding in ((".br", "br"), (".gz", "gzip")):
+        if request.accept_encodings[encoding] and os.path.isfile(real_path + suffix):
+            return suffix, encoding, etag + "-" + encoding
+    return "", None, etag
+
 def accel_redirect(internal, real, relative_name):
     real_path = os.path.join(real, relative_name)
-    if app.config["DEBUG"]:
-        return send_file(real_path)
-    internal_path = os.path.join(internal, relative_name)
-    if not os.path.isfile(real_path):
-        abort(405)
     mimetype = None
     types = guess_type(real_path)
     if len(types) != 0:
         mimetype = types[0]
-    response = Response(mimetype=mimetype)
-    response.headers.add("X-Accel-Redirect", internal_path)
-    response.cache_control.public = True
+    suffix, encoding, etag = "", None, None
     if mimetype == "application/json":
+        suffix, encoding, etag = json_encoding(real_path)
+    if etag is not None and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif app.config["DEBUG"]:
+        response = send_file(real_path + suffix, mimetype=mimetype, etag=etag is None)
+    else:
+        internal_path = os.path.join(internal, relative_name)
+        if not os.path.isfile(real_path):
+            abort(405)
+        response = Response(mimetype=mimetype)
+        response.headers.add("X-Accel-Redirect", internal_path + suffix)
+    response.cache_control.public = True
+    if mimetype == "application/json" and etag is not None:
+        # Revalidated on every use, which the ETag makes a cheap 304.
+        response.cache_control.no_cache = True
+        response.vary.add("Accept-Encoding")
+    elif mimetype == "application/json":
+        # The photo lists have no ETag to revalidate against, so they are cached for a while.
         response.cache_control.max_age = 3600
     else:
         response.cache_control.max_age = 29030400
+    if etag is not None:
+        # nginx does not pass these on through X-Accel-Redirect, so the internal
+        # location adds them back from the X-Photofloat-* copies.
+        response.set_etag(etag)
+        response.headers["X-Photofloat-ETag"] = response.headers["ETag"]
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+        response.headers["X-Photofloat-Encoding"] = encoding
     return response
 
+# The photo list is read one month shard at a time, as /photos needs them. The
+# shards read are kept, filtered for visitors who are not logged in, until they
+# hold more than shard_cache_size photos, when the least recently used go. A
+# cache from before the shards only has all_photos.json, read as a single shard
+# (named None), and one with neither lists no photos. Everything is dropped when
+# the manifest (or auth.txt) changes.
+shard_cache_size = 200000
+photo_lists = dict(generation=None, shards=[], counts={}, cache=OrderedDict(), size=0)
+def photo_shards():
+    # (name, photo count or None) of every shard, oldest first.
+    global photo_lists
+    reload_auth_list()
+    path = os.path.join(app.config["CACHE_PATH"], shard_dir, manifest_file)
+    if not os.path.exists(path):
+        path = os.path.join(app.config["CACHE_PATH"], list_file)
+    try:
+        stat = os.stat(path)
+        generation = (path, stat.st_mtime_ns, stat.st_size, reload_auth_list.mtime)
+    except FileNotFoundError:
+        generation = None
+    if photo_lists["generation"] != generation or generation is None:
+        shards = []
+        if generation is not None and os.path.basename(path) == manifest_file:
+            f = open(path, "r")
+            shards = [(shard["name"], shard["count"]) for shard in json.load(f)["shards"]]
+            f.close()
+        elif generation is not None:
+            shards = [(None, None)]
+        photo_lists = dict(generation=generation, shards=shards, counts={}, cache=OrderedDict(), size=0)
+    return photo_lists["shards"]
+
+def shard_photos(name, public):
+    # The paths of a shard, oldest first; if public, only those visible without logging in.
+    cache = photo_lists["cache"]
+    if (name, public) in cache:
+        cache.move_to_end((name, public))
+        return cache[(name, public)]
+    if name is None:
+        f = open(os.path.join(app.config["CACHE_PATH"], list_file), "r")
+        photos = json.load(f)
+        f.close()
+    else:
+        photos = [path for date, path in read_shard(app.config["CACHE_PATH"], name)]
+    if public:
+        photos = [photo for photo in photos if not is_restricted(photo)]
+    photo_lists["counts"][(name, public)] = len(photos)
+    cache[(name, public)] = photos
+    photo_lists["size"] += len(photos)
+    while photo_lists["size"] > shard_cache_size and len(cache) > 1:
+        evicted = cache.popitem(last=False)[1]
+        photo_lists["size"] -= len(evicted)
+    return photos
+
+def shard_count(name, count, public):
+    # The manifest has the counts of whole shards; the others are known once read.
+    if not public and count is not None:
+        return count
+    if (name, public) not in photo_lists["counts"]:
+        shard_photos(name, public)
+    return photo_lists["counts"][(name, public)]
+
 @app.route("/photos")
 @jsonp
 def photos():
-    f = open(os.path.join(app.config["CACHE_PATH"], "all_photos.json"), "r")
-    photos = json.load(f)
-    f.close()
-    if not is_authenticated():
-        def allowed(photo):
-            for auth_path in auth_list:
-                if photo.startswith(auth_path):
-                    return False
-            return True
-        photos = [photo for photo in photos if allowed(photo)]
-    count = int(request.args.get("count", len(photos)))
+    public = not is_authenticated()
+    shards = photo_shards()
+    counts = [shard_count(name, count, public) for name, count in shards]
+    starts = [sum(counts[:i]) for i in range(len(counts))]
+    total = sum(counts)
+    count = max(0, min(int(request.args.get("count", total)), total))
     random = request.args.get("random") == "true"
+    # Only the shards holding the photos returned are read: the newest ones, or
+    # those of a sample of positions in the whole list, visited in order.
+    photos = []
     if random:
-        shuffle(photos)
+        picked = sample(range(total), count)
+        found = dict()
+        for index in sorted(picked):
+            shard = bisect_right(starts, index) - 1
+            items = shard_photos(shards[shard][0], public)
+            # A shard rewritten since the manifest was read may have shrunk.
+            if index - starts[shard] < len(items):
+                found[index] = items[index - starts[shard]]
+        photos = [found[index] for index in picked if index in found]
     else:
-        photos.reverse()
-    response = jsonify(photos=photos[0:count])
+        for shard in reversed(shards):
+            if len(photos) >= count:
+                break
+            items = shard_photos(shard[0], public)
+            photos.extend(reversed(items[max(0, len(items) - (count - len(photos))):]))
+    response = jsonify(photos=photos)
     response.cache_control.no_cache = True
     return response
 
@@ -173,39 +312,109 @@ def upload():
                 request.files['pic'],
                 folder=request.form.get('album_path'))
     filepath = os.path.abspath(os.path.sep.join([app.config["ALBUM_PATH"], filename]))
-    cache_path = os.path.abspath(app.config["CACHE_PATH"])
-    args = (filepath, cache_path)
-    kwds = dict(
-            album_base=app.config['ALBUM_PATH'],
-            compress=True
-            )
-    clean_done_jobs()
-    thumber_works.append(dict(
-                type='thumber',
-                filename=filename,
-                album_path=request.form.get('album_path'),
-                _jb=thumber_pool.apply_async(wait_and_compress, args=args, kwds=kwds)
+    queue = job_queue()
+    queue.clean()
+    queue.enqueue("ingest", dict(
+                path=filepath,
+                cache_path=os.path.abspath(app.config["CACHE_PATH"]),
+                album_base=os.path.abspath(app.config['ALBUM_PATH'])
                 ))
     response = jsonify(msg=filename)
     response.cache_control.no_cache = True
     return response
 
 
+def upload_target(folder, name):
+    # Where an uploaded file goes, or None if it is not an allowed image or would
+    # land outside the album directory. Absolute names and names with ".." are
+    # refused rather than cleaned up, as tar archives should not have them.
+    album_path = os.path.abspath(app.config["ALBUM_PATH"])
+    folder = os.path.normpath(os.path.join(album_path, folder))
+    if os.path.commonpath([folder, album_path]) != album_path:
+        return None
+    if name.startswith("/") or ".." in name.split("/"):
+        return None
+    parts = [albumuploadset.get_basename(part) for part in name.split("/") if part not in ("", ".")]
+    if len(parts) == 0 or "" in parts or not albumuploadset.extension_allowed(extension(parts[-1])):
+        return None
+    return os.path.join(folder, *parts)
+
+def save_upload(stream, target):
+    # Copied in chunks to a hidden name first, so the scanner never sees half a file.
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    partial = os.path.join(os.path.dirname(target), ".upload-" + os.path.basename(target))
+    try:
+        with open(partial, "wb") as fp:
+            shutil.copyfileobj(stream, fp, 1 << 20)
+    except BaseException:
+        try:
+            os.unlink(partial)
+        except FileNotFoundError:
+            pass
+        raise
+    os.rename(partial, target)
+
+@app.route("/upload_batch", methods=['POST'])
+@admin_required
+@jsonp
+def upload_batch():
+    # Many files at once, either as multipart "pic" fields or as a tar stream
+    # (Content-Type: application/x-tar, with album_path in the query string),
+    # queued as a single job.
+    folder = request.args.get('album_path', '') or request.form.get('album_path', '')
+    if folder == '':
+        abort(make_response(jsonify(code='msg', msg='album path is missing'), 400))
+    paths = []
+    skipped = []
+    if request.mimetype == "application/x-tar":
+        with tarfile.open(fileobj=request.stream, mode="r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    # Links, devices and the like are never written; directories come with their files.
+                    if not member.isdir():
+                        skipped.append(member.name)
+                    continue
+                target = upload_target(folder, member.name)
+                if target is None:
+                    skipped.append(member.name)
+                    continue
+                save_upload(tar.extractfile(member), target)
+                paths.append(target)
+    else:
+        for storage in request.files.getlist('pic'):
+            target = upload_target(folder, storage.filename or "")
+            if target is None:
+                skipped.append(storage.filename)
+                continue
+            save_upload(storage.stream, target)
+            paths.append(target)
+    if len(paths) == 0:
+        abort(make_response(jsonify(code='msg', msg='no pictures', skipped=skipped), 400))
+    queue = job_queue()
+    queue.clean()
+    id = queue.enqueue("ingest_batch", dict(
+                paths=paths,
+                cache_path=os.path.abspath(app.config["CACHE_PATH"]),
+                album_base=os.path.abspath(app.config['ALBUM_PATH'])
+                ), total=len(paths))
+    album_path = os.path.abspath(app.config["ALBUM_PATH"])
+    response = jsonify(job=id, msg=[os.path.relpath(path, album_path) for path in paths], skipped=skipped)
+    response.cache_control.no_cache = True
+    return response
+
+
 def thumber_status():
-    for jb in [x for x in thumber_works if x['type'] == 'thumber']:
-        jb.update(dict(done="%s, %s" % (jb['_jb'].ready(), jb['_jb'].successful())))
-        yield jb
+    for id, state, args, error, done, total in job_queue().jobs("ingest") + job_queue().jobs("ingest_batch"):
+        finished = state in ("done", "failed")
+        yield dict(done="%s, %s" % (finished, state == "done"), job=id, state=state, progress=done, total=total)
 
 
 @app.route("/upload_status")
 @jsonp
 def upload_status():
-    response = jsonify(working=[i['done'] for i in thumber_status()])
+    jobs = list(thumber_status())
+    response = jsonify(working=[i['done'] for i in jobs],
+                       jobs=[dict(job=i['job'], state=i['state'], done=i['progress'], total=i['total']) for i in jobs],
+                       done=sum(i['progress'] for i in jobs), total=sum(i['total'] for i in jobs))
     response.cache_control.no_cache = True
     return response
-
-
-def clean_done_jobs():
-    for jb in list(thumber_works):
-        if jb['_jb'].ready():
-            thumber_works.remove(jb)
@@ -26,7 +26,7 @@ def unauthorized():
 def login_required(fn):
     @wraps(fn)
     def decorated_view(*args, **kwargs):
-        if query_is_admin_user(request.args) or query_is_photo_user(request.args) or current_user.is_authenticated():
+        if query_is_admin_user(request.args) or query_is_photo_user(request.args) or current_user.is_authenticated:
             return fn(*args, **kwargs)
         return app.login_manager.unauthorized()
     return decorated_view
@@ -34,7 +34,7 @@ def login_required(fn):
 def admin_required(fn):
     @wraps(fn)
     def decorated_view(*args, **kwargs):
-        if query_is_admin_user(request.args) or (current_user.is_authenticated() and current_user.admin):
+        if query_is_admin_user(request.args) or (current_user.is_authenticated and current_user.admin):
             return fn(*args, **kwargs)
         return app.login_manager.unauthorized()
     return decorated_view
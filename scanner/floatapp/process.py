@@ -1,5 +1,11 @@
-from multiprocessing import Pool
+from floatapp import app
+from JobQueue import JobQueue
+import threading
 
-thumber_works = list()
-thumber_pool = Pool(1)
-walker = None
+# Uploads and scans are queued for worker.py, so that every gunicorn worker
+# sees the same jobs and they survive restarts. One connection per thread.
+connections = threading.local()
+def job_queue():
+    if not hasattr(connections, "queue"):
+        connections.queue = JobQueue(app.config["CACHE_PATH"])
+    return connections.queue
@@ -1,23 +1,83 @@
 #!/usr/bin/env python3
 
-from TreeWalker import TreeWalker
-from CachePath import message
+from TreeWalker import TreeWalker, Progress
+from CachePath import message, setup_logging, NOTICE
+from PhotoAlbum import Photo, Album
+import argparse
+import logging
 import sys
 import os
 import imp
 
+def read_config(path):
+    # Same format as the Flask app.cfg: Python assignments of UPPERCASE names.
+    config = {}
+    with open(path) as fp:
+        exec(compile(fp.read(), path, "exec"), config)
+    return dict((key, value) for key, value in config.items() if key.isupper())
+
+def add_logging_arguments(parser):
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="only log problems")
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="also log each directory; -vv also logs each file")
+
+def log_level(args):
+    if args.quiet:
+        return logging.WARNING
+    return [NOTICE, logging.INFO, logging.DEBUG][min(args.verbose, 2)]
+
 def main():
     imp.reload(sys)
 
-    if len(sys.argv) != 3:
-        print("usage: %s ALBUM_PATH CACHE_PATH" % sys.argv[0])
-        return
+    parser = argparse.ArgumentParser(description="Scan ALBUM_PATH and populate CACHE_PATH with album JSON and thumbnails.")
+    parser.add_argument("album_path", metavar="ALBUM_PATH")
+    parser.add_argument("cache_path", metavar="CACHE_PATH")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                        help="build photo metadata and thumbnails in N worker processes (default: 1)")
+    parser.add_argument("--index", action="store_true",
+                        help="keep a scan index in CACHE_PATH and only rewrite album JSON that changed")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only re-walk the directories recorded by watcher.py, and their ancestors (implies --index)")
+    parser.add_argument("--config", metavar="FILE",
+                        help="read THUMB_SIZES, THUMB_FORMATS, CONTENT_ADDRESSED, FAST_EXIF, SYNC_WRITES, ALBUM_SCHEMA, ALBUM_PAGE_SIZE "
+                             "and BROTLI_QUALITY from FILE, e.g. floatapp/app.cfg")
+    parser.add_argument("--content-addressed", action="store_true",
+                        help="name thumbnails after a hash of each original's contents, so copies and moved "
+                             "directories share them (same as CONTENT_ADDRESSED = True in the config)")
+    parser.add_argument("--fsync", action="store_true",
+                        help="flush every file written to disk before moving it into place, so even a power "
+                             "failure cannot leave a cache file cut short (same as SYNC_WRITES = True in the config)")
+    parser.add_argument("--stats", metavar="FILE",
+                        help="write the time spent in each stage of the scan, in all and for the slowest "
+                             "directories, to FILE as JSON (- for standard output)")
+    parser.add_argument("--prometheus", metavar="FILE",
+                        help="write the stage times to FILE in the Prometheus text format, e.g. for "
+                             "node_exporter's textfile collector")
+    parser.add_argument("--progress", type=int, default=Progress.interval, metavar="SECONDS",
+                        help="log files done, files per second, cache hits and the time left every SECONDS "
+                             "(default: %d; 0 for never)" % Progress.interval)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging(log_level(args))
+    Progress.interval = args.progress
     try:
         os.umask(0o22)
-        TreeWalker(sys.argv[1], sys.argv[2])
+        config = read_config(args.config) if args.config else {}
+        if args.content_addressed:
+            config["CONTENT_ADDRESSED"] = True
+        if args.fsync:
+            config["SYNC_WRITES"] = True
+        Photo.configure(config)
+        Album.configure(config)
+        walker = TreeWalker(args.album_path, args.cache_path, jobs=args.jobs, index=args.index, incremental=args.incremental)
+        if args.stats:
+            walker.stats.write_json(args.stats)
+        if args.prometheus:
+            walker.stats.write_prometheus(args.prometheus)
     except KeyboardInterrupt:
         message("keyboard", "CTRL+C pressed, quitting.")
         sys.exit(-97)
-    
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+from CachePath import message, set_cache_path_base, trim_base
+from ChangeJournal import record_dirty
+import argparse
+import os
+import os.path
+import sys
+import time
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+def album_dirs(album_path):
+    # Same directories the scanner walks: dotfiles are skipped.
+    for root, dirs, files in os.walk(album_path):
+        dirs[:] = [d for d in dirs if d[0] != '.']
+        yield root
+
+def watch_inotify(album_path, cache_path, delay):
+    inotify = INotify()
+    mask = flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO | flags.CLOSE_WRITE | flags.ATTRIB
+    watches = {}
+    def add_watches(path):
+        for directory in album_dirs(path):
+            try:
+                watches[inotify.add_watch(directory, mask)] = directory
+            except OSError:
+                message("watch failure", directory)
+    add_watches(album_path)
+    message("watching", "%d directories with inotify" % len(watches))
+    while True:
+        dirty = set()
+        for event in inotify.read(read_delay=int(delay * 1000)):
+            if event.mask & flags.Q_OVERFLOW:
+                message("overflow", "events lost, marking everything dirty")
+                dirty.update(watches.values())
+                continue
+            if event.mask & flags.IGNORED:
+                watches.pop(event.wd, None)
+                continue
+            directory = watches.get(event.wd)
+            if directory is None:
+                continue
+            dirty.add(directory)
+            if event.mask & flags.ISDIR and event.mask & (flags.CREATE | flags.MOVED_TO):
+                # New (or moved) subtrees need watching, and are new to the scanner too.
+                subtree = os.path.join(directory, event.name)
+                add_watches(subtree)
+                dirty.add(subtree)
+        dirty = sorted(trim_base(directory) for directory in dirty)
+        for directory in dirty:
+            message("dirty", directory or ".")
+        record_dirty(cache_path, dirty)
+
+def watch_polling(album_path, cache_path, interval):
+    def snapshot():
+        mtimes = {}
+        for directory in album_dirs(album_path):
+            try:
+                mtimes[directory] = os.stat(directory).st_mtime
+            except OSError:
+                pass
+        return mtimes
+    mtimes = snapshot()
+    message("watching", "%d directories by polling every %ds" % (len(mtimes), interval))
+    while True:
+        time.sleep(interval)
+        current = snapshot()
+        dirty = set(directory for directory, mtime in current.items() if mtimes.get(directory) != mtime)
+        # A removed directory changes its parent's listing as well, so that is enough.
+        dirty.update(os.path.dirname(directory) for directory in mtimes if directory not in current and directory != album_path)
+        dirty = sorted(trim_base(directory) for directory in dirty)
+        for directory in dirty:
+            message("dirty", directory or ".")
+        record_dirty(cache_path, dirty)
+        mtimes = current
+
+def main():
+    parser = argparse.ArgumentParser(description="Record directories of ALBUM_PATH that change, for main.py --incremental.")
+    parser.add_argument("album_path", metavar="ALBUM_PATH")
+    parser.add_argument("cache_path", metavar="CACHE_PATH")
+    parser.add_argument("--poll", type=int, default=0, metavar="SECONDS",
+                        help="poll directory mtimes every SECONDS instead of using inotify "
+                             "(does not notice files rewritten in place)")
+    parser.add_argument("--delay", type=float, default=1.0, metavar="SECONDS",
+                        help="with inotify, collect events for SECONDS before recording them (default: 1)")
+    args = parser.parse_args()
+    album_path = os.path.abspath(args.album_path)
+    cache_path = os.path.abspath(args.cache_path)
+    set_cache_path_base(album_path)
+    try:
+        if args.poll == 0 and INotify is not None:
+            watch_inotify(album_path, cache_path, args.delay)
+        else:
+            if args.poll == 0:
+                message("no inotify", "install inotify_simple for event-driven watching; polling instead")
+            watch_polling(album_path, cache_path, args.poll or 60)
+    except KeyboardInterrupt:
+        message("keyboard", "CTRL+C pressed, quitting.")
+        sys.exit(-97)
+
+if __name__ == "__main__":
+    main()
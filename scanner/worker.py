@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+from CachePath import message, setup_logging
+from Ingest import ingest, ingest_batch
+from JobQueue import JobQueue, worker_name
+from PhotoAlbum import Photo, Album
+from TreeWalker import TreeWalker
+from main import read_config, add_logging_arguments, log_level
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
+import os.path
+import sys
+import time
+import traceback
+
+# How each job type queued by FloatApp is run; args are what it was queued with,
+# and progress(done) reports how many of the job's items are finished.
+def scan_job(progress, album_path, cache_path):
+    TreeWalker(album_path, cache_path)
+
+def ingest_job(progress, path, cache_path, album_base):
+    ingest(path, album_base, cache_path)
+
+def ingest_batch_job(progress, paths, cache_path, album_base):
+    # One bad file does not hold up the rest of the batch.
+    photos, failed = ingest_batch(paths, album_base, cache_path, progress)
+    if failed:
+        raise ValueError("could not ingest: %s" % ", ".join(failed))
+
+handlers = { "scan": scan_job, "ingest": ingest_job, "ingest_batch": ingest_batch_job }
+
+def work(cache_path, config, idle):
+    Photo.configure(config)
+    Album.configure(config)
+    queue = JobQueue(cache_path)
+    name = worker_name()
+    while True:
+        job = queue.claim(name)
+        if job is None:
+            time.sleep(idle)
+            continue
+        id, type, args = job
+        message("job", "%d: %s %s" % (id, type, args))
+        error = None
+        try:
+            handlers[type](lambda done: queue.progress(id, done), **args)
+        except KeyboardInterrupt:
+            raise
+        except:
+            traceback.print_exc()
+            error = traceback.format_exc()
+        queue.finish(id, error)
+        message("job", "%d: %s" % (id, "failed" if error else "done"))
+
+# A job that has taken down this many worker processes (the kernel's OOM killer,
+# on a huge photo, say) fails instead of being queued for the next one.
+max_crashes = 3
+
+def supervise(cache_path, config, idle, jobs):
+    # Processes, not threads: a scan keeps its settings and stats in module state.
+    # A worker that dies is replaced, and the job it was running queued again.
+    workers = {}
+    def start():
+        worker = multiprocessing.Process(target=work, args=(cache_path, config, idle))
+        worker.start()
+        workers[worker.sentinel] = worker
+    for i in range(jobs):
+        start()
+    queue = JobQueue(cache_path)
+    crashes = {}
+    while True:
+        for sentinel in multiprocessing.connection.wait(list(workers)):
+            worker = workers.pop(sentinel)
+            worker.join()
+            message("worker died", "process %d, exit code %s" % (worker.pid, worker.exitcode))
+            for id in queue.running(worker_name(worker.pid)):
+                crashes[id] = crashes.get(id, 0) + 1
+                if crashes[id] >= max_crashes:
+                    message("job", "%d: failed, it took down %d workers" % (id, crashes[id]))
+                    queue.finish(id, "worker process died %d times running this job" % crashes[id])
+                else:
+                    message("requeued", "job %d" % id)
+                    queue.requeue(id)
+            start()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the thumbnail and scan jobs FloatApp queues in CACHE_PATH.")
+    parser.add_argument("cache_path", metavar="CACHE_PATH", nargs="?",
+                        help="defaults to CACHE_PATH of the --config file")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                        help="run up to N jobs at once, in N processes (default: 1)")
+    parser.add_argument("--config", metavar="FILE",
+                        help="read CACHE_PATH and the thumbnail and album settings from FILE, e.g. floatapp/app.cfg")
+    parser.add_argument("--idle", type=float, default=1.0, metavar="SECONDS",
+                        help="wait SECONDS before looking again when there is nothing to do (default: 1)")
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    setup_logging(log_level(args))
+    config = read_config(args.config) if args.config else {}
+    cache_path = args.cache_path or config.get("CACHE_PATH")
+    if not cache_path:
+        parser.error("no CACHE_PATH given")
+    cache_path = os.path.abspath(cache_path)
+    try:
+        os.umask(0o22)
+        queue = JobQueue(cache_path)
+        requeued = queue.requeue_orphans()
+        if requeued:
+            message("requeued", "%d jobs left running by a previous worker" % requeued)
+        queue.close()
+        message("working", "%d processes on %s" % (args.jobs, cache_path))
+        if args.jobs == 1:
+            work(cache_path, config, args.idle)
+            return
+        supervise(cache_path, config, args.idle, args.jobs)
+    except KeyboardInterrupt:
+        message("keyboard", "CTRL+C pressed, quitting.")
+        sys.exit(-97)
+
+if __name__ == "__main__":
+    main()
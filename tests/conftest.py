@@ -0,0 +1,5 @@
+import os.path
+import sys
+
+# The scanner's modules import each other by name, as main.py runs them.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "scanner"))
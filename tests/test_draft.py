@@ -0,0 +1,51 @@
+from CachePath import set_cache_path_base
+from PhotoAlbum import Photo
+from PIL import Image, ImageChops
+from benchmark import make_photo
+import math
+import random
+import pytest
+
+# Thumbnails made with draft decoding (Photo.draft_decode), where the JPEG
+# decoder scales the original down first (by 1/2, 1/4 or 1/8 here), against
+# those made from a full decode.
+min_psnr = 35.0
+ladders = [
+    [(1024, False, 75), (150, True, 75)],
+    [(512, False, 75), (150, True, 75)],
+    [(1600, False, 85), (512, False, 75), (256, True, 75), (150, True, 75)],
+]
+
+def psnr(a, b):
+    histogram = ImageChops.difference(a.convert("RGB"), b.convert("RGB")).histogram()
+    squares = sum(count * (value % 256) ** 2 for value, count in enumerate(histogram))
+    mse = squares / float(a.size[0] * a.size[1] * 3)
+    return float("inf") if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+@pytest.fixture
+def thumb_settings():
+    saved = (Photo.thumb_sizes, Photo.thumb_formats, Photo.draft_decode)
+    yield
+    Photo.thumb_sizes, Photo.thumb_formats, Photo.draft_decode = saved
+
+@pytest.mark.parametrize("ladder", ladders)
+@pytest.mark.parametrize("size,orientation", [((1600, 1200), 1), ((3000, 2000), 6), ((4000, 3000), 1), ((6000, 4000), 8)])
+def test_draft_thumbnails_match_full_decode(tmp_path, thumb_settings, ladder, size, orientation):
+    Photo.configure({ "THUMB_SIZES": ladder, "THUMB_FORMATS": ["jpg"] })
+    albums = tmp_path / "albums"
+    albums.mkdir()
+    path = str(albums / "photo.jpg")
+    make_photo(path, size, orientation, 1262304000, random.Random(1))
+    set_cache_path_base(str(albums))
+    thumbs = dict()
+    for draft in (True, False):
+        Photo.draft_decode = draft
+        cache = tmp_path / ("draft" if draft else "full")
+        cache.mkdir()
+        photo = Photo(path, str(cache))
+        assert photo.is_valid
+        thumbs[draft] = [str(cache / entry) for entry in photo.image_caches]
+    for drafted, full in zip(thumbs[True], thumbs[False]):
+        with Image.open(drafted) as a, Image.open(full) as b:
+            assert a.size == b.size
+            assert psnr(a, b) >= min_psnr, drafted
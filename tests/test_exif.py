@@ -0,0 +1,181 @@
+from ExifReader import exif_tags, read_metadata
+from PhotoAlbum import Photo
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+import struct
+import pytest
+
+# ExifReader's tags, from the file headers (read_metadata) and from the APP1
+# segment Pillow kept (exif_tags), against Pillow's _getexif, on JPEGs with
+# hand-built EXIF: they must give Photo the same attributes.
+ascii, short, long, rational, srational, floating = 2, 3, 4, 5, 10, 11
+units = { ascii: 1, short: 2, long: 4, rational: 8, srational: 8, floating: 4 }
+formats = { short: "H", long: "L", rational: "L", srational: "l", floating: "f" }
+
+def encode(endian, type, value):
+    if type == ascii:
+        return value
+    if type in (rational, srational):
+        value = [number for pair in value for number in pair]
+    return struct.pack("%s%d%s" % (endian, len(value), formats[type]), *value)
+
+def tiff(endian, ifd0, details=None):
+    # A TIFF header and IFD0 (and an Exif IFD, if details are given), each entry
+    # as (tag, type, value): bytes for ASCII, a tuple of numbers (or of pairs of
+    # them, for rationals) for the others.
+    mark = b"II*\0" if endian == "<" else b"MM\0*"
+    ifds = [sorted(ifd0 + ([(0x8769, long, (0,))] if details is not None else []))]
+    if details is not None:
+        ifds.append(sorted(details))
+    offsets = []
+    offset = 8
+    for entries in ifds:
+        offsets.append(offset)
+        offset += 2 + len(entries) * 12 + 4
+    data = b""
+    out = []
+    for number, entries in enumerate(ifds):
+        out.append(struct.pack(endian + "H", len(entries)))
+        for tag, type, value in entries:
+            if tag == 0x8769:
+                value = (offsets[1],)
+            payload = encode(endian, type, value)
+            count = len(payload) // units[type]
+            if len(payload) <= 4:
+                field = payload.ljust(4, b"\0")
+            else:
+                field = struct.pack(endian + "L", offset + len(data))
+                data += payload + b"\0" * (len(payload) % 2)
+            out.append(struct.pack(endian + "HHL", tag, type, count) + field)
+        out.append(b"\0\0\0\0")
+    return mark + struct.pack(endian + "L", 8) + b"".join(out) + data
+
+def camera(endian):
+    return tiff(endian, [
+        (0x010f, ascii, b"Canon\0\0\0\0"),
+        (0x0110, ascii, b"EOS 5D\0"),
+        (0x0112, short, (6,)),
+        (0x0132, ascii, b"2010:01:02 03:04:05\0"),
+    ], [
+        (0x829a, rational, ((1, 250),)),
+        (0x829d, rational, ((28, 10),)),
+        (0x8827, short, (100, 200)),
+        (0x9003, ascii, b"2010:01:01 10:00:00\0"),
+        (0x9202, rational, ((0, 0),)),
+        (0x9204, srational, ((-1, 3),)),
+        (0x9207, short, (5,)),
+        (0x9208, short, (1,)),
+        (0x9209, short, (0x19,)),
+        (0x920a, rational, ((50, 0),)),
+        (0x8822, short, (2,)),
+        (0xa217, short, (2,)),
+        (0xa406, short, (1,)),
+        (0xa40c, short, (3,)),
+    ])
+
+def save(path, exif=None, xmp=None, size=(64, 48)):
+    options = {}
+    if exif is not None:
+        options["exif"] = b"Exif\0\0" + exif
+    if xmp is not None:
+        options["xmp"] = xmp
+    Image.new("RGB", size, (90, 120, 150)).save(path, "JPEG", **options)
+    return path
+
+def plain(value):
+    # IFDRationals by their parts, as one with a zero denominator equals nothing.
+    if isinstance(value, IFDRational):
+        return ("rational", value.numerator, value.denominator)
+    if isinstance(value, (tuple, list)):
+        return tuple(plain(item) for item in value)
+    return value
+
+def attributes(size, info):
+    photo = Photo.__new__(Photo)
+    photo._attributes = {}
+    photo._exif_metadata(size, info)
+    return dict((key, plain(value)) for key, value in photo._attributes.items()), photo._orientation
+
+def pillow(path):
+    with Image.open(path) as image:
+        return attributes(image.size, image._getexif())
+
+def from_headers(path):
+    header = read_metadata(path)
+    assert header is not None
+    return attributes(*header)
+
+def from_segment(path):
+    with Image.open(path) as image:
+        info = exif_tags(image.info.get("exif"), image.info.get("xmp"))
+        assert info is not None
+        return attributes(image.size, info)
+
+xmp_orientation = b'<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">' \
+    b'<rdf:Description xmlns:tiff="http://ns.adobe.com/tiff/1.0/" tiff:Orientation="8"/></rdf:RDF></x:xmpmeta>'
+
+cases = {
+    "little_endian": lambda path: save(path, camera("<")),
+    "big_endian": lambda path: save(path, camera(">")),
+    "no_exif": lambda path: save(path),
+    "xmp_orientation": lambda path: save(path, tiff("<", [(0x010f, ascii, b"Nikon\0")]), xmp_orientation),
+    "xmp_without_exif": lambda path: save(path, xmp=xmp_orientation),
+}
+
+@pytest.mark.parametrize("case", sorted(cases))
+def test_exif_reader_matches_pillow(tmp_path, case):
+    path = cases[case](str(tmp_path / "photo.jpg"))
+    expected = pillow(path)
+    assert from_headers(path) == expected
+    assert from_segment(path) == expected
+
+def test_exif_reader_reads_the_awkward_fields(tmp_path):
+    # What the cases above rely on, so they cannot pass by reading nothing.
+    attributes, orientation = from_headers(save(str(tmp_path / "photo.jpg"), camera(">")))
+    assert orientation == 6
+    assert attributes["size"] == (48, 64)
+    assert attributes["make"] == "Canon"
+    assert attributes["iso"] == (100, 200)
+    assert attributes["aperture"] == ("rational", 0, 0)
+    assert attributes["focalLength"] == ("rational", 50, 0)
+    assert attributes["exposureCompensation"] == ("rational", -1, 3)
+    assert attributes["flash"] == "Auto, Fired"
+    attributes, orientation = from_headers(cases["xmp_orientation"](str(tmp_path / "xmp.jpg")))
+    assert orientation == 8
+
+def unsupported_exif():
+    # A float where Pillow reads the field and ExifReader does not.
+    return tiff("<", [(0x010f, ascii, b"Canon\0")], [(0x829a, floating, (0.004,))])
+
+def test_exif_reader_leaves_unusual_input_to_pillow(tmp_path):
+    path = save(str(tmp_path / "float.jpg"), unsupported_exif())
+    assert read_metadata(path) is None
+    with Image.open(path) as image:
+        assert exif_tags(image.info.get("exif")) is None
+    assert exif_tags(b"Exif\0\0XX*\0\0\0\0\0") is None
+    assert exif_tags(b"Exif\0\0II*\0\xff\xff\0\0") is None
+    assert exif_tags(camera("<")[:40]) is None
+
+    data = open(save(str(tmp_path / "full.jpg"), camera("<")), "rb").read()
+    truncated = tmp_path / "truncated.jpg"
+    truncated.write_bytes(data[:60])
+    assert read_metadata(str(truncated)) is None
+    png = tmp_path / "photo.png"
+    Image.new("RGB", (8, 8)).save(str(png))
+    assert read_metadata(str(png)) is None
+
+@pytest.fixture
+def fast_exif():
+    saved = Photo.fast_exif
+    Photo.fast_exif = True
+    yield
+    Photo.fast_exif = saved
+
+def test_photo_falls_back_to_pillow(tmp_path, fast_exif):
+    path = save(str(tmp_path / "float.jpg"), unsupported_exif())
+    photo = Photo.__new__(Photo)
+    photo._attributes = {}
+    with Image.open(path) as image:
+        photo._metadata(image)
+    assert (dict((key, plain(value)) for key, value in photo._attributes.items()), photo._orientation) == pillow(path)
+    assert photo._attributes["exposureTime"] == pytest.approx(0.004)
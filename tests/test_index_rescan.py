@@ -0,0 +1,62 @@
+from PhotoAlbum import Photo
+from TreeWalker import TreeWalker
+from benchmark import make_photo
+import filecmp
+import os
+import random
+import time
+import pytest
+
+# A rescan with the scan index against a fresh scan of the same albums, after a
+# change that leaves the directory's mtime alone.
+when = 1262304000
+
+@pytest.fixture
+def albums(tmp_path):
+    path = tmp_path / "albums"
+    rng = random.Random(3)
+    for directory in ("", "trip"):
+        (path / directory).mkdir(parents=True, exist_ok=True)
+        for i in range(3):
+            make_photo(str(path / directory / ("IMG_%d.jpg" % i)), (320, 240), 1, when + i, rng)
+    return path
+
+def scan(albums, cache):
+    cache.mkdir(exist_ok=True)
+    TreeWalker(str(albums), str(cache), index=True)
+
+def cache_files(cache):
+    # Everything but the scan's own state (the index, the lock and the like).
+    return sorted(os.path.relpath(os.path.join(root, name), str(cache))
+                  for root, dirs, files in os.walk(str(cache)) for name in files if not name.startswith("."))
+
+def assert_same_cache(cache, fresh):
+    names = cache_files(fresh)
+    assert cache_files(cache) == names
+    match, mismatch, errors = filecmp.cmpfiles(str(cache), str(fresh), names, shallow=False)
+    assert mismatch == [] and errors == []
+
+def test_index_rescan_sees_photo_rewritten_in_place(tmp_path, albums):
+    cache = tmp_path / "cache"
+    scan(albums, cache)
+    directory = albums / "trip"
+    held = os.stat(str(directory))
+    path = str(directory / "IMG_1.jpg")
+    inode = os.stat(path).st_ino
+    # Dated after the thumbnails, as an edit would be; an older date keeps them in any mode.
+    make_photo(path, (240, 320), 6, int(time.time()) + 2, random.Random(4))
+    os.utime(str(directory), ns=(held.st_atime_ns, held.st_mtime_ns))
+    assert os.stat(path).st_ino == inode
+    scan(albums, cache)
+    fresh = tmp_path / "fresh"
+    scan(albums, fresh)
+    assert_same_cache(cache, fresh)
+
+def test_index_rescan_rebuilds_missing_thumbnails(tmp_path, albums):
+    cache = tmp_path / "cache"
+    scan(albums, cache)
+    thumbs = sorted(cache.glob("trip/img_2.jpg_*"))
+    assert len(thumbs) == len(Photo.thumb_sizes) * len(Photo.thumb_formats)
+    thumbs[0].unlink()
+    scan(albums, cache)
+    assert thumbs[0].exists()
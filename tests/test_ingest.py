@@ -0,0 +1,117 @@
+from CachePath import file_hash
+from Ingest import ingest, ingest_batch
+from TreeWalker import TreeWalker
+from PhotoAlbum import Photo, read_album_json
+from benchmark import make_photo
+import Ingest
+import PhotoList
+import json
+import os
+import random
+import time
+import pytest
+
+# Ingesting a photo over one the index already has, with content-addressed
+# thumbnails: scans take the ingested photo as current, so ingest itself must
+# drop the thumbnails of what it replaced.
+when = 1262304000
+
+@pytest.fixture
+def content_addressed():
+    saved = Photo.content_addressed
+    Photo.content_addressed = True
+    yield
+    Photo.content_addressed = saved
+
+def objects(cache, digest):
+    return sorted(cache.glob("objects/%s/%s_*" % (digest[:2], digest)))
+
+def test_ingest_removes_replaced_objects(tmp_path, content_addressed):
+    albums = tmp_path / "albums"
+    albums.mkdir()
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    rng = random.Random(5)
+    for i in range(2):
+        make_photo(str(albums / ("IMG_%d.jpg" % i)), (320, 240), 1, when + i, rng)
+    TreeWalker(str(albums), str(cache), index=True)
+    path = str(albums / "IMG_1.jpg")
+    old = file_hash(path)
+    assert len(objects(cache, old)) == len(Photo.thumb_sizes) * len(Photo.thumb_formats)
+
+    make_photo(path, (240, 320), 6, int(time.time()) + 2, random.Random(6))
+    new = file_hash(path)
+    ingest(path, str(albums), str(cache))
+    assert objects(cache, old) == []
+    assert len(objects(cache, new)) == len(Photo.thumb_sizes) * len(Photo.thumb_formats)
+
+    TreeWalker(str(albums), str(cache), index=True, incremental=True)
+    assert objects(cache, old) == []
+
+def test_ingest_keeps_objects_still_shared(tmp_path, content_addressed):
+    albums = tmp_path / "albums"
+    albums.mkdir()
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    make_photo(str(albums / "IMG_0.jpg"), (320, 240), 1, when, random.Random(5))
+    (albums / "IMG_1.jpg").write_bytes((albums / "IMG_0.jpg").read_bytes())
+    TreeWalker(str(albums), str(cache), index=True)
+    path = str(albums / "IMG_1.jpg")
+    old = file_hash(path)
+
+    make_photo(path, (240, 320), 6, int(time.time()) + 2, random.Random(6))
+    ingest(path, str(albums), str(cache))
+    assert len(objects(cache, old)) == len(Photo.thumb_sizes) * len(Photo.thumb_formats)
+
+# A batch writes each album it changes and the photo lists once, and ends up
+# listing what a fresh scan would.
+def test_ingest_batch_writes_each_list_once(tmp_path, monkeypatch):
+    albums = tmp_path / "albums"
+    (albums / "trip").mkdir(parents=True)
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    rng = random.Random(8)
+    make_photo(str(albums / "IMG_0.jpg"), (320, 240), 1, when, rng)
+    make_photo(str(albums / "trip" / "IMG_0.jpg"), (320, 240), 1, when + 86400 * 40, rng)
+    TreeWalker(str(albums), str(cache), index=True)
+
+    # New photos in a known album and in a new one below it, and one replaced
+    # with a photo from another month.
+    (albums / "trip" / "day").mkdir()
+    paths = [str(albums / "trip" / "IMG_1.jpg"), str(albums / "trip" / "day" / "IMG_0.jpg"),
+             str(albums / "trip" / "day" / "IMG_1.jpg"), str(albums / "IMG_0.jpg")]
+    for i, path in enumerate(paths):
+        make_photo(path, (240, 320), 6, when + 86400 * 70 * (i + 1), rng)
+    (albums / "trip" / "bad.jpg").write_bytes(b"not a photo")
+    closed = []
+    monkeypatch.setattr(PhotoList.JSONListWriter, "close", counted(PhotoList.JSONListWriter.close, closed))
+    written = []
+    monkeypatch.setattr(Ingest, "write_album_json", counted(Ingest.write_album_json, written))
+    done = []
+    photos, failed = ingest_batch(paths + [str(albums / "trip" / "bad.jpg")], str(albums), str(cache), done.append)
+    assert len(photos) == 4
+    assert failed == [str(albums / "trip" / "bad.jpg")]
+    assert done == [1, 2, 3, 4, 5]
+    assert len(closed) == 1
+    assert len(written) == 3
+    monkeypatch.undo()
+
+    (albums / "trip" / "bad.jpg").unlink()
+    fresh = tmp_path / "fresh"
+    fresh.mkdir()
+    TreeWalker(str(albums), str(fresh), index=True)
+    for name in ["all_photos.json"] + sorted(os.path.relpath(str(path), str(fresh)) for path in fresh.glob("all_photos.d/*.json")):
+        assert json.loads((cache / name).read_text()) == json.loads((fresh / name).read_text()), name
+    assert sorted(path.name for path in cache.glob("all_photos.d/*")) == sorted(path.name for path in fresh.glob("all_photos.d/*"))
+    for album in ("root", "trip", "trip-day"):
+        ingested = read_album_json(str(cache / (album + ".json")))
+        scanned = read_album_json(str(fresh / (album + ".json")))
+        assert ingested["date"] == scanned["date"]
+        assert [photo["name"] for photo in ingested["photos"]] == [photo["name"] for photo in scanned["photos"]]
+        assert ingested["albums"] == scanned["albums"]
+
+def counted(function, calls):
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        return function(*args, **kwargs)
+    return wrapper
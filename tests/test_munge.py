@@ -0,0 +1,45 @@
+from CachePath import munge, cache_base, json_cache, set_cache_path_base
+import random
+import pytest
+
+# cache_base as it was before munge: one str.replace per character, then
+# loops squeezing the runs. The web page's PhotoFloat.cachePath follows it too.
+def old_chain(path, withoutslash=True):
+    if withoutslash:
+        path = path.replace('/', '-')
+    path = path.replace(' ', '_').replace('(', '').replace('&', '').replace(',', '').replace(')', '').replace('#', '').replace('[', '').replace(']', '').replace('"', '').replace("'", '').replace('_-_', '-').lower()
+    while path.find("--") != -1:
+        path = path.replace("--", "-")
+    while path.find("__") != -1:
+        path = path.replace("__", "_")
+    if len(path) == 0:
+        path = "root"
+    return path
+
+# Weighted towards what munge changes, with some of Unicode's odder cases: İ
+# lower-cases to two characters, and ẞ and Σ have special rules of their own.
+alphabet = "aBcDeFxYz019/ -_. ()&,#[]\"'" + "éÉßẞİΣσςÅøŒ日本語🙂́ \t"
+
+def random_path(rng):
+    return "".join(rng.choice(alphabet) for i in range(rng.randint(0, 40)))
+
+@pytest.mark.parametrize("withoutslash", [True, False])
+def test_munge_matches_old_chain(withoutslash):
+    rng = random.Random(19)
+    for i in range(20000):
+        path = random_path(rng)
+        assert munge(path, withoutslash) == old_chain(path, withoutslash), repr(path)
+
+@pytest.mark.parametrize("path", ["", "/", "Foo Bar", "a - b", "a_-_-_b", "2010/Trip (Rome) & Co", "__--__", "'\"'", "ÉTÉ/Noël"])
+def test_munge_matches_old_chain_on_edges(path):
+    assert munge(path) == old_chain(path)
+    assert munge(path, False) == old_chain(path, False)
+
+def test_cache_base_trims_then_munges():
+    set_cache_path_base("/srv/Albums")
+    rng = random.Random(20)
+    for i in range(2000):
+        path = random_path(rng).lstrip("/")
+        assert cache_base("/srv/Albums/" + path) == old_chain(path), repr(path)
+        assert cache_base("/srv/Albums/" + path, False) == old_chain(path, False), repr(path)
+        assert json_cache("/srv/Albums/" + path) == old_chain(path) + ".json"
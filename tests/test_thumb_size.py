@@ -0,0 +1,45 @@
+from PhotoAlbum import Photo
+from PIL import Image
+import random
+import pytest
+
+# Photo resizes the image as stored and orients the result, where the older
+# pipeline oriented the original and called Image.thumbnail on a copy: the
+# thumbnails should still come out the same.
+orientations = { 1: None, 3: Image.ROTATE_180, 6: Image.ROTATE_270, 8: Image.ROTATE_90 }
+
+def photo(orientation):
+    photo = Photo.__new__(Photo)
+    photo._orientation = orientation
+    return photo
+
+def thumbnail(image, orientation, size):
+    if orientations[orientation] is not None:
+        image = image.transpose(orientations[orientation])
+    image = image.copy()
+    image.thumbnail((size, size), Image.LANCZOS)
+    return image
+
+def sizes():
+    rng = random.Random(7)
+    yield (78, 936), 150
+    for i in range(200):
+        yield (rng.randrange(1, 3000), rng.randrange(1, 3000)), rng.choice([150, 320, 512, 1024])
+
+@pytest.mark.parametrize("orientation", sorted(orientations))
+def test_thumb_size_matches_thumbnail(orientation):
+    for image_size, size in sizes():
+        expected = thumbnail(Image.new("L", image_size), orientation, size).size
+        target = photo(orientation)._thumb_size(image_size, size)
+        oriented = photo(orientation)._oriented(Image.new("L", target or image_size))
+        assert oriented.size == expected, (image_size, size)
+
+def test_resize_matches_thumbnail():
+    # Not a JPEG, so there is no draft decoding and the reducing gap does the work.
+    # Only upright: reducing works from the top left corner, so a rotated result
+    # can differ from thumbnail()'s in the last bits.
+    image = Image.effect_noise((2400, 1100), 64).convert("RGB")
+    for size in (1024, 150):
+        expected = thumbnail(image, 1, size)
+        made = image.resize(photo(1)._thumb_size(image.size, size), Image.LANCZOS, reducing_gap=2.0)
+        assert made.tobytes() == expected.tobytes()
@@ -0,0 +1,70 @@
+import io
+import os
+import tarfile
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("flask_login")
+
+# /upload_batch writes into the album tree, so it is for the admin user only,
+# and a tar archive may only put plain files below the album it names.
+admin = { "username": "admin", "password": "admin-secret" }
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    root = tmp_path_factory.mktemp("floatapp")
+    (root / "albums").mkdir()
+    (root / "cache").mkdir()
+    config = root / "app.cfg"
+    config.write_text("\n".join([
+        "ALBUM_PATH = %r" % str(root / "albums"),
+        "CACHE_PATH = %r" % str(root / "cache"),
+        "ADMIN_USERNAME = %r" % admin["username"],
+        "ADMIN_PASSWORD = %r" % admin["password"],
+        "PHOTO_USERNAME = 'photos'",
+        "PHOTO_PASSWORD = 'photos-secret'",
+        "SECRET_KEY = 'test'",
+    ]) + "\n")
+    os.environ["FLOATAPP_CONFIG"] = str(config)
+    try:
+        from floatapp import app
+    finally:
+        del os.environ["FLOATAPP_CONFIG"]
+    app.testing = True
+    return app.test_client(), root
+
+def tar_of(members):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w") as tar:
+        for name, target in members:
+            info = tarfile.TarInfo(name)
+            if target is None:
+                info.size = 4
+                tar.addfile(info, io.BytesIO(b"JPEG"))
+            else:
+                info.type = tarfile.SYMTYPE
+                info.linkname = target
+                tar.addfile(info)
+    return data.getvalue()
+
+def test_upload_batch_needs_admin(client):
+    client, root = client
+    response = client.post("/upload_batch?album_path=trip", data=tar_of([("a.jpg", None)]),
+                           content_type="application/x-tar")
+    assert response.status_code == 403
+    assert not (root / "albums" / "trip").exists()
+
+def test_upload_batch_refuses_unsafe_tar_members(client):
+    client, root = client
+    members = [("ok.jpg", None), ("/tmp/absolute.jpg", None), ("../escape.jpg", None),
+               ("sub/../../escape.jpg", None), ("link.jpg", "/etc/passwd")]
+    response = client.post("/upload_batch", query_string=dict(admin, album_path="trip"),
+                           data=tar_of(members), content_type="application/x-tar")
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result["msg"] == ["trip/ok.jpg"]
+    assert sorted(result["skipped"]) == sorted(name for name, target in members[1:])
+    written = sorted(os.path.relpath(os.path.join(directory, name), str(root))
+                     for directory, dirs, files in os.walk(str(root)) for name in files)
+    assert [name for name in written if name.startswith("albums")] == [os.path.join("albums", "trip", "ok.jpg")]
+    assert not os.path.lexists(str(root / "albums" / "trip" / "link.jpg"))
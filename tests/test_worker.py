@@ -0,0 +1,51 @@
+from JobQueue import JobQueue, worker_name
+import os
+import signal
+import subprocess
+import sys
+import time
+import pytest
+
+# worker.py -j N keeps N worker processes, replacing any that die, and queues
+# the job a dead one was running again.
+worker = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "scanner", "worker.py")
+
+def children(pid):
+    path = "/proc/%d/task/%d/children" % (pid, pid)
+    if not os.path.exists(path):
+        pytest.skip("needs /proc/PID/task/PID/children")
+    with open(path) as fp:
+        return sorted(int(child) for child in fp.read().split())
+
+def wait_for(condition, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.1)
+    raise AssertionError("timed out")
+
+def test_worker_replaces_dead_process_and_requeues_its_job(tmp_path):
+    albums = tmp_path / "albums"
+    albums.mkdir()
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    queue = JobQueue(str(cache))
+    process = subprocess.Popen([sys.executable, worker, str(cache), "-j", "2", "-q", "--idle", "0.1"])
+    try:
+        first = wait_for(lambda: len(children(process.pid)) == 2 and children(process.pid))
+        # As if the first worker had claimed the scan just before it was killed.
+        id = queue.enqueue("scan", dict(album_path=str(albums), cache_path=str(cache)))
+        assert queue.claim(worker_name(first[0]))[0] == id
+        os.kill(first[0], signal.SIGKILL)
+        replaced = wait_for(lambda: len(children(process.pid)) == 2 and first[0] not in children(process.pid) and children(process.pid))
+        assert first[1] in replaced
+        wait_for(lambda: [job for job in queue.jobs("scan") if job[1] == "done"])
+    finally:
+        left = children(process.pid)
+        process.kill()
+        process.wait()
+        for child in left:
+            os.kill(child, signal.SIGKILL)
+        queue.close()
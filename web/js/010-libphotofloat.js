@@ -2,6 +2,7 @@
 	/* constructor */
 	function PhotoFloat() {
 		this.albumCache = [];
+		this.enums = null;
 	}
 	
 	/* public member functions */
@@ -25,13 +26,90 @@
 			dataType: "json",
 			url: "cache/" + cacheKey + ".json",
 			success: function(album) {
-				var i;
-				for (i = 0; i < album.albums.length; ++i)
-					album.albums[i].parent = album;
-				for (i = 0; i < album.photos.length; ++i)
-					album.photos[i].parent = album;
-				self.albumCache[cacheKey] = album;
-				callback(album);
+				var ready = function(album) {
+					var i;
+					if (typeof album.pages !== "undefined")
+						PhotoFloat.pageAlbum(album, cacheKey);
+					for (i = 0; i < album.albums.length; ++i)
+						album.albums[i].parent = album;
+					for (i = 0; i < album.photos.length; ++i)
+						album.photos[i].parent = album;
+					self.albumCache[cacheKey] = album;
+					callback(album);
+				};
+				if (album.version === 2)
+					self.albumEnums(function(enums) {
+						ready(PhotoFloat.expandAlbum(album, enums));
+					}, error);
+				else
+					ready(album);
+			}
+		};
+		if (typeof error !== "undefined" && error !== null) {
+			ajaxOptions.error = function(jqXHR, textStatus, errorThrown) {
+				error(jqXHR.status);
+			};
+		}
+		$.ajax(ajaxOptions);
+	};
+	PhotoFloat.prototype.albumPage = function(album, page, callback, error) {
+		/* fills in the photos of one page of a paged album, unless they already are */
+		var ajaxOptions, self;
+		if (typeof album.pages === "undefined" || album.loadedPages[page]) {
+			callback(album);
+			return;
+		}
+		if (album.pageRequests[page]) {
+			album.pageRequests[page].push(callback);
+			return;
+		}
+		album.pageRequests[page] = [callback];
+		self = this;
+		ajaxOptions = {
+			type: "GET",
+			dataType: "json",
+			url: "cache/" + album.cacheKey + ".page" + page + ".json",
+			success: function(items) {
+				var ready = function(items) {
+					var i, callbacks;
+					for (i = 0; i < items.photos.length; ++i)
+						$.extend(album.stubs[page * album.pageSize + i], items.photos[i]);
+					album.loadedPages[page] = true;
+					callbacks = album.pageRequests[page];
+					album.pageRequests[page] = null;
+					for (i = 0; i < callbacks.length; ++i)
+						callbacks[i](album);
+				};
+				if (items.version === 2)
+					self.albumEnums(function(enums) {
+						ready(PhotoFloat.expandAlbum(items, enums));
+					}, error);
+				else
+					ready(items);
+			}
+		};
+		ajaxOptions.error = function(jqXHR, textStatus, errorThrown) {
+			album.pageRequests[page] = null;
+			if (typeof error !== "undefined" && error !== null)
+				error(jqXHR.status);
+		};
+		$.ajax(ajaxOptions);
+	};
+	PhotoFloat.prototype.albumEnums = function(callback, error) {
+		/* the EXIF value tables compact (version 2) albums index into, fetched once */
+		var ajaxOptions, self;
+		if (this.enums !== null) {
+			callback(this.enums);
+			return;
+		}
+		self = this;
+		ajaxOptions = {
+			type: "GET",
+			dataType: "json",
+			url: "cache/album_schema.json",
+			success: function(schema) {
+				self.enums = schema.enums;
+				callback(self.enums);
 			}
 		};
 		if (typeof error !== "undefined" && error !== null) {
@@ -50,7 +128,9 @@
 				index -= album.photos.length;
 				self.album(album.albums[index], nextAlbum, error);
 			} else
-				callback(album, album.photos[index]);
+				self.albumPage(album, album.photos[index].page, function() {
+					callback(album, album.photos[index]);
+				}, error);
 		};
 		if (typeof subalbum.photos !== "undefined" && subalbum.photos !== null)
 			nextAlbum(subalbum);
@@ -58,7 +138,8 @@
 			this.album(subalbum, nextAlbum, error);
 	};
 	PhotoFloat.prototype.parseHash = function(hash, callback, error) {
-		var index, album, photo;
+		var index, album, photo, self;
+		self = this;
 		hash = PhotoFloat.cleanHash(hash);
 		index = hash.lastIndexOf("/");
         console.log(hash)
@@ -87,7 +168,12 @@
 					i = -1;
 				}
 			}
-			callback(theAlbum, photo, i);
+			if (photo === null)
+				callback(theAlbum, photo, i);
+			else
+				self.albumPage(theAlbum, photo.page, function() {
+					callback(theAlbum, photo, i);
+				}, error);
 		}, error);
 	};
 	PhotoFloat.prototype.authenticate = function(password, result) {
@@ -142,18 +228,137 @@
 			return PhotoFloat.cachePath(album.path, withoutslash);
 		return PhotoFloat.cachePath(album.parent.path + "/" + album.path, withoutslash);
 	};
-	PhotoFloat.photoPath = function(album, photo, size, square, withoutslash) {
+	PhotoFloat.photoPath = function(album, photo, size, square, withoutslash, format) {
 		var suffix, hash;
         withoutslash = typeof withoutslash !== 'undefined' ? withoutslash : false;
+		format = typeof format !== 'undefined' ? format : "jpg";
 		if (square)
 			suffix = size.toString() + "s";
 		else
 			suffix = size.toString();
-		hash = PhotoFloat.cachePath(PhotoFloat.photoHash(album, photo, withoutslash) + "_" + suffix + ".jpg");
+		/* content-addressed thumbnails, shared by every copy of the photo */
+		if (typeof photo.hash !== "undefined")
+			return "cache/objects/" + photo.hash.substring(0, 2) + "/" + photo.hash + "_" + suffix + "." + format;
+		hash = PhotoFloat.cachePath(PhotoFloat.photoHash(album, photo, withoutslash) + "_" + suffix + "." + format);
 		if (hash.indexOf("root-") === 0 || hash.indexOf("root/") === 0)
 			hash = hash.substring(5);
 		return "cache/" + hash;
 	};
+	PhotoFloat.thumbSizes = function(album, square) {
+		/* largest first, as listed by the scanner; albums from older scans only have these two */
+		var i, sizes = [], thumbs = album.thumbs || { sizes: [[1024, false], [150, true]] };
+		for (i = 0; i < thumbs.sizes.length; ++i)
+			if (thumbs.sizes[i][1] === square)
+				sizes.push(thumbs.sizes[i][0]);
+		return sizes;
+	};
+	PhotoFloat.thumbFormat = function(album) {
+		/* the first listed format the browser decodes, whatever the order; jpg, which
+		   every browser decodes and the scanner is told to keep, only if there is no other */
+		var i;
+		if (typeof album.thumbs === "undefined")
+			return "jpg";
+		for (i = 0; i < album.thumbs.formats.length; ++i)
+			if (album.thumbs.formats[i] !== "jpg" && PhotoFloat.thumbFormat.supported[album.thumbs.formats[i]] === true)
+				return album.thumbs.formats[i];
+		return "jpg";
+	};
+	/* set as the browser decodes (or fails to decode) a 1x1 image of each format;
+	   a format counts as unsupported until its answer is in */
+	PhotoFloat.thumbFormat.supported = {};
+	PhotoFloat.thumbFormat.probes = {
+		webp: "UklGRiQAAABXRUJQVlA4IBgAAAAwAQCdASoBAAEAAsBMJaQAA3AA/veMAAA=",
+		avif: "AAAAIGZ0eXBhdmlmAAAAAGF2aWZtaWYxbWlhZk1BMUIAAADrbWV0YQAAAAAAAAAhaGRscgAAAAAAAAAAcGljdAAAAAAAAAAAAAAAAAAAAAAOcGl0bQAAAAAAAQAAAB5pbG9jAAAAAEQAAAEAAQAAAAEAAAETAAAAIQAAAChpaW5mAAAAAAABAAAAGmluZmUCAAAAAAEAAGF2MDFDb2xvcgAAAABqaXBycAAAAEtpcGNvAAAAFGlzcGUAAAAAAAAAAQAAAAEAAAAQcGl4aQAAAAADCAgIAAAADGF2MUOBAAwAAAAAE2NvbHJuY2x4AAEADQAGgAAAABdpcG1hAAAAAAAAAAEAAQQBAoMEAAAAKW1kYXQSAAoIGAAGiAhoNCAyExlHh4Yhh5555oAAAJBAyRxgimo="
+	};
+	PhotoFloat.thumbFormat.probe = function(format) {
+		var image = new Image();
+		image.onload = function() {
+			PhotoFloat.thumbFormat.supported[format] = image.width === 1;
+		};
+		image.onerror = function() {
+			PhotoFloat.thumbFormat.supported[format] = false;
+		};
+		image.src = "data:image/" + format + ";base64," + PhotoFloat.thumbFormat.probes[format];
+	};
+	PhotoFloat.thumbFormat.probe("webp");
+	PhotoFloat.thumbFormat.probe("avif");
+	PhotoFloat.photoSrcset = function(album, photo, square) {
+		var i, sizes = PhotoFloat.thumbSizes(album, square), format = PhotoFloat.thumbFormat(album), srcset = [];
+		for (i = 0; i < sizes.length; ++i)
+			srcset.push(PhotoFloat.photoPath(album, photo, sizes[i], square, false, format) + " " + sizes[i] + "w");
+		return srcset.join(", ");
+	};
+	PhotoFloat.formatDate = function(seconds) {
+		/* epoch seconds of a UTC-stored date, as the scanner's "%a %b %d %H:%M:%S %Y" */
+		var date, pad;
+		if (typeof seconds !== "number")
+			return seconds;
+		date = new Date(seconds * 1000);
+		pad = function(n) { return n < 10 ? "0" + n : "" + n; };
+		return ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"][date.getUTCDay()] + " " +
+			["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"][date.getUTCMonth()] + " " +
+			pad(date.getUTCDate()) + " " + pad(date.getUTCHours()) + ":" + pad(date.getUTCMinutes()) + ":" +
+			pad(date.getUTCSeconds()) + " " + date.getUTCFullYear();
+	};
+	PhotoFloat.expandRows = function(columns, count, enums) {
+		/* a compact album's columns back into one object per photo or sub-album */
+		var rows, key, i, value, isDate, dates;
+		rows = [];
+		/* a photo's date is usually also its dateTimeOriginal and dateTime */
+		dates = {};
+		for (i = 0; i < count; ++i)
+			rows.push({});
+		for (key in columns) {
+			if (!columns.hasOwnProperty(key))
+				continue;
+			isDate = key === "date" || key.substring(0, 8) === "dateTime";
+			for (i = 0; i < count; ++i) {
+				value = columns[key][i];
+				if (value === null)
+					continue;
+				if (isDate) {
+					if (!dates.hasOwnProperty(value))
+						dates[value] = PhotoFloat.formatDate(value);
+					value = dates[value];
+				}
+				else if (enums.hasOwnProperty(key) && typeof value === "number")
+					value = enums[key][value];
+				rows[i][key] = value;
+			}
+		}
+		return rows;
+	};
+	PhotoFloat.expandAlbum = function(album, enums) {
+		/* also takes the pages and headers of paged albums, which lack some of the keys */
+		if (typeof album.date !== "undefined")
+			album.date = PhotoFloat.formatDate(album.date);
+		if (typeof album.photos !== "undefined") {
+			album.photos = PhotoFloat.expandRows(album.photos, album.photoCount, enums);
+			delete album.photoCount;
+		}
+		if (typeof album.albums !== "undefined") {
+			album.albums = PhotoFloat.expandRows(album.albums, album.albumCount, enums);
+			delete album.albumCount;
+		}
+		delete album.version;
+		return album;
+	};
+	PhotoFloat.pageAlbum = function(album, cacheKey) {
+		/* a paged album's header only names its photos: they start out as stubs that
+		 * albumPage fills in, a page at a time */
+		var i;
+		album.cacheKey = cacheKey;
+		album.stubs = [];
+		for (i = 0; i < album.names.length; ++i)
+			album.stubs.push({ name: album.names[i], parent: album, page: Math.floor(i / album.pageSize) });
+		album.photos = album.stubs.slice();
+		album.loadedPages = [];
+		album.pageRequests = [];
+		delete album.names;
+	};
+	PhotoFloat.photoLoaded = function(photo) {
+		return typeof photo.parent.pages === "undefined" || photo.parent.loadedPages[photo.page] === true;
+	};
 	PhotoFloat.originalPhotoPath = function(album, photo) {
 		return "albums/" + album.path + "/" + photo.name;
 	};
@@ -186,6 +391,12 @@
 	PhotoFloat.prototype.photoHash = PhotoFloat.photoHash;
 	PhotoFloat.prototype.albumHash = PhotoFloat.albumHash;
 	PhotoFloat.prototype.photoPath = PhotoFloat.photoPath;
+	PhotoFloat.prototype.thumbSizes = PhotoFloat.thumbSizes;
+	PhotoFloat.prototype.thumbFormat = PhotoFloat.thumbFormat;
+	PhotoFloat.prototype.photoSrcset = PhotoFloat.photoSrcset;
+	PhotoFloat.prototype.formatDate = PhotoFloat.formatDate;
+	PhotoFloat.prototype.expandAlbum = PhotoFloat.expandAlbum;
+	PhotoFloat.prototype.photoLoaded = PhotoFloat.photoLoaded;
 	PhotoFloat.prototype.originalPhotoPath = PhotoFloat.originalPhotoPath;
 	PhotoFloat.prototype.trimExtension = PhotoFloat.trimExtension;
 	PhotoFloat.prototype.cleanHash = PhotoFloat.cleanHash;
@@ -29,6 +29,8 @@ $(document).ready(function() {
 	var photoFloat = new PhotoFloat();
 	var maxSize = 1024;
 	var thumbSize = 150;
+	var thumbFormat = "jpg";
+	var pageElements = [];
 	
 	/* Displays */
 	
@@ -89,29 +91,21 @@ $(document).ready(function() {
 		}
 	}
 	function showAlbum(populate) {
-		var i, link, image, photos, thumbsElement, subalbums, subalbumsElement;
+		var i, link, image, thumbsElement, subalbums, subalbumsElement;
 		if (currentPhoto === null && previousPhoto === null)
 			$("html, body").stop().animate({ scrollTop: 0 }, "slow");
 		
 		if (populate) {
-			photos = [];
-			for (i = 0; i < currentAlbum.photos.length; ++i) {
-				link = $("<a href=\"#!/" + photoFloat.photoHash(currentAlbum, currentAlbum.photos[i], true) + "\"></a>");
-				image = $("<img title=\"" + photoFloat.trimExtension(currentAlbum.photos[i].name) + "\" alt=\"" + photoFloat.trimExtension(currentAlbum.photos[i].name) + "\" src=\"" + photoFloat.photoPath(currentAlbum, currentAlbum.photos[i], thumbSize, true) + "\" height=\"" + thumbSize + "\" width=\"" + thumbSize + "\" />");
-				image.get(0).photo = currentAlbum.photos[i];
-				link.append(image);
-				photos.push(link);
-				(function(theLink, theImage, theAlbum) {
-					theImage.error(function() {
-						photos.splice(photos.indexOf(theLink), 1);
-						theLink.remove();
-						theAlbum.photos.splice(theAlbum.photos.indexOf(theImage.get(0).photo), 1);
-					});
-				})(link, image, currentAlbum);
-			}
+			/* the smallest square rung is shown as is, the others serve denser screens */
+			thumbSize = photoFloat.thumbSizes(currentAlbum, true).pop();
+			thumbFormat = photoFloat.thumbFormat(currentAlbum);
+			/* one element per page of a paged album, filled in as its page loads */
+			pageElements = [];
+			for (i = 0; i < (currentAlbum.pages || 1); ++i)
+				pageElements.push($("<span></span>"));
 			thumbsElement = $("#thumbs");
 			thumbsElement.empty();
-			thumbsElement.append.apply(thumbsElement, photos);
+			thumbsElement.append.apply(thumbsElement, pageElements);
 			
 			subalbums = [];
 			for (i = currentAlbum.albums.length - 1; i >= 0; --i) {
@@ -121,7 +115,7 @@ $(document).ready(function() {
 				subalbums.push(link);
 				(function(theContainer, theAlbum, theImage, theLink) {
 					photoFloat.albumPhoto(theAlbum, function(album, photo) {
-						theImage.css("background-image", "url(" + photoFloat.photoPath(album, photo, thumbSize, true) + ")");
+						theImage.css("background-image", "url(" + photoFloat.photoPath(album, photo, photoFloat.thumbSizes(album, true).pop(), true, false, photoFloat.thumbFormat(album)) + ")");
 					}, function error() {
 						theContainer.albums.splice(currentAlbum.albums.indexOf(theAlbum), 1);
 						theLink.remove();
@@ -140,6 +134,8 @@ $(document).ready(function() {
 				thumbsElement.insertBefore(subalbumsElement);
 		}
 		
+		showPages();
+		
 		if (currentPhoto === null) {
 			$("#thumbs img").removeClass("current-thumb");
 			$("#album-view").removeClass("photo-view-container");
@@ -148,6 +144,52 @@ $(document).ready(function() {
 		}
 		setTimeout(scrollToThumb, 1);
 	}
+	function showPages() {
+		/* thumbnails for the pages loaded since the album was shown */
+		var i, page, link, image, photos;
+		for (page = 0; page < pageElements.length; ++page) {
+			if (pageElements[page].data("shown") || (currentAlbum.pages && !currentAlbum.loadedPages[page]))
+				continue;
+			photos = [];
+			for (i = 0; i < currentAlbum.photos.length; ++i) {
+				if (currentAlbum.pages && currentAlbum.photos[i].page !== page)
+					continue;
+				link = $("<a href=\"#!/" + photoFloat.photoHash(currentAlbum, currentAlbum.photos[i], true) + "\"></a>");
+				image = $("<img title=\"" + photoFloat.trimExtension(currentAlbum.photos[i].name) + "\" alt=\"" + photoFloat.trimExtension(currentAlbum.photos[i].name) + "\" src=\"" + photoFloat.photoPath(currentAlbum, currentAlbum.photos[i], thumbSize, true, false, thumbFormat) + "\" srcset=\"" + photoFloat.photoSrcset(currentAlbum, currentAlbum.photos[i], true) + "\" sizes=\"" + thumbSize + "px\" height=\"" + thumbSize + "\" width=\"" + thumbSize + "\" />");
+				image.get(0).photo = currentAlbum.photos[i];
+				link.append(image);
+				photos.push(link);
+				(function(theLink, theImage, theAlbum) {
+					theImage.error(function() {
+						theLink.remove();
+						theAlbum.photos.splice(theAlbum.photos.indexOf(theImage.get(0).photo), 1);
+					});
+				})(link, image, currentAlbum);
+			}
+			pageElements[page].data("shown", true);
+			pageElements[page].append.apply(pageElements[page], photos);
+		}
+		loadPages();
+	}
+	function loadPages() {
+		/* loads the pages of a paged album whose (empty) elements are within a screen of being seen */
+		var page, near, theAlbum = currentAlbum;
+		if (!currentAlbum.pages)
+			return;
+		for (page = 0; page < pageElements.length; ++page) {
+			if (currentAlbum.loadedPages[page] || currentAlbum.pageRequests[page])
+				continue;
+			if (currentPhoto === null)
+				near = pageElements[page].offset().top < $(window).scrollTop() + 2 * $(window).height();
+			else
+				near = pageElements[page].position().left < 2 * $("#album-view").width();
+			if (near)
+				photoFloat.albumPage(currentAlbum, page, function() {
+					if (theAlbum === currentAlbum)
+						showPages();
+				}, die);
+		}
+	}
 	function getDecimal(fraction) {
 		if (fraction[0] < fraction[1])
 			return fraction[0] + "/" + fraction[1];
@@ -164,9 +206,20 @@ $(document).ready(function() {
 		else if (image.css("height") !== "100%")
 			image.css("height", "100%").css("width", "auto").css("position", "").css("bottom", "");
 	}
+	function fitSize() {
+		/* smallest plain rung that covers the screen, so src and the preloads match what srcset picks */
+		var i, sizes = photoFloat.thumbSizes(currentAlbum, false);
+		var needed = Math.max($(window).width(), $(window).height()) * (window.devicePixelRatio || 1);
+		thumbFormat = photoFloat.thumbFormat(currentAlbum);
+		for (i = sizes.length - 1; i > 0; --i)
+			if (sizes[i] >= needed)
+				return sizes[i];
+		return sizes[0];
+	}
 	function showPhoto() {
 		var width, height, photoSrc, previousPhoto, nextPhoto, nextLink, text;
         console.log('should show photo')
+		maxSize = fitSize();
 		width = currentPhoto.size[0];
 		height = currentPhoto.size[1];
 		if (width > height) {
@@ -177,10 +230,12 @@ $(document).ready(function() {
 			height = maxSize;
 		}
 		$(window).unbind("resize", scaleImage);
-		photoSrc = photoFloat.photoPath(currentAlbum, currentPhoto, maxSize, false);
+		photoSrc = photoFloat.photoPath(currentAlbum, currentPhoto, maxSize, false, false, thumbFormat);
 		$("#photo")
 			.attr("width", width).attr("height", height)//.attr("ratio", currentPhoto.size[0] / currentPhoto.size[1])
 			.attr("src", photoSrc)
+			.attr("srcset", photoFloat.photoSrcset(currentAlbum, currentPhoto, false))
+			.attr("sizes", "100vw")
 			.attr("alt", currentPhoto.name)
 			.attr("title", currentPhoto.date)
 			.data("rotate", 0)
@@ -202,7 +257,11 @@ $(document).ready(function() {
 		nextPhoto = currentAlbum.photos[
 			(currentPhotoIndex + 1 >= currentAlbum.photos.length) ? 0 : (currentPhotoIndex + 1)
 		];
-		$.preloadImages(photoFloat.photoPath(currentAlbum, nextPhoto, maxSize, false), photoFloat.photoPath(currentAlbum, previousPhoto, maxSize, false ));
+		/* neighbours on pages not loaded yet are loaded when they are shown */
+		if (photoFloat.photoLoaded(nextPhoto))
+			$.preloadImages(photoFloat.photoPath(currentAlbum, nextPhoto, maxSize, false, false, thumbFormat));
+		if (photoFloat.photoLoaded(previousPhoto))
+			$.preloadImages(photoFloat.photoPath(currentAlbum, previousPhoto, maxSize, false, false, thumbFormat));
 		
 		nextLink = "#!/" + photoFloat.photoHash(currentAlbum, nextPhoto, true);
 		$("#next-photo").attr("href", nextLink);
@@ -275,6 +334,14 @@ $(document).ready(function() {
 	
 	/* Event listeners */
 	
+	$(window).scroll(function() {
+		if (currentAlbum !== null)
+			loadPages();
+	});
+	$("#album-view").scroll(function() {
+		if (currentAlbum !== null)
+			loadPages();
+	});
 	$(window).hashchange(function() {
 		$("#loading").show();
 		$("link[rel=image_src]").remove();